@@ -1,5 +1,9 @@
+import itertools
 import os
 import shutil
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 
 import pandas as pd
 import numpy as np
@@ -17,13 +21,23 @@ from sklearn.decomposition import FastICA
 
 from lib_graph.calculate_peak_alpha import calculate_peak_alpha_simple, calculate_peak_alpha_welch, \
     calculate_peak_alpha_window, calculate_periods_peak_alpha_simple, calculate_periods_peak_alpha_welch, \
-    calculate_periods_peak_alpha_window
-from lib_graph.func_eeg_data import remove_non_connected_electrode_parts, add_average_to_data
-
-from lib_graph.func_signal_quality import identify_bad_electrodes, signal_quality_statistics
+    calculate_periods_peak_alpha_window, calculate_periods_peak_alpha_pyramid, calculate_peak_alpha_trajectory, aggregate_peak_alpha_trajectory, \
+    peak_alpha_trajectory_to_json
+from lib_graph.artifact_cache import ArtifactCache, artifact_key, code_version
+from lib_graph.build_manifest import PIPELINE_VERSION, input_fingerprint, is_up_to_date, session_manifest, write_manifest
+from lib_graph.catalog import scan_catalog, viable_recordings
+from lib_graph.derived_signals import DerivedSignals
+from lib_graph.func_eeg_data import remove_non_connected_electrode_parts, add_average_to_data, connected_segments, \
+    decimate_eeg_data
+
+from lib_graph.func_filters import filter_bank
+from lib_graph.func_spectral import BANDS, PsdPyramid, band_power_periods, band_power_series, fft_resolution, save_band_power_series, \
+    set_fft_workers
+from lib_graph.func_signal_quality import signal_quality_statistics, signal_quality_summary
 from lib_graph.html_templates import generate_detail_html_file, generate_index_file
-from lib_graph.load_eeg_data import load_data
-from lib_graph.load_signal_quality_data import load_signal_quality
+from lib_graph.instrumentation import TIMINGS_FILE, Timings, write_run_timings
+from lib_graph.load_recording import MuseRecording
+from lib_graph.pipeline import Pipeline
 from lib_graph.plot_amplitude_distribution_histogram_1 import plot_amplitude_distribution_histogram_1
 from lib_graph.plot_frequency_domain_1 import plot_frequency_domain_1
 from lib_graph.plot_powerbands import plot_powerbands_1
@@ -31,6 +45,8 @@ from lib_graph.plot_powerbands_hilbert_envelope_1 import plot_powerbands_hilbert
 from lib_graph.plot_powerbands_hilbert_envelope_moveing_average_1 import plot_powerbands_hilbert_envelope_moveing_average_1
 from lib_graph.plot_psd__power_spectral_density_1 import plot_psd__power_spectral_density_1
 from lib_graph.plot_time_frequency_analysis_1 import plot_time_frequency_analysis_1
+from lib_graph.sample_cache import SampleCache
+from lib_graph.spectral_cache import SpectralCache
 from lib_graph.save_json import save_dict_to_json_pretty
 from lib_graph.util import generate_img_thumbnail
 
@@ -96,80 +112,434 @@ def file_list(folder):
 
 
 
-def generate_img_report_for(file='tho_eeglab_2024.09.04_22.02.zip', cache_dir_base='cache', data_dir='out_eeg'):
+# analysis parameters of the reports that are not arguments of generate_img_report_for, all of them together with the
+# arguments go into the build manifest of a session (see build_manifest)
+REPORT_PARAMETERS = {
+    'nperseg': 1024,  # resolution of .25hz
+    'periode_length': 300,
+    'signal_quality_from': 65,
+    'signal_quality_until': 220,
+    'bad_electrode_threshold': 90,
+    'max_bad_electrodes': 3
+}
+
+
+# the code that loads and prepares the data of a session, a change rebuilds every artifact of the sessions (it is the
+# code of the session key)
+SESSION_CODE = (MuseRecording, SampleCache, signal_quality_summary, signal_quality_statistics,
+                remove_non_connected_electrode_parts, add_average_to_data, connected_segments, decimate_eeg_data,
+                SpectralCache, DerivedSignals)
+
+# the code of the plots and statistics of a report, a change rebuilds the sessions, where only the artifacts of the
+# changed code are built again (see ArtifactCache), the data of a session is only loaded if one of them is missing.
+# The lib_graph modules they use are hashed with them (see code_version).
+REPORT_PLOTS = (plot_frequency_domain_1, plot_psd__power_spectral_density_1, plot_time_frequency_analysis_1,
+                plot_amplitude_distribution_histogram_1, plot_powerbands_1, plot_powerbands_hilbert_envelope_1,
+                plot_powerbands_hilbert_envelope_moveing_average_1)
+REPORT_CODE = REPORT_PLOTS + (
+    generate_img_thumbnail, band_power_series, save_band_power_series, calculate_peak_alpha_simple,
+    calculate_periods_peak_alpha_simple, calculate_peak_alpha_welch, calculate_periods_peak_alpha_welch,
+    calculate_peak_alpha_window, calculate_periods_peak_alpha_window, calculate_peak_alpha_trajectory,
+    aggregate_peak_alpha_trajectory, peak_alpha_trajectory_to_json, calculate_periods_peak_alpha_pyramid, PsdPyramid,
+    band_power_periods, filter_bank)
+
+
+def manifest_parameters(report_settings):
+    """
+    Returns:
+    - parameters: dict, the parameters of the build manifest of a session, report_settings, REPORT_PARAMETERS and
+      the version of the code of the session and the report.
+    """
+    return dict(report_settings, code=code_version(generate_img_report_for, session_pipeline, *SESSION_CODE, *REPORT_CODE), **REPORT_PARAMETERS)
+
+
+def session_settings(load_from, load_until, fast_fft, periode_lengths, analysis_rate):
+    """
+    Returns:
+    - settings: dict, every parameter of a session report, for the build manifest and the artifact keys.
+    """
+    return dict({'load_from': load_from, 'load_until': load_until, 'fast_fft': fast_fft, 'periode_lengths': periode_lengths,
+                 'analysis_rate': analysis_rate, 'pipeline_version': PIPELINE_VERSION}, **REPORT_PARAMETERS)
+
+
+def session_pipeline(file='tho_eeglab_2024.09.04_22.02.zip', cache_dir_base='cache', data_dir='out_eeg', load_from=300, load_until=1600, fast_fft=False, periode_lengths=(60, 300, 600), analysis_rate=None):
+    """
+    The stages of the report of one session as a Pipeline, from the recording to the plots and statistics.json.
+    A subset of the values can be requested, only their stages run, e.g.
+
+        session_pipeline(file).run(['peak_alpha_welch'])
+
+    The plots and files are written to {cache_dir_base}/{base name of file}, every plot stage is named like its
+    plot function and returns the artifact key of its png. The 'report' stage writes statistics.json and returns the
+    statistics, after all files of the report are written.
+
+    Every plot, file and statistics block is an artifact with its own key (the stage f'{name}_key'), from the session
+    key, its settings and its code. The artifacts that are cached are linked before anything else runs, the EEG data
+    is only loaded and prepared if an artifact has to be built.
+
+    Returns:
+    - pipeline: Pipeline.
+    """
+    cache_dir = f'{cache_dir_base}/{os.path.splitext(file)[0]}'
+    sample_rate = 256  # Hz
+    # nperseg = 256   # resolution of 1hz
+    nperseg = REPORT_PARAMETERS['nperseg']  # 1024: resolution of .25hz
+    # nperseg = 2560  # resolution of 0.1hz - not so good, because the function assumes a stationary over this timeframe.. 10s seems too long, mostly its 1s, 4s seems to be okayisch
+    periode_length = REPORT_PARAMETERS['periode_length']
+
+    # every artifact is keyed by the session data, its own settings and its code, unchanged artifacts are linked
+    # from {cache_dir_base}/_artifacts instead of being built again (the spectra are only computed on demand)
+    artifacts = ArtifactCache(f'{cache_dir_base}/_artifacts')
+    # decoded samples are kept in {cache_dir_base}/_samples, so opening the zip a second time is cheap
+    sample_cache = SampleCache(f'{cache_dir_base}/_samples')
+
+    pipeline = Pipeline()
+
+    # the signal quality decides about the bad electrodes and the channels of the report, it is needed for the
+    # artifact keys, the EEG data only for the artifacts that are built
+    def load_signal_quality():
+        with MuseRecording(f'{data_dir}/{file}', cache=sample_cache) as recording: #, col_separator='\t')
+            signal_quality_data = recording.read_signal_quality(load_from=REPORT_PARAMETERS['signal_quality_from'], load_until=REPORT_PARAMETERS['signal_quality_until'])
+        print('signal quality loaded')
+        return signal_quality_data
+    pipeline.add('load_signal_quality', load_signal_quality, outputs='signal_quality_data')
+
+    def load_eeg():
+        with MuseRecording(f'{data_dir}/{file}', cache=sample_cache) as recording: #, col_separator='\t')
+            #todo: warning if eeg_data is empty (file shorter than load_from)
+            eeg_data = recording.read_eeg(load_from=load_from, load_until=load_until)
+        print('eeg loaded')
+        return eeg_data
+    pipeline.add('load_eeg', load_eeg, outputs='eeg_data')
+
+    # Identify bad electrodes, the statistics of all electrodes come from the same pass
+    pipeline.add('signal_quality_summary', lambda signal_quality_data: signal_quality_summary(signal_quality_data, REPORT_PARAMETERS['bad_electrode_threshold']),
+                 ['signal_quality_data'], ('signal_quality_summary_all', 'bad_electrodes'))
+    pipeline.add('signal_quality_statistics', lambda signal_quality_data, bad_electrodes, summary: signal_quality_statistics(signal_quality_data, bad_electrodes, summary=summary),
+                 ['signal_quality_data', 'bad_electrodes', 'signal_quality_summary_all'], ('statis_good_el', 'statis_bad_el'))
+
+    pipeline.add('truncate', remove_non_connected_electrode_parts, ['eeg_data', 'signal_quality_data', 'bad_electrodes'],
+                 ('eeg_data_trunc', 'signal_quality_data_trunc'))
+
+    def add_average(eeg_data_trunc, bad_electrodes):
+        # add electrode average, in place, eeg_data_trunc has no other reader
+        add_average_to_data(eeg_data_trunc, bad_electrodes)
+        return eeg_data_trunc
+    pipeline.add('average', add_average, ['eeg_data_trunc', 'bad_electrodes'], 'eeg_data_average')
+
+    def segments(signal_quality_data_trunc, bad_electrodes):
+        # connected parts inside the truncated data, spectra and filters are computed per segment instead of across the gaps
+        combined = connected_segments(signal_quality_data_trunc, bad_electrodes, min_length=nperseg)['combined']
+        return combined if len(combined) else None
+    pipeline.add('segments', segments, ['signal_quality_data_trunc', 'bad_electrodes'])
+
+    # the rate and the nperseg of the spectral analyses are settings of the artifacts, known without the data.
+    # nperseg keeps its resolution in Hz.
+    rate = sample_rate if analysis_rate is None else analysis_rate
+    pipeline.add('analysis_rate', lambda: rate)
+    pipeline.add('analysis_nperseg', lambda: nperseg * rate // sample_rate)
+
+    def analysis(eeg_data_average, segments):
+        # the spectral analyses optionally run on a decimated copy (analysis_rate, e.g. 128 Hz, they only look at 0.5-45 Hz),
+        # eeg_data_average keeps the full rate
+        analysis_data, _, analysis_segments = decimate_eeg_data(eeg_data_average, sample_rate, analysis_rate, segments)
+        return analysis_data, analysis_segments
+    pipeline.add('analysis', analysis, ['eeg_data_average', 'segments'], ('analysis_data', 'analysis_segments'))
+
+    # every spectrum of the session is computed once and shared by the plots and statistics
+    # fast_fft zero pads the FFTs to a fast length, the bins then move slightly (see fft_resolution in statistics.json)
+    pipeline.add('spectra', lambda data, rate, segments: SpectralCache(data, rate, segments, fast_length=fast_fft),
+                 ['analysis_data', 'analysis_rate', 'analysis_segments'])
+    # the same for the band filtered signals and their envelopes
+    pipeline.add('derived', DerivedSignals, ['analysis_data', 'analysis_rate', 'analysis_segments'])
+    # the good electrodes and the average, transformed together in the batched spectrogram and filter bank
+    pipeline.add('session_channels', lambda bad_electrodes: [channel for channel in ['tp9', 'af7', 'af8', 'tp10'] if channel not in bad_electrodes] + ['electrodes_average'],
+                 ['bad_electrodes'])
+
+    #### eeg_data_filterd = filter_eeg_data(eeg_data_trunc, sample_rate=sample_rate, ignored_electrodes=ignored_electrodes)
+
+    # the recording, the settings and the code that prepares the data, every artifact key builds on it. The wiring of
+    # the report is not part of it, every artifact key has the code of its own stage.
+    pipeline.add('session_key', lambda: artifact_key(input_fingerprint(f'{data_dir}/{file}'), list(SESSION_CODE), session_settings(load_from, load_until, fast_fft, periode_lengths, analysis_rate)))
+    def report_dir():
+        mk_dir(cache_dir)
+        return cache_dir
+    pipeline.add('report_dir', report_dir)
+
+    def add_artifact(name, code, build, inputs=(), settings=None, constants=None, filename=None, upstream='session_key', exclusive=False):
+        # the stage name provides an artifact of the ArtifactCache, the stage f'{name}_key' its key from the upstream
+        # key, code, the code of build, the names of inputs, settings (keyword -> name of a value in the pipeline) and
+        # constants. build is called with the values of inputs and returns the value of the artifact, with a filename
+        # it writes {report_dir}/{filename} (report_dir is its first argument) and the stage returns the key.
+        settings = settings or {}
+        code = [*code, build.__code__] if isinstance(code, (list, tuple)) else [code, build.__code__]
+        def key(upstream_key, *values):
+            return artifact_key(upstream_key, code, dict(zip(settings, values), inputs=list(inputs), **(constants or {})))
+        pipeline.add(f'{name}_key', key, [upstream, *settings.values()])
+
+        if filename is None:
+            pipeline.add(name, lambda key, *values: artifacts.value(key, lambda: build(*values)), [f'{name}_key', *inputs],
+                         lookup=artifacts.lookup, lookup_inputs=[f'{name}_key'])
+            return
+
+        def build_file(key, report_dir, *values):
+            artifacts.file(key, f'{report_dir}/{filename}', lambda: build(report_dir, *values))
+            return key
+        def link_file(key, report_dir):
+            return key if artifacts.link(key, f'{report_dir}/{filename}') else None
+        pipeline.add(name, build_file, [f'{name}_key', 'report_dir', *inputs], exclusive=exclusive,
+                     lookup=link_file, lookup_inputs=[f'{name}_key', 'report_dir'])
+
+    def add_plot(plot_function, data, **inputs):
+        # inputs: keyword argument of plot_function -> name of its value in the pipeline
+        # the shared spectra and derived signals are part of the session data, not of the plot settings
+        settings = {argument: name for argument, name in inputs.items() if argument not in ('spectra', 'derived')}
+        def build(report_dir, data, *values):
+            plot_function(data, location=report_dir, **dict(zip(inputs, values)))
+        # pyplot is not thread safe
+        add_artifact(plot_function.__name__, plot_function, build, [data, *inputs.values()], settings,
+                     filename=f'{plot_function.__name__}.png', exclusive=True)
+
+    def add_statistic(name, function, data, constants=None, **inputs):
+        # the spectra and segments are part of the session data, not of the statistic settings
+        settings = {argument: name for argument, name in inputs.items() if argument not in ('spectra', 'segments')}
+        def build(data, *values):
+            return function(data, **dict(zip(inputs, values)), **(constants or {}))
+        add_artifact(name, function, build, [data, *inputs.values()], settings, constants)
+
+    add_plot(plot_frequency_domain_1, 'analysis_data', sampling_rate='analysis_rate', spectra='spectra')
+    add_plot(plot_psd__power_spectral_density_1, 'analysis_data', sampling_rate='analysis_rate', nperseg='analysis_nperseg', spectra='spectra')
+    # one spectrogram of all session channels, for the plot and the band power time series
+    add_plot(plot_time_frequency_analysis_1, 'analysis_data', sampling_rate='analysis_rate', spectra='spectra', channels='session_channels')
+
+    def band_power(report_dir, spectra, session_channels):
+        # the columns across the gaps between the connected segments are NaN
+        frequencies, times, Sxx = spectra.spectrogram(session_channels, mask_gaps=True)
+        save_band_power_series(f'{report_dir}/band_power.npz', times, band_power_series(frequencies, Sxx), session_channels)
+    add_artifact('band_power', [band_power_series, save_band_power_series], band_power, ['spectra', 'session_channels'],
+                 {'channels': 'session_channels'}, {'mask_gaps': True}, filename='band_power.npz')
+
+    add_plot(plot_amplitude_distribution_histogram_1, 'eeg_data_average')
+
+    add_plot(plot_powerbands_1, 'analysis_data', sampling_rate='analysis_rate', derived='derived')
+    add_plot(plot_powerbands_hilbert_envelope_1, 'analysis_data', sampling_rate='analysis_rate', derived='derived')
+    add_plot(plot_powerbands_hilbert_envelope_moveing_average_1, 'analysis_data', sampling_rate='analysis_rate', derived='derived')
+
+    # the thumbnail of the moving average plot, its key builds on the key of the plot
+    icon_name = f'{plot_powerbands_hilbert_envelope_moveing_average_1.__name__}.png'
+    add_artifact('icon', generate_img_thumbnail, lambda report_dir, _: generate_img_thumbnail(f'{report_dir}/{icon_name}',f'{report_dir}/icon.png'),
+                 [plot_powerbands_hilbert_envelope_moveing_average_1.__name__], filename='icon.png',
+                 upstream=f'{plot_powerbands_hilbert_envelope_moveing_average_1.__name__}_key')
+
+    add_statistic('peak_alpha_simple', calculate_peak_alpha_simple, 'analysis_data', sample_rate='analysis_rate', spectra='spectra')
+    add_statistic('periods_peak_alpha_simple', calculate_periods_peak_alpha_simple, 'analysis_data', {'periode_length': periode_length, 'fast_length': fast_fft}, sample_rate='analysis_rate', segments='analysis_segments')
+    add_statistic('peak_alpha_welch', calculate_peak_alpha_welch, 'analysis_data', sample_rate='analysis_rate', nperseg='analysis_nperseg', spectra='spectra')
+    add_statistic('periods_peak_alpha_welch', calculate_periods_peak_alpha_welch, 'analysis_data', {'periode_length': periode_length}, sample_rate='analysis_rate', nperseg='analysis_nperseg', segments='analysis_segments')
+    add_statistic('peak_alpha_window', calculate_peak_alpha_window, 'analysis_data', sample_rate='analysis_rate', spectra='spectra')
+    add_statistic('periods_peak_alpha_window', calculate_periods_peak_alpha_window, 'analysis_data', {'periode_length': periode_length, 'fast_length': fast_fft}, sample_rate='analysis_rate', segments='analysis_segments')
+
+    # peak alpha of 60s windows every 10s from one spectrogram, the periods are averaged from the windows
+    window_length, hop = 60, 10
+    def peak_alpha_trajectory(analysis_data, analysis_rate, analysis_nperseg, spectra):
+        trajectory = calculate_peak_alpha_trajectory(analysis_data, sample_rate=analysis_rate, window_length=window_length, hop=hop, nperseg=analysis_nperseg, spectra=spectra)
+        return {'trajectory': peak_alpha_trajectory_to_json(trajectory), 'periods': aggregate_peak_alpha_trajectory(trajectory, periode_length=periode_length)}
+    add_artifact('pa_trajectory', [calculate_peak_alpha_trajectory, aggregate_peak_alpha_trajectory, peak_alpha_trajectory_to_json], peak_alpha_trajectory,
+                 ['analysis_data', 'analysis_rate', 'analysis_nperseg', 'spectra'], {'sample_rate': 'analysis_rate', 'nperseg': 'analysis_nperseg'},
+                 {'window_length': window_length, 'hop': hop, 'periode_length': periode_length})
+    pipeline.add('peak_alpha_trajectory', lambda pa_trajectory: pa_trajectory['trajectory'], ['pa_trajectory'])
+    pipeline.add('periods_peak_alpha_trajectory', lambda pa_trajectory: pa_trajectory['periods'], ['pa_trajectory'])
+
+    # peak alpha and band power of several period lengths, summed from the 10s blocks of one PSD pyramid
+    add_statistic('periods_peak_alpha_pyramid', calculate_periods_peak_alpha_pyramid, 'analysis_data', {'periode_lengths': periode_lengths},
+                  sample_rate='analysis_rate', nperseg='analysis_nperseg', spectra='spectra')
+
+    def periods_band_power(spectra, session_channels, analysis_rate, analysis_nperseg):
+        pyramid = spectra.psd_pyramid(session_channels, nperseg=analysis_nperseg)
+        return {length: band_power_periods(pyramid, length, session_channels, analysis_rate) for length in periode_lengths}
+    add_artifact('periods_band_power', [PsdPyramid, band_power_periods], periods_band_power, ['spectra', 'session_channels', 'analysis_rate', 'analysis_nperseg'],
+                 {'channels': 'session_channels', 'nperseg': 'analysis_nperseg'})
+
+    # all bands of the session channels from one filter bank pass
+    def band_envelope_mean(derived, session_channels):
+        _, band_envelopes = derived.filter_bank(session_channels)
+        return {band: {channel: float(np.nanmean(band_envelopes[i, j], dtype=np.float64)) for j, channel in enumerate(session_channels)}
+                for i, band in enumerate(BANDS)}
+    add_artifact('band_envelope_mean', filter_bank, band_envelope_mean, ['derived', 'session_channels'], {'channels': 'session_channels'})
+
+    def resolution(spectra, analysis_data, analysis_rate):
+        # bin spacing of the FFTs, of a full period and of the shorter last period
+        periode_samples = periode_length * analysis_rate
+        resolution = {'session': spectra.fft_resolution(), 'period': fft_resolution(periode_samples, analysis_rate, fast_fft)}
+        if len(analysis_data) % periode_samples:
+            resolution['last_period'] = fft_resolution(len(analysis_data) % periode_samples, analysis_rate, fast_fft)
+        return resolution
+    add_artifact('fft_resolution', fft_resolution, resolution, ['spectra', 'analysis_data', 'analysis_rate'], {'sample_rate': 'analysis_rate'},
+                 {'periode_length': periode_length, 'fast_length': fast_fft})
+
+    # the keys of statistics.json -> the values in the pipeline
+    statistics = {'peak_alpha_simple':'peak_alpha_simple', 'peak_alpha_welch':'peak_alpha_welch', 'peak_alpha_window':'peak_alpha_window', 'periods_peak_alpha_simple':'periods_peak_alpha_simple', 'periods_peak_alpha_welch':'periods_peak_alpha_welch', 'periods_peak_alpha_window':'periods_peak_alpha_window',  'table_good_electrodes':'statis_good_el', 'table_bad_electrodes':'statis_bad_el', 'fft_resolution':'fft_resolution', 'band_envelope_mean':'band_envelope_mean', 'peak_alpha_trajectory':'peak_alpha_trajectory', 'periods_peak_alpha_trajectory':'periods_peak_alpha_trajectory', 'periods_peak_alpha_pyramid':'periods_peak_alpha_pyramid', 'periods_band_power':'periods_band_power'}
+    report_files = [plot_function.__name__ for plot_function in REPORT_PLOTS] + ['band_power', 'icon']
+
+    def report(report_dir, *values):
+        statistics_json = dict(zip(statistics, values))
+        save_dict_to_json_pretty(statistics_json, filename='statistics.json', location=report_dir)
+        return statistics_json
+    pipeline.add('report', report, ['report_dir', *statistics.values(), *report_files])
+
+    # TODO: 1) generate '{cache_dir}/statistics.json' and create a {cache_dir_base}/summary.csv
+    #       2) peak alpha stats
+
+    return pipeline
+
+
+def generate_img_report_for(file='tho_eeglab_2024.09.04_22.02.zip', cache_dir_base='cache', data_dir='out_eeg', load_from=300, load_until=1600, fast_fft=False, periode_lengths=(60, 300, 600), analysis_rate=None, stage_workers=1, instrument=False, trace_memory=False):
+    """
+    Build the report of one session (see session_pipeline).
+
+    Parameters:
+    - stage_workers: int, threads for the independent stages of the session, the plots still run one at a time.
+    - instrument: bool, record the time, memory and input sizes of every stage to {cache_dir}/timings.json (see
+      Timings), also for failed and skipped sessions.
+    - trace_memory: bool, additionally trace the allocations of every stage (slower).
 
+    Returns:
+    - statistics_json: dict, the content of statistics.json, or False if the session has too many bad electrodes.
+    """
     base_name = os.path.splitext(file)[0]
     cache_dir = f'{cache_dir_base}/{base_name}'
     rm_dir(cache_dir)
     mk_dir(cache_dir)
 
-    sample_rate = 256  # Hz
-
-    # Band colors
-    band_colors = {
-        'alpha': 'navy',
-        'delta': 'green',
-        'theta': 'turquoise',
-        'beta': 'violet',
-        'gamma': '#808080'  # Hex value for gray
-    }
+    timings = Timings(trace_memory) if instrument else None
+    pipeline = session_pipeline(file, cache_dir_base, data_dir, load_from, load_until, fast_fft, periode_lengths, analysis_rate)
 
+    try:
+        # the bad electrodes first, sessions with too many bad electrodes are skipped
+        values = pipeline.run(['signal_quality_data', 'signal_quality_summary_all', 'bad_electrodes'], timings=timings)
+        if len(values['bad_electrodes']) > REPORT_PARAMETERS['max_bad_electrodes']:
+            return False
 
+        values = pipeline.run(['report', 'statis_good_el', 'statis_bad_el'], values, workers=stage_workers, timings=timings)
+    finally:
+        if timings is not None:
+            timings.save(f'{cache_dir}/{TIMINGS_FILE}')
 
-    #todo: warning if eeg_data is empty (file shorter than load_from)
-    eeg_data = load_data(f'{data_dir}/{file}', load_from=300, load_until=1600) #, col_separator='\t')
-    print('eeg loaded')
+    print(values['statis_good_el'])
+    print(values['statis_bad_el'])
 
-    signal_quality_data = load_signal_quality(f'{data_dir}/{file}', load_from=65, load_until=220) #, col_separator='\t')
-    print('signal quality loaded')
+    return values['report']
 
-    # Identify bad electrodes
-    bad_electrodes = identify_bad_electrodes(signal_quality_data)
-    if len(bad_electrodes) > 3:
-        return False
 
+def process_session(file, cache_dir_base, data_dir, report_settings, run_settings=None):
+    """
+    Generate the report of one session, with all exceptions caught, so a broken recording does not stop the batch.
 
-    eeg_data_trunc, signal_quality_data_trunc  = remove_non_connected_electrode_parts(eeg_data, signal_quality_data, bad_electrodes)
+    Parameters:
+    - file: str, the zip file name in data_dir.
+    - report_settings: dict, keyword arguments of generate_img_report_for that define the report, part of the
+      build manifest.
+    - run_settings: dict, keyword arguments of generate_img_report_for that do not change the report
+      (stage_workers, instrument, trace_memory), not part of the build manifest.
 
-    statis_good_el, statis_bad_el = signal_quality_statistics(signal_quality_data, bad_electrodes)
-    signal_quality_statis_trunc = signal_quality_statistics(signal_quality_data_trunc)
+    The build manifest of the session is written after a complete build, see session_is_up_to_date.
 
+    Returns:
+    - result: dict, with file, status ('ok', 'skipped' or 'error'), reason (None, the skip reason or the
+      traceback), statistics (the statistics of the session or None) and rebuilt (True).
+    """
+    try:
+        manifest = session_manifest(f'{data_dir}/{file}', manifest_parameters(report_settings))
+        statistics = generate_img_report_for(file, cache_dir_base, data_dir, **report_settings, **(run_settings or {}))
+        generate_detail_html_file(file, f'{cache_dir_base}')
 
+        session_dir = f'{cache_dir_base}/{os.path.splitext(file)[0]}'
+        if statistics is False:
+            reason = f"more than {REPORT_PARAMETERS['max_bad_electrodes']} bad electrodes"
+            write_manifest(session_dir, manifest, 'skipped', reason)
+            return {'file': file, 'status': 'skipped', 'reason': reason, 'statistics': None, 'rebuilt': True}
 
-    # add electrode average
-    add_average_to_data(eeg_data_trunc, bad_electrodes)
+        write_manifest(session_dir, manifest, 'ok')
+        return {'file': file, 'status': 'ok', 'reason': None, 'statistics': statistics, 'rebuilt': True}
+    except Exception:
+        return {'file': file, 'status': 'error', 'reason': traceback.format_exc(), 'statistics': None, 'rebuilt': True}
+    finally:
+        plt.close('all')
 
-    #### eeg_data_filterd = filter_eeg_data(eeg_data_trunc, sample_rate=sample_rate, ignored_electrodes=ignored_electrodes)
 
-    plot_frequency_domain_1(eeg_data_trunc, location=cache_dir)
-    plot_psd__power_spectral_density_1(eeg_data_trunc, location=cache_dir)
-    plot_time_frequency_analysis_1(eeg_data_trunc, location=cache_dir)
-    plot_amplitude_distribution_histogram_1(eeg_data_trunc, location=cache_dir)
+def session_is_up_to_date(file, cache_dir_base, data_dir, report_settings):
+    """
+    Check the build manifest of a session: the recording, the parameters and the pipeline version are unchanged and
+    all outputs exist.
 
-    plot_powerbands_1(eeg_data_trunc, location=cache_dir)
-    plot_powerbands_hilbert_envelope_1(eeg_data_trunc, location=cache_dir)
-    icon_name = plot_powerbands_hilbert_envelope_moveing_average_1(eeg_data_trunc, location=cache_dir)
-    generate_img_thumbnail(f'{cache_dir}/{icon_name}',f'{cache_dir}/icon.png')
+    Returns:
+    - result: dict, in the format of process_session with rebuilt False and no statistics, or None if the session
+      has to be built.
+    """
+    manifest = session_manifest(f'{data_dir}/{file}', manifest_parameters(report_settings))
+    previous = is_up_to_date(f'{cache_dir_base}/{os.path.splitext(file)[0]}', manifest)
+    if previous is None:
+        return None
 
-    # nperseg = 256   # resolution of 1hz
-    nperseg = 1024  # resolution of .25hz
-    # nperseg = 2560  # resolution of 0.1hz - not so good, because the function assumes a stationary over this timeframe.. 10s seems too long, mostly its 1s, 4s seems to be okayisch
-    pa_simple = calculate_peak_alpha_simple(eeg_data_trunc)
-    ppa_simple = calculate_periods_peak_alpha_simple(eeg_data_trunc, periode_length=300)
-    pa_welch = calculate_peak_alpha_welch(eeg_data_trunc, nperseg=nperseg)
-    ppa_welch = calculate_periods_peak_alpha_welch(eeg_data_trunc, nperseg=nperseg, periode_length=300)
-    pa_window = calculate_peak_alpha_window(eeg_data_trunc)
-    ppa_window = calculate_periods_peak_alpha_window(eeg_data_trunc, periode_length=300)
+    return {'file': file, 'status': previous['status'], 'reason': previous['reason'], 'statistics': None, 'rebuilt': False}
 
-    statistics_json = {'peak_alpha_simple':pa_simple, 'peak_alpha_welch':pa_welch, 'peak_alpha_window':pa_window, 'periods_peak_alpha_simple':ppa_simple, 'periods_peak_alpha_welch':ppa_welch, 'periods_peak_alpha_window':ppa_window,  'table_good_electrodes':statis_good_el, 'table_bad_electrodes':statis_bad_el}
-    save_dict_to_json_pretty(statistics_json, filename='statistics.json', location=cache_dir)
 
-    # TODO: 1) generate '{cache_dir}/statistics.json' and create a {cache_dir_base}/summary.csv
-    #       2) peak alpha stats
+def process_sessions(files, cache_dir_base, data_dir, report_settings, workers=1, max_in_flight=None, incremental=True, run_settings=None):
+    """
+    Process the sessions in a pool of worker processes (see process_session).
 
+    Parameters:
+    - files: list of str, the zip file names in data_dir.
+    - report_settings: dict, keyword arguments of generate_img_report_for.
+    - workers: int, the number of worker processes, 1 processes the sessions one after the other in this process.
+    - max_in_flight: int, the number of sessions submitted at the same time (default workers), bounds the memory
+      of sessions waiting in the queue.
+    - incremental: bool, only build sessions that are new or changed (see session_is_up_to_date).
+    - run_settings: dict, see process_session, changing them does not rebuild a session.
 
-    print(statis_good_el)
-    print(statis_bad_el)
+    Returns:
+    - results: dict, file -> result of process_session, in the order of files.
+    """
+    results = {}
+    if incremental:
+        for f in files:
+            result = session_is_up_to_date(f, cache_dir_base, data_dir, report_settings)
+            if result is not None:
+                results[f] = result
+    to_build = [f for f in files if f not in results]
+
+    if workers <= 1:
+        for f in to_build:
+            results[f] = process_session(f, cache_dir_base, data_dir, report_settings, run_settings)
+        return {f: results[f] for f in files}
+
+    if max_in_flight is None:
+        max_in_flight = workers
+
+    pending = iter(to_build)
+    # every worker process runs its FFTs single threaded, the pool already uses the cores
+    with ProcessPoolExecutor(max_workers=workers, initializer=set_fft_workers, initargs=(1,)) as executor:
+        in_flight = {}
+        for f in itertools.islice(pending, max_in_flight):
+            in_flight[executor.submit(process_session, f, cache_dir_base, data_dir, report_settings, run_settings)] = f
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                f = in_flight.pop(future)
+                try:
+                    results[f] = future.result()
+                except Exception:
+                    # the worker died (e.g. out of memory), the pool can not take new sessions anymore
+                    results[f] = {'file': f, 'status': 'error', 'reason': traceback.format_exc(), 'statistics': None, 'rebuilt': True}
+                print(f'{results[f]["status"]}: {f}')
+
+            for f in itertools.islice(pending, len(done)):
+                try:
+                    in_flight[executor.submit(process_session, f, cache_dir_base, data_dir, report_settings, run_settings)] = f
+                except BrokenProcessPool:
+                    results[f] = {'file': f, 'status': 'error', 'reason': 'the process pool is broken', 'statistics': None, 'rebuilt': True}
+
+    return {f: results[f] for f in files}
 
 
 def main():
@@ -180,16 +550,55 @@ def main():
 
 
 
-    files = file_list(data_dir)
+    load_from = 300
+    load_until = 1600
+
+    # zero pad the FFTs to fast lengths, faster for odd session lengths but the frequency bins move slightly
+    fast_fft = False
+
+    # period lengths of the period statistics in seconds, multiples of 10s
+    periode_lengths = (60, 300, 600)
+
+    # sampling rate of the spectral analyses, e.g. 128 to halve their work, None keeps the 256 Hz of the recording
+    analysis_rate = None
+
+    # time every stage of the built sessions, {session}/timings.json and the run report {cache_dir_base}/run_timings.json,
+    # e.g. to find the cause of a slow night. Does not change the reports, so switching it does not rebuild any session.
+    instrument = False
+
+    # only schedule the recordings that are long enough and readable, the catalog is kept in {cache_dir_base}/catalog.json
+    catalog = scan_catalog(data_dir, file_list(data_dir), f'{cache_dir_base}/catalog.json')
+    files, skipped = viable_recordings(catalog, min_duration=load_from)
+    for f, reason in skipped.items():
+        print(f'skipped {f}: {reason}')
 
     # generate_img_report_for(files[1], cache_dir_base, data_dir)
     # generate_detail_html_file(files[1], f'{cache_dir_base}')
 
-    for f in files:
-        generate_img_report_for(f, cache_dir_base, data_dir)
-        generate_detail_html_file(f, f'{cache_dir_base}')
+    # sessions processed in parallel, every session in flight holds its recording in memory
+    workers = max(1, (os.cpu_count() or 1) // 2)
+    max_in_flight = workers
+
+    report_settings = {'load_from': load_from, 'load_until': load_until, 'fast_fft': fast_fft,
+                       'periode_lengths': periode_lengths, 'analysis_rate': analysis_rate}
+    run_settings = {'instrument': instrument}
+    # sessions whose recording and parameters are unchanged since their last build are not built again
+    results = process_sessions(files, cache_dir_base, data_dir, report_settings, workers, max_in_flight, incremental=True, run_settings=run_settings)
+
+    print(f"{sum(result['rebuilt'] for result in results.values())} of {len(results)} sessions built")
+    for f, result in results.items():
+        if result['status'] != 'ok' and result['rebuilt']:
+            print(f'{result["status"]} {f}: {result["reason"]}')
+
+    if instrument:
+        write_run_timings([f'{cache_dir_base}/{os.path.splitext(f)[0]}' for f, result in results.items() if result['rebuilt']],
+                          f'{cache_dir_base}/run_timings.json')
+
+    # bound the artifact cache, the artifacts of old code versions go first
+    ArtifactCache(f'{cache_dir_base}/_artifacts').evict()
 
-    generate_index_file(files, f'{cache_dir_base}')
+    # the index lists all sessions with a detail page
+    generate_index_file([f for f, result in results.items() if result['status'] != 'error'], f'{cache_dir_base}')
 
 
 if __name__ == "__main__":
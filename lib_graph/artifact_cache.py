@@ -0,0 +1,244 @@
+import ast
+import hashlib
+import importlib
+import inspect
+import json
+import os
+import shutil
+import sys
+from functools import lru_cache
+
+from lib_graph.save_json import json_default
+
+
+# Maximum size of all cached artifacts together, the least recently used are removed first
+CACHE_SIZE_LIMIT = 2 * 1024 ** 3  # bytes
+
+PACKAGE = __name__.split('.')[0]
+
+
+@lru_cache(maxsize=None)
+def _source_hash(code_object):
+    try:
+        source = inspect.getsource(code_object)
+    except (OSError, TypeError):
+        source = repr(getattr(code_object, '__code__', code_object))
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+
+def _imported_modules(module):
+    # the lib_graph modules in the import statements of module (also imported constants like BANDS)
+    imported = set()
+    for node in ast.walk(ast.parse(inspect.getsource(module))):
+        if isinstance(node, ast.ImportFrom) and node.module:
+            imported.add(node.module)
+        elif isinstance(node, ast.Import):
+            imported.update(alias.name for alias in node.names)
+    return [name for name in imported if name.startswith(f'{PACKAGE}.')]
+
+
+@lru_cache(maxsize=None)
+def _package_modules(module_name):
+    # the module and all lib_graph modules it imports, transitively
+    modules = set()
+    missing = [module_name]
+    while missing:
+        name = missing.pop()
+        if name in modules:
+            continue
+        modules.add(name)
+        missing.extend(_imported_modules(importlib.import_module(name)))
+
+    return frozenset(modules)
+
+
+def code_version(*code_objects):
+    """
+    Version of the code that builds an artifact. For functions and classes of lib_graph it is a hash over the
+    source of their module and of every lib_graph module that it uses, transitively, so a change of a helper in
+    the call chain changes the version as well. Other objects (e.g. of graph_main) are hashed by their own source.
+
+    Returns:
+    - version: str, hex digest.
+    """
+    hashes = set()
+    for code_object in code_objects:
+        module_name = getattr(code_object, '__module__', None) or ''
+        if module_name.startswith(f'{PACKAGE}.'):
+            hashes.update(_source_hash(sys.modules[name]) for name in _package_modules(module_name))
+        else:
+            hashes.add(_source_hash(code_object))
+
+    return hashlib.sha1(''.join(sorted(hashes)).encode('utf-8')).hexdigest()
+
+
+def artifact_key(upstream, code, settings):
+    """
+    Key of an artifact from everything it depends on.
+
+    Parameters:
+    - upstream: str, the key of the data the artifact is built from (e.g. of the session, or of another artifact).
+    - code: function, class or list of them, the code that builds the artifact (see code_version), or None.
+    - settings: dict, the parameters of the artifact, json serializable.
+
+    Returns:
+    - key: str, hex digest.
+    """
+    if code is None:
+        version = None
+    elif isinstance(code, (list, tuple)):
+        version = code_version(*code)
+    else:
+        version = code_version(code)
+
+    content = json.dumps({'upstream': upstream, 'code': version, 'settings': settings}, sort_keys=True, default=json_default)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def _link(source, target):
+    # a hard link shares the file without copying it, a copy is the fallback across file systems
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+class ArtifactCache:
+    """
+    Content-addressed cache of the report artifacts (plots, thumbnails, statistics blocks). An artifact is stored
+    under its key (see artifact_key), so it is only built again if its upstream data, its settings or its code
+    changed. Cached files are hard linked into the report folder.
+
+    The report folders are rebuilt from scratch (see generate_img_report_for), so a linked file is never written to
+    in place, which would change the cached file as well.
+
+    The file modification time is used as the last access time. evict() removes the entries that no report links
+    to anymore first, then the least recently used, until the cache is smaller than size_limit.
+
+    Usage:
+        artifacts = ArtifactCache('cache/_artifacts')
+        artifacts.file(key, f'{cache_dir}/plot.png', lambda: plot(eeg_data, location=cache_dir))
+
+    link() and lookup() only look into the cache, so a caller can skip loading the data of artifacts that are cached
+    (see Pipeline lookups).
+    """
+
+    def __init__(self, cache_dir='cache/_artifacts', size_limit=CACHE_SIZE_LIMIT):
+        self.cache_dir = cache_dir
+        self.size_limit = size_limit
+
+    def _path(self, key, extension):
+        return f'{self.cache_dir}/{key[:2]}/{key}{extension}'
+
+    def _store(self, source, cached):
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        # link to a temporary name first, so a concurrent reader never sees a partial file
+        tmp_file = f'{cached}.{os.getpid()}.tmp'
+        _link(source, tmp_file)
+        os.replace(tmp_file, cached)
+
+    def link(self, key, path):
+        """
+        Link the cached artifact file of key to path, if it is in the cache.
+
+        Returns:
+        - found: bool, False if the artifact has to be built.
+        """
+        cached = self._path(key, os.path.splitext(path)[1])
+        try:
+            # mark as recently used
+            os.utime(cached)
+            _link(cached, path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def file(self, key, path, build):
+        """
+        Provide the artifact file at path, from the cache or by calling build().
+
+        Parameters:
+        - key: str, see artifact_key.
+        - path: str, where the artifact is expected.
+        - build: callable, writes the artifact to path.
+
+        Returns:
+        - built: bool, True if the artifact was built, False if it came from the cache.
+        """
+        if self.link(key, path):
+            return False
+
+        build()
+        self._store(path, self._path(key, os.path.splitext(path)[1]))
+        return True
+
+    def _load(self, key):
+        cached = self._path(key, '.json')
+        try:
+            with open(cached, 'r', encoding='utf-8') as f:
+                value = json.load(f)
+            os.utime(cached)
+            return True, value
+        except (OSError, ValueError):
+            return False, None
+
+    def lookup(self, key):
+        """
+        Returns:
+        - value: the cached value of key (see value), or None if it is not cached.
+        """
+        return self._load(key)[1]
+
+    def value(self, key, build):
+        """
+        Provide a json serializable value (e.g. a block of statistics.json), from the cache or by calling build().
+        DataFrames and numpy values are converted as in save_dict_to_json_pretty, so a built value is the same as a
+        cached one.
+
+        Returns:
+        - value: the value.
+        """
+        found, value = self._load(key)
+        if found:
+            return value
+
+        value = json.loads(json.dumps(build(), default=json_default))
+
+        cached = self._path(key, '.json')
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        tmp_file = f'{cached}.{os.getpid()}.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(value, f)
+        os.replace(tmp_file, cached)
+
+        return value
+
+    def evict(self):
+        """
+        Remove entries until the cache is smaller than size_limit: first the files that are not linked into a report
+        folder anymore (e.g. the plots of an older version of a plot function), then the least recently used.
+        Called once per batch (see main), not after every stored artifact.
+        """
+        entries = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = os.stat(f'{root}/{name}')
+                except FileNotFoundError:
+                    # evicted by another process in the meantime
+                    continue
+                # a file artifact without a second link is in no report folder anymore, values are never linked
+                unused = stat.st_nlink == 1 and not name.endswith('.json')
+                entries.append((not unused, stat.st_mtime, stat.st_size, f'{root}/{name}'))
+
+        total_size = sum(size for _, _, size, _ in entries)
+        for _, _, size, filename in sorted(entries):
+            if total_size <= self.size_limit:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            total_size -= size
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import zipfile
+import zlib
+
+
+# bump when the reports change without a change of the parameters or of the hashed code (see code_version), e.g.
+# a new version of a dependency, so all sessions are rebuilt
+PIPELINE_VERSION = 1
+
+MANIFEST_FILE = 'manifest.json'
+
+
+def input_fingerprint(filename):
+    """
+    Fingerprint of the content of a recording zip, from the size and the name, size and CRC32 of every member in
+    the central directory. Unlike recording_fingerprint it does not depend on the path or the modification time,
+    so a copied or touched recording is not rebuilt.
+
+    Returns:
+    - fingerprint: str, hex digest, or None if the zip can not be read.
+    """
+    content = hashlib.sha1()
+    try:
+        content.update(f'{os.path.getsize(filename)};'.encode('utf-8'))
+        with zipfile.ZipFile(filename, 'r') as zip_ref:
+            for info in zip_ref.infolist():
+                content.update(f'{info.filename}:{info.file_size}:{info.CRC};'.encode('utf-8'))
+    except (zipfile.BadZipFile, zlib.error, OSError):
+        return None
+
+    return content.hexdigest()
+
+
+def session_manifest(filename, parameters):
+    """
+    The build manifest of the session report of filename with the given parameters.
+
+    Parameters:
+    - filename: str, path to the recording zip.
+    - parameters: dict, every parameter of the analysis, json serializable.
+
+    Returns:
+    - manifest: dict, with pipeline_version, input and parameters.
+    """
+    # a round trip through json, so tuples compare equal to the lists of a loaded manifest
+    return json.loads(json.dumps({
+        'pipeline_version': PIPELINE_VERSION,
+        'input': input_fingerprint(filename),
+        'parameters': parameters
+    }, sort_keys=True))
+
+
+def load_manifest(session_dir):
+    """
+    Returns:
+    - manifest: dict, the manifest of the last complete build of session_dir, or None.
+    """
+    try:
+        with open(f'{session_dir}/{MANIFEST_FILE}', 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_up_to_date(session_dir, manifest):
+    """
+    Whether session_dir holds a complete build for manifest: same pipeline version, input and parameters, and all
+    output files still exist.
+
+    Returns:
+    - previous: dict, the stored manifest (with status, reason and outputs) if the build is up to date, else None.
+    """
+    if manifest['input'] is None:
+        return None
+
+    previous = load_manifest(session_dir)
+    if previous is None:
+        return None
+    if any(previous.get(key) != manifest[key] for key in ('pipeline_version', 'input', 'parameters')):
+        return None
+    if not all(os.path.exists(f'{session_dir}/{output}') for output in previous.get('outputs', [])):
+        return None
+
+    return previous
+
+
+def write_manifest(session_dir, manifest, status, reason=None):
+    """
+    Record a complete build of session_dir. The manifest is written last and atomically, so an interrupted build
+    is never taken as complete.
+
+    Parameters:
+    - session_dir: str, the report folder of the session.
+    - manifest: dict, see session_manifest.
+    - status: str, 'ok' or 'skipped'.
+    - reason: str, why the session was skipped.
+    """
+    outputs = sorted(name for name in os.listdir(session_dir) if name != MANIFEST_FILE)
+    content = dict(manifest, status=status, reason=reason, outputs=outputs)
+
+    tmp_file = f'{session_dir}/{MANIFEST_FILE}.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(content, f, indent=4, sort_keys=True)
+        f.write('\n')
+    os.replace(tmp_file, f'{session_dir}/{MANIFEST_FILE}')
@@ -1,7 +1,13 @@
+import itertools
+import math
+
 import pandas as pd
 import numpy as np
 from scipy import signal
 
+from lib_graph.func_spectral import amplitude_spectrum, stft_valid_columns, welch_segments
+from lib_graph.spectral_cache import SpectralCache
+
 
 #  This example doesn't apply windowing or overlapping segments which are common in spectral analysis for more
 #  accurate results, especially for shorter segments or when looking for changes over time. If you need to
@@ -9,133 +15,159 @@ from scipy import signal
 #  or applying a window function.
 
 
-def calculate_peak_alpha_simple(eeg_data, sample_rate=256, flatness_threshold=0.1, power_threshold=1e-5):
-    channels = ['tp9', 'af7', 'af8', 'tp10']
-    peak_alphas = {}
+def _spectrum_peak_alpha(freqs, spectrum, flatness_threshold, power_threshold):
+    # Define alpha band
+    alpha_band = (freqs >= 8) & (freqs <= 13)
 
-    for channel in channels:
-        channel_data = eeg_data[channel].values
+    # Check for peak within the alpha band
+    alpha_spectrum = spectrum[alpha_band]
 
-        # Compute the FFT
-        freqs = np.fft.fftfreq(len(channel_data), d=1 / sample_rate)
-        fft_values = np.abs(np.fft.fft(channel_data))
+    # If the spectrum is flat or below threshold, consider no peak
+    if np.max(alpha_spectrum) - np.min(alpha_spectrum) < flatness_threshold or np.max(alpha_spectrum) < power_threshold:
+        return None
 
-        # Consider only positive frequencies
-        positive_freqs = freqs[freqs >= 0]
-        fft_values = fft_values[freqs >= 0]
+    return freqs[alpha_band][np.argmax(alpha_spectrum)]
 
-        # Define the alpha band
-        alpha_band = (positive_freqs >= 8) & (positive_freqs <= 13)
 
-        # Extract alpha band data
-        alpha_fft = fft_values[alpha_band]
-        alpha_freqs = positive_freqs[alpha_band]
+def _fft_peak_alpha(spectra, channel, flatness_threshold, power_threshold, window=None):
+    if spectra.segments is None:
+        freqs, fft_values = spectra.spectrum(channel, 'fft', window=window)
+        return _spectrum_peak_alpha(freqs, fft_values, flatness_threshold, power_threshold)
 
-        # Check for a discernible peak in the alpha band
-        if np.max(alpha_fft) - np.min(alpha_fft) < flatness_threshold or np.max(alpha_fft) < power_threshold:
-            peak_alpha_freq = None  # Indicating no significant peak detected
-        else:
-            peak_alpha_freq = alpha_freqs[np.argmax(alpha_fft)]
+    # the peak of every connected segment on its own, averaged weighted by the segment length
+    peaks = []
+    weights = []
+    for freqs, fft_values, n_samples in spectra.segment_spectra(channel, window=window):
+        peak = _spectrum_peak_alpha(freqs, fft_values, flatness_threshold, power_threshold)
+        if peak is not None:
+            peaks.append(peak)
+            weights.append(n_samples)
 
-        peak_alphas[channel] = peak_alpha_freq
+    if not peaks:
+        return None
+    return np.average(peaks, weights=weights)
 
+
+def _mean_peak_alpha(peak_alphas):
     # Calculate the mean, filtering out None values
     valid_peaks = [v for v in peak_alphas.values() if v is not None]
     if not valid_peaks:  # If all are None
-        overall_peak_alpha = None
-    else:
-        overall_peak_alpha = np.mean(valid_peaks)
+        return None
+    return np.mean(valid_peaks)
+
+
+def calculate_peak_alpha_simple(eeg_data, sample_rate=256, flatness_threshold=0.1, power_threshold=1e-5, segments=None, spectra=None, fast_length=False):
+    """
+    Peak alpha frequency per channel from the FFT of the whole data.
+
+    With segments (see connected_segments) every connected segment is transformed on its own and the peaks are
+    averaged weighted by the segment length, so the gaps between the segments do not distort the spectrum.
+    With spectra (a SpectralCache of the session) the FFTs are taken from and shared through the cache, its
+    segments are used instead of the segments argument.
+    With fast_length the FFT is zero padded to a fast length (see fft_length), unless spectra is given.
+    """
+    if spectra is None:
+        spectra = SpectralCache(eeg_data, sample_rate, segments, fast_length)
+
+    channels = ['tp9', 'af7', 'af8', 'tp10']
+    peak_alphas = {channel: _fft_peak_alpha(spectra, channel, flatness_threshold, power_threshold) for channel in channels}
 
-    return {'peak_alphas': peak_alphas, 'mean_peak_alpha': overall_peak_alpha}
+    return {'peak_alphas': peak_alphas, 'mean_peak_alpha': _mean_peak_alpha(peak_alphas)}
 
 
 
 def calculate_peak_alpha_welch(eeg_data, sample_rate=256, nperseg=256, noverlap=None, flatness_threshold=0.1,
-                               power_threshold=1e-5):
+                               power_threshold=1e-5, segments=None, spectra=None):
+    """
+    Peak alpha frequency per channel from the Welch PSD.
+
+    With segments (see connected_segments) no Welch segment spans a gap between two connected segments.
+    With spectra (a SpectralCache of the session) the PSDs are taken from and shared through the cache.
+    """
+    if spectra is None:
+        spectra = SpectralCache(eeg_data, sample_rate, segments)
+
     channels = ['tp9', 'af7', 'af8', 'tp10']
 
     peak_alphas = {}
 
-    if noverlap is None:
-        noverlap = nperseg // 2  # Default overlap
-
     for channel in channels:
-        channel_data = eeg_data[channel].values
-
         # Using Welch's method to compute PSD
-        freqs, psd = signal.welch(channel_data, sample_rate, nperseg=nperseg, noverlap=noverlap)
+        freqs, psd = spectra.spectrum(channel, 'welch', nperseg=nperseg, noverlap=noverlap)
 
-        # Define alpha band
-        alpha_band = (freqs >= 8) & (freqs <= 13)
+        peak_alphas[channel] = _spectrum_peak_alpha(freqs, psd, flatness_threshold, power_threshold)
 
-        # Check for peak within the alpha band
-        alpha_psd = psd[alpha_band]
+    return {'peak_alphas': peak_alphas, 'mean_peak_alpha': _mean_peak_alpha(peak_alphas)}
 
-        # If the power spectrum is flat or below threshold, consider no peak
-        if np.max(alpha_psd) - np.min(alpha_psd) < flatness_threshold or np.max(alpha_psd) < power_threshold:
-            peak_alpha_freq = None
-        else:
-            peak_alpha_freq = freqs[alpha_band][np.argmax(alpha_psd)]
 
-        peak_alphas[channel] = peak_alpha_freq
 
-    # Calculate mean, ignoring None values
-    valid_peaks = [v for v in peak_alphas.values() if v is not None]
-    if not valid_peaks:
-        overall_peak_alpha = None
-    else:
-        overall_peak_alpha = np.mean(valid_peaks)
 
-    return {'peak_alphas': peak_alphas, 'mean_peak_alpha': overall_peak_alpha}
+def calculate_peak_alpha_window(eeg_data, sample_rate=256, window='hann', flatness_threshold=0.1, power_threshold=1e-5, segments=None, spectra=None, fast_length=False):
+    """
+    Peak alpha frequency per channel from the FFT of the windowed data.
 
+    With segments (see connected_segments) every connected segment is windowed and transformed on its own and the
+    peaks are averaged weighted by the segment length.
+    With spectra (a SpectralCache of the session) the FFTs are taken from and shared through the cache.
+    With fast_length the FFT is zero padded to a fast length (see fft_length), unless spectra is given.
+    """
+    if spectra is None:
+        spectra = SpectralCache(eeg_data, sample_rate, segments, fast_length)
 
+    channels = ['tp9', 'af7', 'af8', 'tp10']
+    peak_alphas = {channel: _fft_peak_alpha(spectra, channel, flatness_threshold, power_threshold, window) for channel in channels}
 
+    return {'peak_alphas': peak_alphas, 'mean_peak_alpha': _mean_peak_alpha(peak_alphas)}
 
-def calculate_peak_alpha_window(eeg_data, sample_rate=256, window='hann', flatness_threshold=0.1, power_threshold=1e-5):
-    channels = ['tp9', 'af7', 'af8', 'tp10']
-    peak_alphas = {}
 
-    for channel in channels:
-        channel_data = eeg_data[channel].values
+def _batched_peak_alpha(freqs, spectra, flatness_threshold, power_threshold):
+    # the peak of every spectrum along the last axis at once, NaN where the alpha band is flat or too weak
+    alpha_band = (freqs >= 8) & (freqs <= 13)
+    alpha_spectra = spectra[..., alpha_band]
 
-        # Create and apply window
-        win = signal.get_window(window, len(channel_data))
-        windowed_data = channel_data * win
+    alpha_max = alpha_spectra.max(axis=-1)
+    no_peak = (alpha_max - alpha_spectra.min(axis=-1) < flatness_threshold) | (alpha_max < power_threshold)
 
-        # Compute the FFT
-        freqs = np.fft.fftfreq(len(windowed_data), d=1 / sample_rate)
-        fft_values = np.abs(np.fft.fft(windowed_data))
+    peaks = freqs[alpha_band][alpha_spectra.argmax(axis=-1)]
+    peaks[no_peak] = np.nan
 
-        # Consider only positive frequencies
-        positive_freqs = freqs[freqs >= 0]
-        fft_values = fft_values[freqs >= 0]
+    return peaks
 
-        # Define alpha band
-        alpha_band = (positive_freqs >= 8) & (positive_freqs <= 13)
 
-        # Extract alpha band data
-        alpha_fft = fft_values[alpha_band]
-        alpha_freqs = positive_freqs[alpha_band]
+def _period_parts(segments, start, stop):
+    # the parts of the connected segments inside the period [start, stop)
+    parts = np.clip(segments, start, stop)
+    return parts[parts[:, 1] > parts[:, 0]]
 
-        # Check if there's a discernible peak
-        if np.max(alpha_fft) - np.min(alpha_fft) < flatness_threshold or np.max(alpha_fft) < power_threshold:
-            peak_alpha_freq = None  # No significant peak detected
-        else:
-            peak_alpha_freq = alpha_freqs[np.argmax(alpha_fft)]
 
-        peak_alphas[channel] = peak_alpha_freq
+def _fft_parts_peak_alpha(data, parts, sample_rate, spectrum, flatness_threshold, power_threshold):
+    # the peak of every part on its own, averaged weighted by the part length (as _fft_peak_alpha). Parts shorter
+    # than one second are left out, their spectrum has no resolution in the alpha band.
+    peaks = []
+    weights = []
+    for start, stop in parts:
+        if stop - start >= sample_rate:
+            freqs, spectra = spectrum(data[:, start:stop])
+            peaks.append(_batched_peak_alpha(freqs, spectra, flatness_threshold, power_threshold))
+            weights.append(stop - start)
 
-    # Check if all channels returned None, if not calculate mean
-    if all(v is None for v in peak_alphas.values()):
-        overall_peak_alpha = None
-    else:
-        # Filter out None values before calculating mean
-        overall_peak_alpha = np.mean([v for v in peak_alphas.values() if v is not None])
+    if not peaks:
+        return np.full(data.shape[0], np.nan)
 
-    return {'peak_alphas': peak_alphas, 'mean_peak_alpha': overall_peak_alpha}
+    peaks = np.array(peaks)
+    weights = np.where(np.isnan(peaks), 0, np.array(weights)[:, np.newaxis])
+    with np.errstate(invalid='ignore'):
+        return np.nansum(peaks * weights, axis=0) / weights.sum(axis=0)
 
 
-def calculate_periods_peak_alpha_simple(eeg_data, periode_length=600, sample_rate=256, flatness_threshold=0.1, power_threshold=1e-5):
+def _calculate_periods_peak_alpha(eeg_data, periode_length, sample_rate, spectrum, flatness_threshold, power_threshold, segments=None, parts_peak_alpha=None):
+    # The periods are transformed in one batch: the channels are reshaped into a (n_periods, n_channels,
+    # periode_length_samples) view and spectrum() transforms along the last axis. The shorter last period is
+    # transformed on its own.
+    # With segments, the periods that are not completely inside one connected segment are replaced by
+    # parts_peak_alpha(data, parts) of their connected parts.
+    channels = ['tp9', 'af7', 'af8', 'tp10']
+
     # Ensure periode_length is in samples, not seconds
     periode_length_samples = periode_length * sample_rate
 
@@ -143,215 +175,329 @@ def calculate_periods_peak_alpha_simple(eeg_data, periode_length=600, sample_rat
     if len(eeg_data) < periode_length_samples:
         raise ValueError("The EEG data is shorter than the specified period length.")
 
-    # Number of periods we can fit into the EEG data length
-    num_periods = len(eeg_data) // periode_length_samples
+    data = np.ascontiguousarray(eeg_data[channels].to_numpy().T)
+    num_full_periods = data.shape[1] // periode_length_samples
+    full_length = num_full_periods * periode_length_samples
 
+    batches = [data[:, :full_length].reshape(len(channels), num_full_periods, periode_length_samples).transpose(1, 0, 2)]
     #  If there's any remaining data less than periode_length, add an additional period
-    if len(eeg_data) % periode_length_samples != 0:
-        num_periods += 1
+    if full_length < data.shape[1]:
+        batches.append(data[np.newaxis, :, full_length:])
 
     results = []
 
+    peaks = [_batched_peak_alpha(*spectrum(batch), flatness_threshold, power_threshold) for batch in batches]
+    if segments is not None:
+        for i, period_peaks in enumerate(itertools.chain(*peaks)):
+            start = i * periode_length_samples
+            stop = min(start + periode_length_samples, data.shape[1])
+            parts = _period_parts(segments, start, stop)
+            if len(parts) != 1 or parts[0, 0] != start or parts[0, 1] != stop:
+                period_peaks[:] = parts_peak_alpha(data, parts)
+
+    for batch, batch_peaks in zip(batches, peaks):
+        for period_peaks in batch_peaks:
+            peak_alphas = {channel: (None if np.isnan(peak) else peak) for channel, peak in zip(channels, period_peaks)}
+
+            # Append results for this slice
+            results.append({
+                'periode_start': periode_length * len(results),
+                'periode_length': int(batch.shape[-1] / sample_rate),
+                'peak_aplhas': peak_alphas,
+                'mean_peak_alpha': _mean_peak_alpha(peak_alphas)
+            })
 
-    for i in range(num_periods):
-        start_from = i * periode_length_samples
-        end_at = start_from + periode_length_samples
-        if end_at > len(eeg_data):      # if end_at is bigger than eeg_data, reduce to len(eeg_data)
-            end_at = len(eeg_data)
-        # Slice the data for this period
-        eeg_slice = eeg_data.iloc[start_from:end_at]
-
-        channels = ['tp9', 'af7', 'af8', 'tp10']
-        peak_alphas = {}
-
-        for channel in channels:
-            channel_data = eeg_slice[channel].values
-
-            # Compute the FFT
-            freqs = np.fft.fftfreq(len(channel_data), d=1 / sample_rate)
-            fft_values = np.abs(np.fft.fft(channel_data))
-
-            # Consider only positive frequencies
-            positive_freqs = freqs[freqs >= 0]
-            fft_values = fft_values[freqs >= 0]
+    return results
 
-            # Define the alpha band
-            alpha_band = (positive_freqs >= 8) & (positive_freqs <= 13)
 
-            # Extract alpha band data
-            alpha_fft = fft_values[alpha_band]
-            alpha_freqs = positive_freqs[alpha_band]
+def calculate_periods_peak_alpha_simple(eeg_data, periode_length=600, sample_rate=256, flatness_threshold=0.1, power_threshold=1e-5, fast_length=False, segments=None):
+    """
+    Peak alpha frequency per channel for consecutive periods of periode_length seconds, from the FFT of each period.
+    The last period is shorter if the data does not fill it, with fast_length it is zero padded to a fast length
+    (see fft_length).
 
-            # Check for a discernible peak in the alpha band
-            if np.max(alpha_fft) - np.min(alpha_fft) < flatness_threshold or np.max(alpha_fft) < power_threshold:
-                peak_alpha_freq = None  # Indicating no significant peak detected
-            else:
-                peak_alpha_freq = alpha_freqs[np.argmax(alpha_fft)]
+    With segments (see connected_segments) a period with gaps is handled like calculate_peak_alpha_simple: every
+    connected part of the period is transformed on its own and the peaks are averaged weighted by the part length.
+    """
+    def spectrum(batch):
+        # Compute the FFT of all periods and channels
+        return amplitude_spectrum(batch, sample_rate, fast_length=fast_length)
 
-            peak_alphas[channel] = peak_alpha_freq
+    def parts_peak_alpha(data, parts):
+        return _fft_parts_peak_alpha(data, parts, sample_rate, spectrum, flatness_threshold, power_threshold)
 
-        # Calculate the mean, filtering out None values
-        valid_peaks = [v for v in peak_alphas.values() if v is not None]
-        if not valid_peaks:  # If all are None
-            overall_peak_alpha = None
-        else:
-            overall_peak_alpha = np.mean(valid_peaks)
+    return _calculate_periods_peak_alpha(eeg_data, periode_length, sample_rate, spectrum, flatness_threshold, power_threshold, segments, parts_peak_alpha)
 
-        # Append results for this slice
-        results.append({
-            'periode_start': periode_length * i,
-            'periode_length': int((end_at - start_from) / sample_rate),
-            'peak_aplhas': peak_alphas,
-            'mean_peak_alpha': overall_peak_alpha
-        })
 
-    return results
+def calculate_periods_peak_alpha_welch(eeg_data, periode_length=600, sample_rate=256, nperseg=256, noverlap=None, flatness_threshold=0.1, power_threshold=1e-5, segments=None):
+    """
+    Peak alpha frequency per channel for consecutive periods of periode_length seconds, from the Welch PSD of each
+    period. The last period is shorter if the data does not fill it.
 
-def calculate_periods_peak_alpha_welch(eeg_data, periode_length=600, sample_rate=256, nperseg=256, noverlap=None, flatness_threshold=0.1, power_threshold=1e-5):
-    # Ensure periode_length is in samples, not seconds
-    periode_length_samples = periode_length * sample_rate
+    With segments (see connected_segments) no Welch segment of a period spans a gap (see welch_segments).
+    """
+    if noverlap is None:
+        noverlap = nperseg // 2  # Default overlap
 
-    # Check if the data length allows for at least one complete period
-    if len(eeg_data) < periode_length_samples:
-        raise ValueError("The EEG data is shorter than the specified period length.")
+    def spectrum(batch):
+        # Using Welch's method to compute the PSD of all periods and channels
+        return signal.welch(batch, sample_rate, nperseg=nperseg, noverlap=noverlap, axis=-1)
 
-    # Number of periods we can fit into the EEG data length
-    num_periods = len(eeg_data) // periode_length_samples
+    def parts_peak_alpha(data, parts):
+        try:
+            freqs, psd = welch_segments(data.T, parts, sample_rate, nperseg=nperseg, noverlap=noverlap)
+        except ValueError:
+            # no connected part of the period is as long as nperseg
+            return np.full(data.shape[0], np.nan)
+        return _batched_peak_alpha(freqs, psd.T, flatness_threshold, power_threshold)
 
-    #  If there's any remaining data less than periode_length, add an additional period
-    if len(eeg_data) % periode_length_samples != 0:
-        num_periods += 1
+    return _calculate_periods_peak_alpha(eeg_data, periode_length, sample_rate, spectrum, flatness_threshold, power_threshold, segments, parts_peak_alpha)
 
-    results = []
 
 
-    for i in range(num_periods):
-        start_from = i * periode_length_samples
-        end_at = start_from + periode_length_samples
-        if end_at > len(eeg_data):      # if end_at is bigger than eeg_data, reduce to len(eeg_data)
-            end_at = len(eeg_data)
+def calculate_periods_peak_alpha_window(eeg_data, periode_length=600, sample_rate=256, window='hann', flatness_threshold=0.1, power_threshold=1e-5, fast_length=False, segments=None):
+    """
+    Peak alpha frequency per channel for consecutive periods of periode_length seconds, from the FFT of each
+    windowed period. The last period is shorter if the data does not fill it, with fast_length it is zero padded
+    to a fast length (see fft_length).
 
-        # Slice the data for this period
-        eeg_slice = eeg_data.iloc[start_from:end_at]
+    With segments (see connected_segments) a period with gaps is handled like calculate_peak_alpha_window: every
+    connected part of the period is windowed and transformed on its own.
+    """
+    def spectrum(batch):
+        # Apply the window, then compute the FFT of all periods and channels
+        return amplitude_spectrum(batch, sample_rate, window, fast_length)
 
-        channels = ['tp9', 'af7', 'af8', 'tp10']
+    def parts_peak_alpha(data, parts):
+        return _fft_parts_peak_alpha(data, parts, sample_rate, spectrum, flatness_threshold, power_threshold)
 
-        peak_alphas = {}
+    return _calculate_periods_peak_alpha(eeg_data, periode_length, sample_rate, spectrum, flatness_threshold, power_threshold, segments, parts_peak_alpha)
 
-        if noverlap is None:
-            noverlap = nperseg // 2  # Default overlap
 
-        for channel in channels:
-            channel_data = eeg_slice[channel].values
+def calculate_periods_peak_alpha_blocks(eeg_blocks, method='welch', periode_length=600, sample_rate=256, **kwargs):
+    """
+    Peak alpha per period of a stream of EEG blocks, for recordings that are too long to be loaded at once.
+    Each block is one period, so the blocks have to be streamed without overlap and with
+    block_size = periode_length * sample_rate, e.g. iter_data_blocks(filename, block_size=periode_length * 256).
 
-            # Using Welch's method to compute PSD
-            freqs, psd = signal.welch(channel_data, sample_rate, nperseg=nperseg, noverlap=noverlap)
+    Parameters:
+    - eeg_blocks: iterable of DataFrames, the EEG data of the periods.
+    - method: str, 'simple', 'welch' or 'window' (see calculate_peak_alpha_*).
+    - periode_length: int, the length of a period in seconds.
+    - sample_rate: int, the sampling rate of the EEG data in Hz.
+    - kwargs: passed to the calculate_peak_alpha_* function (nperseg, window, thresholds, ...).
 
-            # Define alpha band
-            alpha_band = (freqs >= 8) & (freqs <= 13)
+    Returns:
+    - results: list of dict, in the same format as calculate_periods_peak_alpha_*.
+    """
+    methods = {'simple': calculate_peak_alpha_simple, 'welch': calculate_peak_alpha_welch, 'window': calculate_peak_alpha_window}
+    if method not in methods:
+        raise ValueError("Invalid method. Use 'simple', 'welch' or 'window'.")
 
-            # Check for peak within the alpha band
-            alpha_psd = psd[alpha_band]
+    periode_length_samples = periode_length * sample_rate
 
-            # If the power spectrum is flat or below threshold, consider no peak
-            if np.max(alpha_psd) - np.min(alpha_psd) < flatness_threshold or np.max(alpha_psd) < power_threshold:
-                peak_alpha_freq = None
-            else:
-                peak_alpha_freq = freqs[alpha_band][np.argmax(alpha_psd)]
+    results = []
 
-            peak_alphas[channel] = peak_alpha_freq
+    for i, eeg_slice in enumerate(eeg_blocks):
+        # Check if the data length allows for at least one complete period
+        if i == 0 and len(eeg_slice) < periode_length_samples:
+            raise ValueError("The EEG data is shorter than the specified period length.")
 
-        # Calculate mean, ignoring None values
-        valid_peaks = [v for v in peak_alphas.values() if v is not None]
-        if not valid_peaks:
-            overall_peak_alpha = None
-        else:
-            overall_peak_alpha = np.mean(valid_peaks)
+        peak_alpha = methods[method](eeg_slice, sample_rate=sample_rate, **kwargs)
 
         # Append results for this slice
         results.append({
             'periode_start': periode_length * i,
-            'periode_length': int((end_at - start_from) / sample_rate),
-            'peak_aplhas': peak_alphas,
-            'mean_peak_alpha': overall_peak_alpha
+            'periode_length': int(len(eeg_slice) / sample_rate),
+            'peak_aplhas': peak_alpha['peak_alphas'],
+            'mean_peak_alpha': peak_alpha['mean_peak_alpha']
         })
 
-    return results
-
-
-
-def calculate_periods_peak_alpha_window(eeg_data, periode_length=600, sample_rate=256, window='hann', flatness_threshold=0.1, power_threshold=1e-5):
-    # Ensure periode_length is in samples, not seconds
-    periode_length_samples = periode_length * sample_rate
-
-    # Check if the data length allows for at least one complete period
-    if len(eeg_data) < periode_length_samples:
+    if not results:
         raise ValueError("The EEG data is shorter than the specified period length.")
 
-    # Number of periods we can fit into the EEG data length
-    num_periods = len(eeg_data) // periode_length_samples
-
-    #  If there's any remaining data less than periode_length, add an additional period
-    if len(eeg_data) % periode_length_samples != 0:
-        num_periods += 1
-
-    results = []
-
-    for i in range(num_periods):
-        start_from = i * periode_length_samples
-        end_at = start_from + periode_length_samples
-        if end_at > len(eeg_data):  # if end_at is bigger than eeg_data, reduce to len(eeg_data)
-            end_at = len(eeg_data)
+    return results
 
-        # Slice the data for this period
-        eeg_slice = eeg_data.iloc[start_from:end_at]
 
+def calculate_peak_alpha_trajectory(eeg_data, window_length=60, hop=10, sample_rate=256, nperseg=1024, noverlap=None,
+                                    flatness_threshold=0.1, power_threshold=1e-5, channels=None, spectra=None):
+    """
+    Peak alpha frequency per channel over sliding windows, from one spectrogram of the whole data.
+
+    The Welch PSD of every window is the mean of the spectrogram columns (hann, nperseg, noverlap) inside the window,
+    taken from a cumulative sum, so all windows together cost about one STFT pass. The peaks of all windows and
+    channels are searched at once and refined between the bins with a parabola through the peak bin and its
+    neighbours. With the segments of spectra (see connected_segments) the columns across a gap are left out.
+
+    Parameters:
+    - eeg_data: DataFrame, the EEG data.
+    - window_length: float, the length of a window in seconds.
+    - hop: float, the distance between the window starts in seconds.
+    - sample_rate: int, the sampling rate of the EEG data in Hz.
+    - nperseg: int, length of a Welch segment in samples.
+    - noverlap: int, overlap of the Welch segments (default nperseg // 2). window_length and hop have to be
+      multiples of nperseg - noverlap samples.
+    - flatness_threshold, power_threshold: float, see calculate_peak_alpha_welch.
+    - channels: list of str, the channels (default tp9, af7, af8, tp10).
+    - spectra: SpectralCache, the spectral cache of the session.
+
+    Returns:
+    - trajectory: dict, with
+      - times: ndarray, the window centers in seconds.
+      - peak_alphas: dict, channel -> ndarray with the peak of every window, NaN where there is no peak.
+      - mean_peak_alpha: ndarray, the mean over the channels with a peak, NaN where no channel has one.
+      - duration: float, the length of eeg_data in seconds, the periods of aggregate_peak_alpha_trajectory end there.
+    """
+    if channels is None:
         channels = ['tp9', 'af7', 'af8', 'tp10']
-        peak_alphas = {}
-
-        for channel in channels:
-            channel_data = eeg_slice[channel].values
-
-            # Create and apply window
-            win = signal.get_window(window, len(channel_data))
-            windowed_data = channel_data * win
+    if spectra is None:
+        spectra = SpectralCache(eeg_data, sample_rate)
+    if noverlap is None:
+        noverlap = nperseg // 2  # Default overlap
+    step = nperseg - noverlap
+
+    window_samples = int(round(window_length * sample_rate))
+    hop_samples = int(round(hop * sample_rate))
+    if window_samples % step or hop_samples % step or window_samples < nperseg:
+        raise ValueError("window_length and hop have to be multiples of nperseg - noverlap samples, window_length at least nperseg.")
+    if len(eeg_data) < window_samples:
+        raise ValueError("The EEG data is shorter than the specified window length.")
+
+    freqs, _, Sxx = spectra.spectrogram(channels, nperseg=nperseg, noverlap=noverlap, nfft=nperseg, window='hann')
+
+    # the alpha band and one bin on each side for the refinement
+    alpha_band = (freqs >= 8) & (freqs <= 13)
+    band_bins = np.flatnonzero(alpha_band)
+    bins = np.arange(max(band_bins[0] - 1, 0), min(band_bins[-1] + 2, len(freqs)))
+    columns = Sxx[:, bins, :]
+
+    # columns that lie completely inside one connected segment
+    valid = stft_valid_columns(columns.shape[-1], step, nperseg, spectra.segments)
+
+    # mean of the valid columns of every window from cumulative sums
+    segments_per_window = (window_samples - noverlap) // step
+    hop_columns = hop_samples // step
+    n_windows = (columns.shape[-1] - segments_per_window) // hop_columns + 1
+    window_starts = np.arange(n_windows) * hop_columns
+
+    cumulative = np.concatenate([np.zeros(columns.shape[:2] + (1,)), np.cumsum(columns * valid, axis=-1)], axis=-1)
+    counts = np.concatenate([[0], np.cumsum(valid)])
+    window_counts = counts[window_starts + segments_per_window] - counts[window_starts]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        window_psd = (cumulative[..., window_starts + segments_per_window] - cumulative[..., window_starts]) / window_counts
+    window_psd = window_psd.transpose(0, 2, 1)  # (channels, windows, bins)
+
+    # peak search in the alpha band of all channels and windows
+    in_band = alpha_band[bins]
+    peaks = _batched_peak_alpha(freqs[bins][in_band], window_psd[..., in_band], flatness_threshold, power_threshold)
+    peaks[:, window_counts == 0] = np.nan
+
+    # parabolic refinement between the bins
+    peak_bin = np.flatnonzero(in_band)[0] + np.argmax(window_psd[..., in_band], axis=-1)
+    inner = (peak_bin > 0) & (peak_bin < len(bins) - 1)
+    left = np.take_along_axis(window_psd, np.clip(peak_bin - 1, 0, len(bins) - 1)[..., np.newaxis], axis=-1)[..., 0]
+    center = np.take_along_axis(window_psd, peak_bin[..., np.newaxis], axis=-1)[..., 0]
+    right = np.take_along_axis(window_psd, np.clip(peak_bin + 1, 0, len(bins) - 1)[..., np.newaxis], axis=-1)[..., 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        curvature = left - 2 * center + right
+        offset = np.where(inner & (curvature < 0), 0.5 * (left - right) / curvature, 0)
+    peaks += np.clip(np.nan_to_num(offset), -0.5, 0.5) * (freqs[1] - freqs[0])
+
+    with np.errstate(invalid='ignore'):
+        valid_peaks = ~np.isnan(peaks)
+        mean_peak_alpha = np.where(valid_peaks.any(axis=0), np.nansum(peaks, axis=0) / valid_peaks.sum(axis=0), np.nan)
+
+    return {
+        'times': (window_starts * step + window_samples / 2) / sample_rate,
+        'peak_alphas': {channel: peaks[i] for i, channel in enumerate(channels)},
+        'mean_peak_alpha': mean_peak_alpha,
+        'duration': len(eeg_data) / sample_rate
+    }
+
+
+def calculate_periods_peak_alpha_pyramid(eeg_data, periode_lengths=(60, 300, 600), base_length=10, sample_rate=256,
+                                         nperseg=1024, noverlap=None, flatness_threshold=0.1, power_threshold=1e-5,
+                                         spectra=None):
+    """
+    Peak alpha frequency per channel for consecutive periods of several lengths at once, from the Welch PSDs of a
+    PsdPyramid (see SpectralCache.psd_pyramid). Every period length is a multiple of base_length seconds and costs
+    only a sum over the base blocks, the results are the same as calculate_periods_peak_alpha_welch.
+
+    Returns:
+    - results: dict, periode_length -> list of dict in the format of calculate_periods_peak_alpha_*.
+    """
+    channels = ['tp9', 'af7', 'af8', 'tp10']
+    if spectra is None:
+        spectra = SpectralCache(eeg_data, sample_rate)
+    pyramid = spectra.psd_pyramid(channels, base_length, nperseg, noverlap)
+
+    results = {}
+    for periode_length in periode_lengths:
+        starts, lengths, psd, counts = pyramid.periods(periode_length * sample_rate)
+        with np.errstate(invalid='ignore'):
+            peaks = _batched_peak_alpha(pyramid.freqs, psd, flatness_threshold, power_threshold)
+        peaks[counts == 0] = np.nan
+
+        results[periode_length] = []
+        for start, length, period_peaks in zip(starts, lengths, peaks):
+            peak_alphas = {channel: (None if np.isnan(peak) else peak) for channel, peak in zip(channels, period_peaks)}
+            results[periode_length].append({
+                'periode_start': int(start // sample_rate),
+                'periode_length': int(length / sample_rate),
+                'peak_aplhas': peak_alphas,
+                'mean_peak_alpha': _mean_peak_alpha(peak_alphas)
+            })
 
-            # Compute the FFT
-            freqs = np.fft.fftfreq(len(windowed_data), d=1 / sample_rate)
-            fft_values = np.abs(np.fft.fft(windowed_data))
+    return results
 
-            # Consider only positive frequencies
-            positive_freqs = freqs[freqs >= 0]
-            fft_values = fft_values[freqs >= 0]
 
-            # Define alpha band
-            alpha_band = (positive_freqs >= 8) & (positive_freqs <= 13)
+def aggregate_peak_alpha_trajectory(trajectory, periode_length=600):
+    """
+    Peak alpha per period from a trajectory (see calculate_peak_alpha_trajectory): the mean of the windows whose
+    center lies in the period, without computing any spectra again.
 
-            # Extract alpha band data
-            alpha_fft = fft_values[alpha_band]
-            alpha_freqs = positive_freqs[alpha_band]
+    The periods are the ones of calculate_periods_peak_alpha_*: consecutive periods of periode_length seconds up to
+    the end of the data, the last one is shorter if the data does not fill it. A short last period without a window
+    center has no peaks.
 
-            # Check if there's a discernible peak
-            if np.max(alpha_fft) - np.min(alpha_fft) < flatness_threshold or np.max(alpha_fft) < power_threshold:
-                peak_alpha_freq = None  # No significant peak detected
-            else:
-                peak_alpha_freq = alpha_freqs[np.argmax(alpha_fft)]
+    Returns:
+    - results: list of dict, in the format of calculate_periods_peak_alpha_* (None where no window has a peak).
+    """
+    times = trajectory['times']
+    duration = trajectory['duration']
+    period_index = (times // periode_length).astype(int)
 
-            peak_alphas[channel] = peak_alpha_freq
+    results = []
+    for period in range(math.ceil(duration / periode_length)):
+        in_period = period_index == period
 
-        # Check if all channels returned None, if not calculate mean
-        if all(v is None for v in peak_alphas.values()):
-            overall_peak_alpha = None
-        else:
-            # Filter out None values before calculating mean
-            overall_peak_alpha = np.mean([v for v in peak_alphas.values() if v is not None])
+        peak_alphas = {}
+        for channel, peaks in trajectory['peak_alphas'].items():
+            period_peaks = peaks[in_period]
+            period_peaks = period_peaks[~np.isnan(period_peaks)]
+            peak_alphas[channel] = float(np.mean(period_peaks)) if len(period_peaks) else None
 
-        # Append results for this slice
         results.append({
-            'periode_start': periode_length * i,
-            'periode_length': int((end_at - start_from) / sample_rate),
+            'periode_start': periode_length * period,
+            # clamped to the end of the data, like the shorter last period
+            'periode_length': int(min(periode_length, duration - periode_length * period)),
             'peak_aplhas': peak_alphas,
-            'mean_peak_alpha': overall_peak_alpha
+            'mean_peak_alpha': _mean_peak_alpha(peak_alphas)
         })
 
     return results
+
+
+def peak_alpha_trajectory_to_json(trajectory):
+    """
+    Returns:
+    - trajectory: dict, the trajectory with lists instead of arrays and None instead of NaN.
+    """
+    def to_list(values):
+        return [None if np.isnan(value) else float(value) for value in values]
+
+    return {
+        'times': [float(time) for time in trajectory['times']],
+        'peak_alphas': {channel: to_list(peaks) for channel, peaks in trajectory['peak_alphas'].items()},
+        'mean_peak_alpha': to_list(trajectory['mean_peak_alpha'])
+    }
@@ -0,0 +1,163 @@
+import json
+import os
+import zipfile
+import zlib
+
+from lib_graph.load_recording import contains_letters
+
+
+# bump when the content of a catalog entry changes, older index files are then rescanned
+CATALOG_VERSION = 1
+
+# number of bytes decompressed from the start of the _eeg.csv to find the header and the line length
+HEAD_SIZE = 16384
+
+
+def scan_recording(filename, sample_rate=256):
+    """
+    Describe a recording zip from its central directory and the first lines of the _eeg.csv member, without
+    parsing the csv files. The number of samples is estimated from the uncompressed member size and the average
+    length of the first lines.
+
+    Parameters:
+    - filename: str, path to the ZIP file.
+    - sample_rate: int, the sampling rate of the EEG data in Hz.
+
+    Returns:
+    - entry: dict, with the keys size, mtime_ns, eeg_member, signal_quality_member, eeg_bytes, has_header,
+      estimated_samples, estimated_duration and error (None or a description of the problem).
+    """
+    stat = os.stat(filename)
+    entry = {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'eeg_member': None,
+        'signal_quality_member': None,
+        'eeg_bytes': 0,
+        'has_header': None,
+        'estimated_samples': 0,
+        'estimated_duration': 0.0,
+        'error': None
+    }
+
+    try:
+        with zipfile.ZipFile(filename, 'r') as zip_ref:
+            for info in zip_ref.infolist():
+                if info.filename.endswith('_eeg.csv') and entry['eeg_member'] is None:
+                    entry['eeg_member'] = info.filename
+                    entry['eeg_bytes'] = info.file_size
+                elif info.filename.endswith('_signal_quality.csv') and entry['signal_quality_member'] is None:
+                    entry['signal_quality_member'] = info.filename
+
+            if entry['eeg_member'] is None:
+                entry['error'] = 'no _eeg.csv in the zip'
+                return entry
+            if entry['signal_quality_member'] is None:
+                entry['error'] = 'no _signal_quality.csv in the zip'
+                return entry
+
+            with zip_ref.open(entry['eeg_member']) as csv_file:
+                head = csv_file.read(HEAD_SIZE)
+    except (zipfile.BadZipFile, zlib.error, OSError, EOFError) as e:
+        entry['error'] = f'unreadable zip: {e}'
+        return entry
+
+    lines = head.split(b'\n')
+    if len(head) < entry['eeg_bytes']:
+        lines = lines[:-1]  # the last line is cut off
+    lines = [line for line in lines if line.strip()]
+    if not lines:
+        entry['error'] = 'empty _eeg.csv'
+        return entry
+
+    header_bytes = 0
+    entry['has_header'] = contains_letters(lines[0].decode('utf-8', errors='replace'))
+    if entry['has_header']:
+        header_bytes = len(lines[0]) + 1
+        lines = lines[1:]
+    if not lines:
+        entry['error'] = 'no samples in _eeg.csv'
+        return entry
+
+    bytes_per_line = sum(len(line) + 1 for line in lines) / len(lines)
+    entry['estimated_samples'] = int((entry['eeg_bytes'] - header_bytes) / bytes_per_line)
+    entry['estimated_duration'] = entry['estimated_samples'] / sample_rate
+
+    return entry
+
+
+def scan_catalog(data_dir, files, index_file='cache/catalog.json', sample_rate=256):
+    """
+    Scan the recordings of data_dir. Entries of the index file are reused for files whose size and modification
+    time are unchanged, so only new or changed recordings are opened.
+
+    Parameters:
+    - data_dir: str, the folder with the recordings.
+    - files: list of str, the zip file names in data_dir (see file_list).
+    - index_file: str, the json file the catalog is kept in between runs.
+    - sample_rate: int, the sampling rate of the EEG data in Hz.
+
+    Returns:
+    - catalog: dict, file name -> entry (see scan_recording).
+    """
+    previous = {}
+    try:
+        with open(index_file, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get('version') == CATALOG_VERSION and index.get('sample_rate') == sample_rate:
+            previous = index['recordings']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    catalog = {}
+    for file in files:
+        stat = os.stat(f'{data_dir}/{file}')
+        entry = previous.get(file)
+        if entry is None or entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+            entry = scan_recording(f'{data_dir}/{file}', sample_rate)
+        catalog[file] = entry
+
+    os.makedirs(os.path.dirname(index_file) or '.', exist_ok=True)
+    with open(index_file, 'w', encoding='utf-8') as f:
+        json.dump({'version': CATALOG_VERSION, 'sample_rate': sample_rate, 'recordings': catalog}, f, indent=4, sort_keys=True)
+        f.write('\n')
+
+    return catalog
+
+
+def skip_reason(entry, min_duration=0):
+    """
+    Returns:
+    - reason: str, why the recording can not be processed, or None if it is viable.
+    """
+    if entry['error'] is not None:
+        return entry['error']
+    if entry['estimated_duration'] <= min_duration:
+        return f"too short ({entry['estimated_duration']:.0f}s, at least {min_duration}s needed)"
+    return None
+
+
+def viable_recordings(catalog, min_duration=0):
+    """
+    Select the recordings that can be processed, largest first, so long sessions are not left for the end.
+
+    Parameters:
+    - catalog: dict, see scan_catalog.
+    - min_duration: float, recordings of this length in seconds or shorter are skipped.
+
+    Returns:
+    - files: list of str, the viable file names ordered by size.
+    - skipped: dict, file name -> reason for the skipped recordings.
+    """
+    files = []
+    skipped = {}
+    for file, entry in catalog.items():
+        reason = skip_reason(entry, min_duration)
+        if reason is None:
+            files.append(file)
+        else:
+            skipped[file] = reason
+
+    files.sort(key=lambda file: catalog[file]['eeg_bytes'], reverse=True)
+
+    return files, skipped
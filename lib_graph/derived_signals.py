@@ -0,0 +1,79 @@
+import numpy as np
+from scipy.signal import hilbert
+
+from lib_graph.func_eeg_data import map_segments
+from lib_graph.func_filters import bandpass_filter_filtfilt, filter_bank
+from lib_graph.func_spectral import BANDS
+
+
+class DerivedSignals:
+    """
+    The band filtered signals and envelopes of one session. Like SpectralCache for the spectra, the plots and
+    statistics request them from here, so every band filter and Hilbert transform runs once per session.
+
+    Signals are keyed by (kind, channel, band, order):
+    - 'band': the zero-phase bandpass filtered channel (see bandpass_filter_filtfilt).
+    - 'envelope': |hilbert| of the band signal.
+    - 'bank': all bands of several channels at once (see filter_bank), float32.
+
+    With segments (see connected_segments) the filter and the Hilbert transform run per segment, the values in the
+    gaps are NaN (see map_segments).
+
+    Usage:
+        derived = DerivedSignals(eeg_data, sample_rate=256, segments=segments)
+        alpha_signal = derived.band_signal('electrodes_average', (8, 13))
+    """
+
+    def __init__(self, eeg_data, sample_rate=256, segments=None):
+        self.eeg_data = eeg_data
+        self.sample_rate = sample_rate
+        self.segments = segments
+        self._signals = {}
+
+    def band_signal(self, channel, band=(8, 13), order=5):
+        """
+        Parameters:
+        - channel: str, a column of the EEG data (e.g. 'electrodes_average').
+        - band: tuple, (lowcut, highcut) of the bandpass in Hz.
+        - order: int, the order of the Butterworth filter.
+
+        Returns:
+        - band_signal: ndarray, the filtered channel.
+        """
+        key = ('band', channel, band, order)
+        if key not in self._signals:
+            low, high = band
+            channel_data = self.eeg_data[channel].values
+            self._signals[key] = map_segments(channel_data, self.segments,
+                                              lambda part: bandpass_filter_filtfilt(part, low, high, self.sample_rate, order))
+
+        return self._signals[key]
+
+    def envelope(self, channel, band=(8, 13), order=5):
+        """
+        Returns:
+        - envelope: ndarray, the amplitude of the analytic signal of band_signal(channel, band, order).
+        """
+        key = ('envelope', channel, band, order)
+        if key not in self._signals:
+            band_signal = self.band_signal(channel, band, order)
+            self._signals[key] = map_segments(band_signal, self.segments, lambda part: np.abs(hilbert(part)))
+
+        return self._signals[key]
+
+    def filter_bank(self, channels, bands=BANDS, order=5):
+        """
+        Parameters:
+        - channels: list of str, columns of the EEG data.
+        - bands: dict, band name -> (lowcut, highcut) in Hz.
+        - order: int, the order of the Butterworth filters.
+
+        Returns:
+        - band_signals: float32 ndarray of shape (n_bands, n_channels, n_samples), in the order of bands and channels.
+        - envelopes: float32 ndarray of the same shape.
+        """
+        key = ('bank', tuple(channels), tuple(bands.items()), order)
+        if key not in self._signals:
+            self._signals[key] = filter_bank(self.eeg_data[channels].to_numpy(), self.sample_rate, bands, order, self.segments)
+
+        return self._signals[key]
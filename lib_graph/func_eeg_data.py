@@ -1,6 +1,31 @@
+import math
+
 import numpy as np
 import pandas as pd
-from Demos.getfilever import pairs
+from scipy import signal
+
+
+def _align_signal_quality(eeg_data, signal_quality_data, sample_frequency_signal_quality=256):
+    # Row position of the nearest signal quality sample for every EEG sample, with integer sample indices instead of
+    # a join on the float time_seconds. A slice if the EEG samples map to a contiguous range of signal quality rows.
+    # Both streams are recorded on a sample grid, the EEG data can have any sampling frequency (nearest sample).
+    target = np.rint(eeg_data['time_seconds'].to_numpy() * sample_frequency_signal_quality).astype(np.int64)
+    quality_index = np.rint(signal_quality_data['time_seconds'].to_numpy() * sample_frequency_signal_quality).astype(np.int64)
+
+    if len(target) == 0 or len(quality_index) == 0:
+        return np.zeros(len(target), dtype=np.int64)
+
+    if np.all(np.diff(quality_index) == 1):
+        # signal quality without gaps: the position is an offset
+        positions = target - quality_index[0]
+        if np.all(np.diff(positions) == 1) and positions[0] >= 0 and positions[-1] < len(quality_index):
+            return slice(positions[0], positions[-1] + 1)
+        return np.clip(positions, 0, len(quality_index) - 1)
+
+    # gaps in the signal quality data: nearest neighbour search
+    right = np.clip(np.searchsorted(quality_index, target), 1, len(quality_index) - 1)
+    left = right - 1
+    return np.where(target - quality_index[left] <= quality_index[right] - target, left, right)
 
 
 def remove_non_connected_electrode_parts(eeg_data, signal_quality_data, ignored_electrodes=None, truncate_only_beginning_and_end=True, sample_frequency_data=256, sample_frequency_signal_quality=256):
@@ -12,52 +37,190 @@ def remove_non_connected_electrode_parts(eeg_data, signal_quality_data, ignored_
     - signal_quality_data: DataFrame, the signal quality data.
     - ignored_electrodes: list of str, electrodes to ignore in the analysis.
     - truncate_only_beginning_and_end: bool, if True, only truncate non-connected parts at the beginning and end.
-    - sample_frequency_data: int, the sampling frequency of the EEG data.
+    - sample_frequency_data: int, the sampling frequency of the EEG data, not needed anymore: every EEG sample is
+      matched to the nearest signal quality sample by its time_seconds.
     - sample_frequency_signal_quality: int, the sampling frequency of the signal quality data.
 
     Returns:
-    - eeg_data_filtered: DataFrame, the EEG data with non-connected parts removed.
-    - signal_quality_data_filtered: DataFrame, the signal quality data corresponding to the filtered EEG data.
+    - eeg_data_filtered: DataFrame, the EEG data with non-connected parts removed, with the other columns of the
+      signal quality data (e.g. signal_is_good, sample_number) of the nearest signal quality sample. When only the
+      beginning and end are truncated, the EEG columns share the data with eeg_data. If no EEG sample is connected,
+      the data is not truncated at all.
+    - signal_quality_data_filtered: DataFrame, the signal quality columns corresponding to the filtered EEG data,
+      and its time_seconds.
+    Both are labelled with the row positions in the EEG data sorted by time_seconds.
     """
     if ignored_electrodes is None:
         ignored_electrodes = []
 
-    # Resample signal quality data if frequencies do not match
-    if sample_frequency_data != sample_frequency_signal_quality:
-        signal_quality_data = signal_quality_data.set_index('time_seconds').resample(f'{1/sample_frequency_data}S').ffill().reset_index()
+    if not eeg_data['time_seconds'].is_monotonic_increasing:
+        eeg_data = eeg_data.sort_values('time_seconds')
+    if not signal_quality_data['time_seconds'].is_monotonic_increasing:
+        signal_quality_data = signal_quality_data.sort_values('time_seconds')
 
-    # Merge EEG data with signal quality data
-    merged_data = pd.merge_asof(eeg_data.sort_values('time_seconds'),
-                                signal_quality_data.sort_values('time_seconds'),
-                                on='time_seconds',
-                                direction='nearest')
+    # Align the signal quality data with the EEG samples
+    positions = _align_signal_quality(eeg_data, signal_quality_data, sample_frequency_signal_quality)
 
     # Identify non-connected parts for each electrode
     electrodes = [electrode for electrode in ['tp9', 'af7', 'af8', 'tp10'] if electrode not in ignored_electrodes]
-    non_connected = merged_data[[f'signal_quality_{electrode}' for electrode in electrodes]].gt(1).any(axis=1)
+    quality = signal_quality_data[[f'signal_quality_{electrode}' for electrode in electrodes]].to_numpy()
+    non_connected = (quality[positions] > 1).any(axis=1)
 
     if truncate_only_beginning_and_end:
         # Find the first and last good signal
-        first_good_index = non_connected.idxmin()
-        last_good_index = non_connected[::-1].idxmin() + 1
-
-        # Ensure valid indices
-        if first_good_index >= last_good_index:
-            return pd.DataFrame(columns=eeg_data.columns), pd.DataFrame(columns=signal_quality_data.columns)
+        if non_connected.all():
+            # no connected sample, the data is kept as it is (like the idxmin of merge_asof did before)
+            first_good_index, last_good_index = 0, len(non_connected)
+        else:
+            first_good_index = int(np.argmin(non_connected))
+            last_good_index = len(non_connected) - int(np.argmin(non_connected[::-1]))
 
-        # Truncate data
-        eeg_data_filtered = merged_data.iloc[first_good_index:last_good_index].copy()
+        # Truncate data, a shallow copy shares the samples but can get its own columns (electrodes_average)
+        eeg_data_filtered = eeg_data.iloc[first_good_index:last_good_index].copy(deep=False)
+        labels = pd.RangeIndex(first_good_index, last_good_index)
+        if isinstance(positions, slice):
+            positions = slice(positions.start + first_good_index, positions.start + last_good_index)
+        else:
+            positions = positions[first_good_index:last_good_index]
     else:
         # Remove all non-connected parts
-        eeg_data_filtered = merged_data[~non_connected].copy()
+        eeg_data_filtered = eeg_data[~non_connected].copy()
+        labels = pd.Index(np.flatnonzero(~non_connected))
+        if isinstance(positions, slice):
+            positions = np.arange(positions.start, positions.stop)
+        positions = positions[~non_connected]
 
-    # Separate EEG data and signal quality data
-    signal_quality_columns = [col for col in merged_data.columns if 'signal_quality' in col]
-    signal_quality_data_filtered = eeg_data_filtered[signal_quality_columns + ['time_seconds']].copy()
-    eeg_data_filtered.drop(columns=signal_quality_columns, inplace=True)
+    # signal quality rows of the remaining EEG samples, on the EEG time axis and with the labels of the merge of both
+    # streams before
+    signal_quality_rows = signal_quality_data.iloc[positions]
+    eeg_data_filtered.index = labels
+    for column in signal_quality_rows.columns:
+        if 'signal_quality' not in column and column not in eeg_data_filtered.columns:
+            eeg_data_filtered[column] = signal_quality_rows[column].to_numpy()
+
+    signal_quality_data_filtered = signal_quality_rows[[column for column in signal_quality_rows.columns if 'signal_quality' in column]].copy()
+    signal_quality_data_filtered.index = labels
+    signal_quality_data_filtered['time_seconds'] = eeg_data_filtered['time_seconds'].to_numpy()
 
     return eeg_data_filtered, signal_quality_data_filtered
 
+def mask_to_segments(good, min_length=1):
+    """
+    Convert a boolean mask into the start and stop positions of its runs of True values.
+
+    Parameters:
+    - good: ndarray of bool.
+    - min_length: int, shorter runs are left out.
+
+    Returns:
+    - segments: ndarray of shape (n_segments, 2), [start, stop) positions.
+    """
+    edges = np.diff(np.concatenate(([0], good.astype(np.int8), [0])))
+    segments = np.column_stack((np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)))
+
+    return segments[segments[:, 1] - segments[:, 0] >= min_length]
+
+
+def connected_segments(signal_quality_data, ignored_electrodes=None, min_length=1):
+    """
+    Interval index of the parts of the recording where the electrodes were connected (signal quality <= 1).
+    Instead of copying the good samples into one signal with the gaps glued together, the analyses work on views of
+    the segments (see welch_segments, map_segments, SpectralCache).
+
+    Parameters:
+    - signal_quality_data: DataFrame, the signal quality data, aligned row by row with the EEG data (see
+      remove_non_connected_electrode_parts).
+    - ignored_electrodes: list of str, electrodes that are left out of the combined segments.
+    - min_length: int, segments shorter than this number of samples are left out.
+
+    Returns:
+    - segments: dict, electrode -> ndarray of shape (n_segments, 2) with the [start, stop) row positions of the
+      connected segments of the electrode, and 'combined' for the segments where all non-ignored electrodes were
+      connected.
+    """
+    if ignored_electrodes is None:
+        ignored_electrodes = []
+
+    electrodes = ['tp9', 'af7', 'af8', 'tp10']
+    connected = signal_quality_data[[f'signal_quality_{electrode}' for electrode in electrodes]].to_numpy() <= 1
+
+    segments = {electrode: mask_to_segments(connected[:, i], min_length) for i, electrode in enumerate(electrodes)}
+
+    used = [i for i, electrode in enumerate(electrodes) if electrode not in ignored_electrodes]
+    segments['combined'] = mask_to_segments(connected[:, used].all(axis=1), min_length)
+
+    return segments
+
+
+def map_segments(values, segments, func):
+    """
+    Apply func to every segment of values on its own, so filters do not run across the gaps between segments.
+
+    Parameters:
+    - values: ndarray, the signal.
+    - segments: ndarray of shape (n_segments, 2), or None to apply func to the whole signal.
+    - func: callable, takes a part of the signal and returns an array of the same length.
+
+    Returns:
+    - result: ndarray, the same length as values, NaN outside of the segments.
+    """
+    if segments is None:
+        return func(values)
+
+    result = np.full(len(values), np.nan)
+    for start, stop in segments:
+        result[start:stop] = func(values[start:stop])
+
+    return result
+
+
+def decimate_eeg_data(eeg_data, sample_rate=256, target_rate=128, segments=None, max_frequency=45):
+    """
+    Decimate all channels at once with a polyphase anti-aliasing filter (scipy.signal.resample_poly), for analyses
+    that only look at the low frequencies (below ~0.4 * target_rate). The input data is left unchanged.
+
+    The filter runs across the joins of removed parts, the samples next to a join are slightly smeared.
+
+    Parameters:
+    - eeg_data: DataFrame, the EEG data.
+    - sample_rate: int, the sampling rate of the EEG data in Hz.
+    - target_rate: int, the sampling rate after decimation, or None to keep the data as it is.
+    - segments: ndarray of shape (n_segments, 2), connected segments of eeg_data, converted to the target rate.
+    - max_frequency: float, the highest frequency the analyses look at (the upper edge of gamma), it has to stay
+      below the Nyquist frequency of the target rate.
+
+    Returns:
+    - decimated_data: DataFrame, with every column but time_seconds resampled, time_seconds and the index are taken
+      from the nearest earlier full-rate sample.
+    - target_rate: int, the sampling rate of decimated_data.
+    - decimated_segments: ndarray, the segments at the target rate (or None).
+    """
+    if target_rate is None or target_rate == sample_rate:
+        return eeg_data, sample_rate, segments
+    if target_rate > sample_rate:
+        raise ValueError("The target rate has to be lower than the sampling rate.")
+    if target_rate / 2 <= max_frequency:
+        raise ValueError(f"The target rate has to be above {2 * max_frequency} Hz to keep the frequencies up to {max_frequency} Hz.")
+
+    divisor = math.gcd(sample_rate, target_rate)
+    up, down = target_rate // divisor, sample_rate // divisor
+
+    channels = [channel for channel in eeg_data.columns if channel != 'time_seconds']
+    decimated = signal.resample_poly(eeg_data[channels].to_numpy(dtype=np.float64), up, down, axis=0)
+
+    positions = np.arange(len(decimated)) * down // up
+    decimated_data = pd.DataFrame(decimated, columns=channels, index=eeg_data.index[positions])
+    if 'time_seconds' in eeg_data.columns:
+        decimated_data.insert(0, 'time_seconds', eeg_data['time_seconds'].to_numpy()[positions])
+
+    if segments is not None:
+        # the decimated samples inside of every segment
+        segments = np.column_stack([-(-segments[:, 0] * up // down), segments[:, 1] * up // down])
+        segments = segments[segments[:, 1] > segments[:, 0]]
+
+    return decimated_data, target_rate, segments
+
+
 def fill_with_valid_data(eeg_data, electrode, bad_electrodes, pairs):
     if electrode not in bad_electrodes:
         return eeg_data[electrode].values
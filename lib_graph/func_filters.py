@@ -1,50 +1,136 @@
+from functools import lru_cache
+
+import numpy as np
 from scipy import signal
-from scipy.signal import filtfilt, butter, lfilter
+from scipy.signal import butter, hilbert, sosfilt, sosfiltfilt
+
+from lib_graph.func_spectral import BANDS
+
+
+@lru_cache(maxsize=64)
+def design_filter(filter_type, band, order, sample_rate):
+    """
+    Design a filter as second-order sections. The designs are cached, so the same filter is only designed once
+    per process.
+
+    Parameters:
+    - filter_type: str, 'bandpass' (Butterworth) or 'notch'.
+    - band: tuple (lowcut, highcut) in Hz for 'bandpass', (freq, quality_factor) for 'notch'.
+    - order: int, the order of the Butterworth filter (ignored for 'notch').
+    - sample_rate: int, the sampling rate of the data in Hz.
+
+    Returns:
+    - sos: ndarray of shape (n_sections, 6), shared by all callers, do not modify it.
+    """
+    if filter_type == 'bandpass':
+        sos = butter(order, band, btype='band', fs=sample_rate, output='sos')
+    elif filter_type == 'notch':
+        freq, quality_factor = band
+        sos = signal.tf2sos(*signal.iirnotch(freq, quality_factor, sample_rate))
+    else:
+        raise ValueError("Invalid filter type. Use 'bandpass' or 'notch'.")
+
+    return sos
+
+
+def apply_filter(data, sos, axis=0, filter_type='filtfilt'):
+    """
+    Filter all channels of data along axis in one call.
+
+    Parameters:
+    - data: ndarray, e.g. of shape (n_samples, n_channels).
+    - sos: ndarray, the second-order sections (see design_filter).
+    - axis: int, the time axis of data.
+    - filter_type: str, 'filtfilt' (zero-phase, forward and backward) or 'lfilter' (causal).
+
+    Returns:
+    - filtered: ndarray, of the shape of data.
+    """
+    if filter_type == 'filtfilt':
+        return sosfiltfilt(sos, data, axis=axis)
+    elif filter_type == 'lfilter':
+        return sosfilt(sos, data, axis=axis)
+    else:
+        raise ValueError("Invalid filter type. Use 'filtfilt' or 'lfilter'.")
+
+
+def filter_channels(data, sos, ignored_electrodes, filter_type='filtfilt', include_time=False):
+    """
+    Filter the channels of a DataFrame in one vectorized pass, the ignored electrodes are passed through unfiltered.
+
+    Returns:
+    - filtered_data: dict, channel -> ndarray, with the unfiltered time_seconds column only if include_time.
+    """
+    channels = [channel for channel in data.columns if channel != 'time_seconds' or include_time]
+    filtered_channels = [channel for channel in channels if channel != 'time_seconds' and channel not in ignored_electrodes]
+
+    filtered_data = {channel: data[channel].values for channel in channels}
+    if filtered_channels:
+        filtered = apply_filter(data[filtered_channels].to_numpy(dtype=np.float64), sos, axis=0, filter_type=filter_type)
+        for i, channel in enumerate(filtered_channels):
+            filtered_data[channel] = filtered[:, i]
+
+    return filtered_data
 
 
 def notch_filter(data, sample_rate, ignored_electrodes, freq=50.0, quality_factor=30.0):
-    b, a = signal.iirnotch(freq, quality_factor, sample_rate)
-    return {channel: (lfilter(b, a, data[channel]) if channel not in ignored_electrodes else data[channel])
-            for channel in data.columns if channel != 'time_seconds'}
+    sos = design_filter('notch', (freq, quality_factor), 2, sample_rate)
+    return filter_channels(data, sos, ignored_electrodes, filter_type='lfilter')
 
 
 
 
 def bandpass_filter_butter(data, lowcut, highcut, sample_rate, ignored_electrodes, order=5):
-    nyquist = 0.5 * sample_rate
-    low = lowcut / nyquist
-    high = highcut / nyquist
-    b, a = butter(order, [low, high], btype='band')
-    return {channel: (lfilter(b, a, data[channel]) if channel not in ignored_electrodes else data[channel])
-            for channel in data.columns if channel != 'time_seconds'}
+    sos = design_filter('bandpass', (lowcut, highcut), order, sample_rate)
+    return filter_channels(data, sos, ignored_electrodes, filter_type='lfilter')
 
-def bandpass_filter_filtfilt(data, lowcut, highcut, sample_rate, order=5):
-    nyquist = 0.5 * sample_rate
-    low = lowcut / nyquist
-    high = highcut / nyquist
-    b, a = butter(order, [low, high], btype='band')
-    return filtfilt(b, a, data)  # Use filtfilt for zero-phase filtering
+def bandpass_filter_filtfilt(data, lowcut, highcut, sample_rate, order=5, axis=-1):
+    sos = design_filter('bandpass', (lowcut, highcut), order, sample_rate)
+    return apply_filter(data, sos, axis=axis)  # Use filtfilt for zero-phase filtering
 
 
 def bandpass_filter_advanced(data, lowcut, highcut, sample_rate, ignored_electrodes, order=5, filter_type='filtfilt'):
-    nyquist = 0.5 * sample_rate
-    low = lowcut / nyquist
-    high = highcut / nyquist
-    b, a = butter(order, [low, high], btype='band')
-
-    def apply_filter(channel_data):
-        if filter_type == 'filtfilt':
-            return filtfilt(b, a, channel_data)
-        elif filter_type == 'lfilter':
-            return lfilter(b, a, channel_data)
-        else:
-            raise ValueError("Invalid filter type. Use 'filtfilt' or 'lfilter'.")
-
-    filtered_data = {}
-    for channel in data.columns:
-        if channel != 'time_seconds' and channel not in ignored_electrodes:
-            filtered_data[channel] = apply_filter(data[channel].values)
-        else:
-            filtered_data[channel] = data[channel].values
+    if filter_type not in ('filtfilt', 'lfilter'):
+        raise ValueError("Invalid filter type. Use 'filtfilt' or 'lfilter'.")
 
-    return filtered_data
+    sos = design_filter('bandpass', (lowcut, highcut), order, sample_rate)
+    return filter_channels(data, sos, ignored_electrodes, filter_type, include_time=True)
+
+
+def filter_bank(data, sample_rate=256, bands=BANDS, order=5, segments=None, envelope=True):
+    """
+    Band filter all channels into all bands, and optionally take the Hilbert envelopes, in one batched pass: every
+    band filter runs over all channels at once (zero-phase, see apply_filter) and the envelopes of all bands and
+    channels come from one Hilbert transform.
+
+    Parameters:
+    - data: ndarray of shape (n_samples, n_channels).
+    - sample_rate: int, the sampling rate of the data in Hz.
+    - bands: dict, band name -> (lowcut, highcut) in Hz, in the order of the first axis of the result.
+    - order: int, the order of the Butterworth filters.
+    - segments: ndarray of shape (n_segments, 2), filter every segment on its own, NaN in the gaps
+      (see map_segments). None filters the whole data.
+    - envelope: bool, also compute the envelopes.
+
+    Returns:
+    - band_signals: float32 ndarray of shape (n_bands, n_channels, n_samples).
+    - envelopes: float32 ndarray of the same shape, or None without envelope.
+    """
+    channels_first = np.ascontiguousarray(np.asarray(data, dtype=np.float64).T)
+    n_channels, n_samples = channels_first.shape
+
+    shape = (len(bands), n_channels, n_samples)
+    band_signals = np.full(shape, np.nan, dtype=np.float32)
+    envelopes = np.full(shape, np.nan, dtype=np.float32) if envelope else None
+
+    parts = [(0, n_samples)] if segments is None else segments
+    for start, stop in parts:
+        part = channels_first[:, start:stop]
+        filtered = np.stack([apply_filter(part, design_filter('bandpass', band, order, sample_rate), axis=-1)
+                             for band in bands.values()])
+
+        band_signals[:, :, start:stop] = filtered
+        if envelope:
+            envelopes[:, :, start:stop] = np.abs(hilbert(filtered, axis=-1))
+
+    return band_signals, envelopes
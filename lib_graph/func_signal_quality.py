@@ -1,59 +1,124 @@
+import numpy as np
 import pandas as pd
 
 
-def signal_quality_statistics(signal_quality_data, ignored_electrodes=None):
+ELECTRODES = ['tp9', 'af7', 'af8', 'tp10']
+
+
+class SignalQualityRuns:
     """
-    Calculate statistics for signal quality data, considering ignored electrodes.
+    Run-length statistics of the signal quality of all electrodes, computed with one vectorized pass over the
+    (n_samples, n_electrodes) quality matrix. A block is a run of the same non-good value (!= 1), as with a
+    groupby over signal_quality.ne(signal_quality.shift()).cumsum().
+
+    The data can be added in consecutive parts (see signal_quality_statistics_blocks), runs that continue from one
+    part into the next are counted once.
+    """
+
+    def __init__(self, electrodes=ELECTRODES):
+        self.electrodes = electrodes
+        self.total_signals = 0
+        self.non_good_signals = np.zeros(len(electrodes), dtype=np.int64)
+        self.non_connected_signals = np.zeros(len(electrodes), dtype=np.int64)
+        self.non_good_blocks = np.zeros(len(electrodes), dtype=np.int64)
+        self.max_block_length = np.zeros(len(electrodes), dtype=np.int64)
+        # the last value and the length of the run that is still open at the end of the data added so far
+        self.last_value = np.full(len(electrodes), np.nan)
+        self.open_run_length = np.zeros(len(electrodes), dtype=np.int64)
+
+    def add(self, signal_quality_data):
+        quality = signal_quality_data[[f'signal_quality_{electrode}' for electrode in self.electrodes]].to_numpy(dtype=float)
+        n_samples, n_electrodes = quality.shape
+        if n_samples == 0:
+            return
+
+        non_good = quality != 1
+
+        # a run starts where the value changes, the first row is compared with the end of the previous part
+        run_starts = np.empty(quality.shape, dtype=bool)
+        run_starts[0] = quality[0] != self.last_value
+        run_starts[1:] = quality[1:] != quality[:-1]
+
+        self.total_signals += n_samples
+        self.non_good_signals += non_good.sum(axis=0)
+        self.non_connected_signals += (quality > 1).sum(axis=0)
+        self.non_good_blocks += (run_starts & non_good).sum(axis=0)
+
+        # run lengths of all electrodes at once: walk the matrix column by column, every column begins a run
+        column_starts = run_starts.T.copy()
+        column_starts[:, 0] = True
+        run_index = np.flatnonzero(column_starts)
+        run_length = np.diff(np.append(run_index, n_samples * n_electrodes))
+        run_electrode = run_index // n_samples
+
+        # the first run of a column continues the open run of the previous part if the value did not change
+        continued = (run_index % n_samples == 0) & ~run_starts[0][run_electrode]
+        run_length[continued] += self.open_run_length[run_electrode[continued]]
+
+        run_non_good = non_good.T.ravel()[run_index]
+        np.maximum.at(self.max_block_length, run_electrode[run_non_good], run_length[run_non_good])
+
+        last_run = np.searchsorted(run_electrode, np.arange(n_electrodes), side='right') - 1
+        self.open_run_length = run_length[last_run]
+        self.last_value = quality[-1]
+
+    def statistics(self):
+        """
+        Returns:
+        - statistics: dict, electrode -> dict with the statistics of the electrode.
+        """
+        statistics = {}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for i, electrode in enumerate(self.electrodes):
+                non_good_signals = int(self.non_good_signals[i])
+                non_good_blocks = int(self.non_good_blocks[i])
+                good_percentage = 100 * (self.total_signals - non_good_signals) / self.total_signals if self.total_signals > 0 else np.nan
+
+                statistics[electrode] = {
+                    'Non-Good Signals': non_good_signals,
+                    'Non-Good Blocks': non_good_blocks,
+                    # the blocks together contain all non-good signals
+                    'Average Block Length': non_good_signals / non_good_blocks if non_good_blocks > 0 else 0,
+                    'Max Block Length': int(self.max_block_length[i]),
+                    'Good Percentage': good_percentage,
+                    'Non-Good Percentage': 100 - good_percentage
+                }
+
+        return statistics
+
+    def bad_electrodes(self, threshold=90):
+        """
+        Returns:
+        - bad_electrodes: list of str, electrodes with more than threshold percent non-connected (> 1) signals.
+        """
+        if self.total_signals == 0:
+            return []
+        non_connected_percentage = 100 * self.non_connected_signals / self.total_signals
+        return [electrode for electrode, percentage in zip(self.electrodes, non_connected_percentage) if percentage > threshold]
+
+
+def signal_quality_summary(signal_quality_data, threshold=90):
+    """
+    Calculate the statistics of all electrodes and identify the bad electrodes in one pass.
 
     Parameters:
     - signal_quality_data: DataFrame, the signal quality data.
-    - ignored_electrodes: list of str, electrodes to ignore in the analysis.
+    - threshold: float, the percentage threshold above which an electrode is considered bad.
 
     Returns:
-    - stats_df: DataFrame, statistics for non-ignored electrodes.
-    - stats_df_bad_electrodes: DataFrame, statistics for ignored electrodes.
+    - summary: dict, electrode -> statistics (Non-Good Signals, Non-Good Blocks, Average Block Length,
+      Max Block Length, Good Percentage, Non-Good Percentage).
+    - bad_electrodes: list of str, names of electrodes to ignore (see identify_bad_electrodes).
     """
-    if ignored_electrodes is None:
-        ignored_electrodes = []
+    runs = SignalQualityRuns()
+    runs.add(signal_quality_data)
+
+    return runs.statistics(), runs.bad_electrodes(threshold)
 
-    # Initialize results dictionaries
-    result = {}
-    bad_result = {}
-    electrodes = ['tp9', 'af7', 'af8', 'tp10']
-
-    for electrode in electrodes:
-        # Extract signal quality for the electrode
-        signal_quality = signal_quality_data[f'signal_quality_{electrode}']
-
-        # Count non-good signals
-        non_good_signals = (signal_quality != 1).sum()
-
-        # Detect blocks of non-good signals
-        blocks = (signal_quality != 1).astype(int).groupby(signal_quality.ne(signal_quality.shift()).cumsum()).sum()
-        non_good_blocks = blocks[blocks > 0]
-        total_non_good_blocks = len(non_good_blocks)
-        average_block_length = non_good_blocks.mean() if total_non_good_blocks > 0 else 0
-
-        # Calculate percentages
-        total_signals = len(signal_quality)
-        good_percentage = 100 * (total_signals - non_good_signals) / total_signals
-        non_good_percentage = 100 - good_percentage
-
-        # Store results in the appropriate dictionary
-        if electrode in ignored_electrodes:
-            bad_result[electrode] = {
-                'Non-Good Signals': non_good_signals,
-                'Average Block Length': average_block_length,
-                'Good Percentage': good_percentage,
-                'Non-Good Percentage': non_good_percentage
-            }
-        else:
-            result[electrode] = {
-                'Non-Good Signals': non_good_signals,
-                'Average Block Length': average_block_length,
-                'Good Percentage': good_percentage,
-                'Non-Good Percentage': non_good_percentage
-            }
+
+def _statistics_tables(summary, ignored_electrodes):
+    result = {electrode: statistics for electrode, statistics in summary.items() if electrode not in ignored_electrodes}
+    bad_result = {electrode: statistics for electrode, statistics in summary.items() if electrode in ignored_electrodes}
 
     # Convert results to DataFrames and transpose for better representation
     stats_df = pd.DataFrame(result).T
@@ -66,6 +131,28 @@ def signal_quality_statistics(signal_quality_data, ignored_electrodes=None):
     return stats_df, stats_df_bad_electrodes
 
 
+def signal_quality_statistics(signal_quality_data, ignored_electrodes=None, summary=None):
+    """
+    Calculate statistics for signal quality data, considering ignored electrodes.
+
+    Parameters:
+    - signal_quality_data: DataFrame, the signal quality data.
+    - ignored_electrodes: list of str, electrodes to ignore in the analysis.
+    - summary: dict, the result of signal_quality_summary() for this data, to avoid computing it again.
+
+    Returns:
+    - stats_df: DataFrame, statistics for non-ignored electrodes.
+    - stats_df_bad_electrodes: DataFrame, statistics for ignored electrodes.
+    """
+    if ignored_electrodes is None:
+        ignored_electrodes = []
+
+    if summary is None:
+        summary, _ = signal_quality_summary(signal_quality_data)
+
+    return _statistics_tables(summary, ignored_electrodes)
+
+
 
 def identify_bad_electrodes(signal_quality_data, threshold=90):
     """
@@ -78,14 +165,35 @@ def identify_bad_electrodes(signal_quality_data, threshold=90):
     Returns:
     - ignored_electrodes: list of str, names of electrodes to ignore.
     """
-    electrodes = ['tp9', 'af7', 'af8', 'tp10']
-    ignored_electrodes = []
+    _, ignored_electrodes = signal_quality_summary(signal_quality_data, threshold)
+
+    return ignored_electrodes
+
+
+def signal_quality_statistics_blocks(signal_quality_blocks, ignored_electrodes=None, threshold=90):
+    """
+    Calculate the signal quality statistics of a stream of non-overlapping signal quality blocks
+    (see iter_signal_quality_blocks) in a single pass. Blocks of non-good signals that span two stream blocks are
+    counted once.
+
+    Parameters:
+    - signal_quality_blocks: iterable of DataFrames, the signal quality data.
+    - ignored_electrodes: list of str, electrodes to ignore in the analysis (default None, use the bad electrodes).
+    - threshold: float, the percentage threshold above which an electrode is considered bad.
 
-    for electrode in electrodes:
-        signal_quality = signal_quality_data[f'signal_quality_{electrode}']
-        non_good_percentage = (signal_quality > 1).mean() * 100
+    Returns:
+    - stats_df: DataFrame, statistics for non-ignored electrodes (see signal_quality_statistics).
+    - stats_df_bad_electrodes: DataFrame, statistics for ignored electrodes.
+    - bad_electrodes: list of str, the electrodes identified as bad (see identify_bad_electrodes).
+    """
+    runs = SignalQualityRuns()
+    for signal_quality_block in signal_quality_blocks:
+        runs.add(signal_quality_block)
+
+    bad_electrodes = runs.bad_electrodes(threshold)
+    if ignored_electrodes is None:
+        ignored_electrodes = bad_electrodes
 
-        if non_good_percentage > threshold:
-            ignored_electrodes.append(electrode)
+    stats_df, stats_df_bad_electrodes = _statistics_tables(runs.statistics(), ignored_electrodes)
 
-    return ignored_electrodes
\ No newline at end of file
+    return stats_df, stats_df_bad_electrodes, bad_electrodes
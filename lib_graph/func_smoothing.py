@@ -0,0 +1,72 @@
+import numpy as np
+from scipy.signal import lfilter
+
+
+def seconds_to_samples(seconds, sample_rate=256):
+    """
+    Returns:
+    - window_size: int, the number of samples of a window of the given length in seconds (at least 1).
+    """
+    return max(1, int(round(seconds * sample_rate)))
+
+
+def moving_average(data, window_size, edge='zeros'):
+    """
+    Centered running mean over window_size samples from a cumulative sum, O(n) for any window size. The window
+    of sample i covers i - window_size // 2 up to i + (window_size - 1) // 2, as np.convolve(..., mode='same').
+
+    Parameters:
+    - data: ndarray, the signal.
+    - window_size: int, the window length in samples.
+    - edge: str, 'zeros' pads with zeros like np.convolve(data, np.ones(window_size) / window_size, mode='same'), so
+      the mean falls off towards the edges, 'shrink' averages over the samples inside the data instead.
+
+    Returns:
+    - smoothed: ndarray, the same length as data.
+    """
+    if edge not in ('shrink', 'zeros'):
+        raise ValueError("Invalid edge. Use 'shrink' or 'zeros'.")
+
+    data = np.asarray(data, dtype=np.float64)
+    n = len(data)
+
+    cumulative = np.zeros(n + 1)
+    np.cumsum(data, out=cumulative[1:])
+
+    positions = np.arange(n)
+    low = np.clip(positions - window_size // 2, 0, n)
+    high = np.clip(positions + (window_size - 1) // 2 + 1, 0, n)
+
+    window_sum = cumulative[high] - cumulative[low]
+    if edge == 'zeros':
+        return window_sum / window_size
+    return window_sum / (high - low)
+
+
+def moving_average_seconds(data, seconds, sample_rate=256, edge='zeros'):
+    """
+    Centered running mean over a window of the given length in seconds (see moving_average).
+    """
+    return moving_average(data, seconds_to_samples(seconds, sample_rate), edge)
+
+
+def exponential_smoothing(data, seconds, sample_rate=256):
+    """
+    Causal exponential smoothing with a time constant in seconds, a recursive running mean that costs the same for
+    any time constant. The filter starts at the first value of data, so there is no ramp up from zero.
+
+    Parameters:
+    - data: ndarray, the signal.
+    - seconds: float, the time constant, after which a step has reached ~63% of its height.
+    - sample_rate: int, the sampling rate of the data in Hz.
+
+    Returns:
+    - smoothed: ndarray, the same length as data.
+    """
+    data = np.asarray(data, dtype=np.float64)
+    if len(data) == 0:
+        return data
+
+    alpha = 1 - np.exp(-1 / (seconds * sample_rate))
+    smoothed, _ = lfilter([alpha], [1, alpha - 1], data, zi=[(1 - alpha) * data[0]])
+    return smoothed
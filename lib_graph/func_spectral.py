@@ -0,0 +1,380 @@
+from functools import lru_cache
+
+import numpy as np
+from scipy import fft, signal
+
+from lib_graph.load_recording import EEG_COLUMNS
+
+
+# Frequency bands in Hz
+BANDS = {
+    'delta': (0.5, 4),
+    'theta': (4, 8),
+    'alpha': (8, 13),
+    'beta': (13, 30),
+    'gamma': (30, 45)
+}
+
+
+# band power ratios of the band power time series, name -> (numerator band, denominator band)
+BAND_RATIOS = {
+    'theta_beta': ('theta', 'beta'),
+    'alpha_theta': ('alpha', 'theta')
+}
+
+# worker threads of the FFTs, -1 uses all cores (see set_fft_workers)
+FFT_WORKERS = -1
+
+
+def set_fft_workers(workers):
+    """
+    Set the worker threads of the FFTs of this process, e.g. 1 in the worker processes of a pool that already uses
+    the cores, as initializer of the pool.
+    """
+    global FFT_WORKERS
+    FFT_WORKERS = workers
+
+
+def fft_length(n_samples, fast_length=False):
+    """
+    Returns:
+    - n_fft: int, the transform length for n_samples: n_samples itself, or with fast_length the next 5-smooth
+      length (only prime factors 2, 3 and 5) the data is zero padded to.
+    """
+    return fft.next_fast_len(n_samples, real=True) if fast_length else n_samples
+
+
+def fft_resolution(n_samples, sample_rate=256, fast_length=False):
+    """
+    The frequency resolution of an FFT of n_samples. Zero padding to a fast length places the bins closer together,
+    the spectrum is interpolated between the exact bins of n_samples.
+
+    Returns:
+    - resolution: dict, with n_samples, n_fft, resolution_hz (bin spacing of the transform) and exact_resolution_hz
+      (bin spacing without padding).
+    """
+    n_fft = fft_length(n_samples, fast_length)
+    return {
+        'n_samples': int(n_samples),
+        'n_fft': int(n_fft),
+        'resolution_hz': sample_rate / n_fft if n_fft else None,
+        'exact_resolution_hz': sample_rate / n_samples if n_samples else None
+    }
+
+
+@lru_cache(maxsize=32)
+def _cached_window(window, n_samples):
+    # the same window lengths come up again for every channel and period, so they are only computed once
+    window_values = signal.get_window(window, n_samples)
+    window_values.flags.writeable = False
+    return window_values
+
+
+def amplitude_spectrum(data, sample_rate=256, window=None, fast_length=False, workers=None):
+    """
+    Amplitude spectrum |rfft| along the last axis of data.
+
+    Parameters:
+    - data: ndarray, the signal(s), transformed along the last axis.
+    - sample_rate: int, the sampling rate of the EEG data in Hz.
+    - window: str, window applied before the FFT (default None: no window).
+    - fast_length: bool, zero pad to the next 5-smooth length (see fft_length). Faster for lengths with large
+      prime factors, but the bins are no longer placed at multiples of sample_rate / n_samples.
+    - workers: int, worker threads of the FFT (default FFT_WORKERS).
+
+    Returns:
+    - freqs: ndarray, the frequencies.
+    - amplitudes: ndarray, the amplitude spectrum.
+    """
+    if workers is None:
+        workers = FFT_WORKERS
+    n_samples = data.shape[-1]
+    if window is not None:
+        data = data * _cached_window(window, n_samples)
+
+    n_fft = fft_length(n_samples, fast_length)
+    return fft.rfftfreq(n_fft, d=1 / sample_rate), np.abs(fft.rfft(data, n=n_fft, axis=-1, workers=workers))
+
+
+def _welch_parts(parts, sample_rate=256, nperseg=256, noverlap=None, window='hann'):
+    # Welch PSD of several parts of a signal without segments across the part borders: every part is transformed
+    # on its own and the PSDs are averaged, weighted by their number of Welch segments.
+    if noverlap is None:
+        noverlap = nperseg // 2  # Default overlap
+    step = nperseg - noverlap
+
+    freqs = None
+    psd_sum = None
+    total_segments = 0
+
+    for part in parts:
+        # parts shorter than one segment have no segment of their own
+        if len(part) < nperseg:
+            continue
+
+        freqs, psd = signal.welch(part, sample_rate, window=window, nperseg=nperseg, noverlap=noverlap, axis=0)
+        segments = (len(part) - noverlap) // step
+
+        psd_sum = psd * segments if psd_sum is None else psd_sum + psd * segments
+        total_segments += segments
+
+    if total_segments == 0:
+        raise ValueError("The EEG data is shorter than nperseg.")
+
+    return freqs, psd_sum / total_segments
+
+
+def welch_psd_blocks(eeg_blocks, channels=EEG_COLUMNS, sample_rate=256, nperseg=256, noverlap=None):
+    """
+    Welch PSD of a stream of EEG blocks (see iter_data_blocks), without holding the whole recording in memory.
+
+    Every block is transformed on its own and the block PSDs are averaged, weighted by their number of Welch
+    segments. If consecutive blocks overlap by noverlap samples and block_size - noverlap is a multiple of
+    nperseg - noverlap, the result is the same as signal.welch over the complete data.
+
+    Parameters:
+    - eeg_blocks: iterable of DataFrames, the EEG blocks.
+    - channels: list of str, the channels to transform.
+    - sample_rate: int, the sampling rate of the EEG data in Hz.
+    - nperseg: int, length of a Welch segment in samples.
+    - noverlap: int, overlap of the Welch segments (default nperseg // 2).
+
+    Returns:
+    - freqs: ndarray, the frequencies of the PSD.
+    - psd: dict, channel -> ndarray with the PSD of the channel.
+    """
+    parts = (eeg_block[channels].to_numpy() for eeg_block in eeg_blocks)
+    freqs, psd = _welch_parts(parts, sample_rate, nperseg, noverlap)
+
+    return freqs, {channel: psd[:, i] for i, channel in enumerate(channels)}
+
+
+def welch_segments(data, segments, sample_rate=256, nperseg=256, noverlap=None, window='hann'):
+    """
+    Welch PSD of the connected segments of a signal (see connected_segments). No Welch segment spans the gap
+    between two connected segments, segments shorter than nperseg are left out.
+
+    Parameters:
+    - data: ndarray, of shape (n_samples,) or (n_samples, n_channels).
+    - segments: ndarray of shape (n_segments, 2), start and stop positions of the connected segments.
+    - sample_rate: int, the sampling rate of the EEG data in Hz.
+    - nperseg: int, length of a Welch segment in samples.
+    - noverlap: int, overlap of the Welch segments (default nperseg // 2).
+    - window: str, the window of the Welch segments.
+
+    Returns:
+    - freqs: ndarray, the frequencies of the PSD.
+    - psd: ndarray, the PSD along the first axis of data.
+    """
+    return _welch_parts((data[start:stop] for start, stop in segments), sample_rate, nperseg, noverlap, window)
+
+
+def band_power_from_psd(freqs, psd, bands=BANDS):
+    """
+    Integrate a PSD over frequency bands.
+
+    Parameters:
+    - freqs: ndarray, the frequencies of the PSD.
+    - psd: dict, channel -> ndarray with the PSD of the channel.
+    - bands: dict, band name -> (low, high) in Hz, low is inclusive and high exclusive.
+
+    Returns:
+    - band_power: dict, band name -> {channel: power}.
+    """
+    df = freqs[1] - freqs[0]
+    band_power = {}
+    for band, (low, high) in bands.items():
+        band_mask = (freqs >= low) & (freqs < high)
+        band_power[band] = {channel: float(np.sum(channel_psd[band_mask]) * df) for channel, channel_psd in psd.items()}
+
+    return band_power
+
+
+def band_power_blocks(eeg_blocks, channels=EEG_COLUMNS, sample_rate=256, nperseg=256, noverlap=None, bands=BANDS):
+    """
+    Absolute band power of a stream of EEG blocks, from the block-wise Welch PSD (see welch_psd_blocks).
+
+    Returns:
+    - band_power: dict, band name -> {channel: power}.
+    """
+    freqs, psd = welch_psd_blocks(eeg_blocks, channels, sample_rate, nperseg, noverlap)
+    return band_power_from_psd(freqs, psd, bands)
+
+
+def band_power_segments(eeg_data, segments, channels=EEG_COLUMNS, sample_rate=256, nperseg=256, noverlap=None, bands=BANDS):
+    """
+    Absolute band power of the connected segments of the EEG data (see welch_segments).
+
+    Returns:
+    - band_power: dict, band name -> {channel: power}.
+    """
+    freqs, psd = welch_segments(eeg_data[channels].to_numpy(), segments, sample_rate, nperseg, noverlap)
+    return band_power_from_psd(freqs, {channel: psd[:, i] for i, channel in enumerate(channels)}, bands)
+
+
+def band_power_series(freqs, Sxx, bands=BANDS, ratios=BAND_RATIOS):
+    """
+    Band power time series of a spectrogram (see SpectralCache.spectrogram). The bins of every band are summed with
+    one product of the band masks and the spectrogram, for all channels and times at once.
+
+    Parameters:
+    - freqs: ndarray, the frequencies of the spectrogram.
+    - Sxx: ndarray of shape (n_channels, n_freqs, n_times), NaN columns (e.g. across gaps, see
+      SpectralCache.spectrogram with mask_gaps) stay NaN in all series.
+    - bands: dict, band name -> (low, high) in Hz, low is inclusive and high exclusive.
+    - ratios: dict, ratio name -> (numerator band, denominator band).
+
+    Returns:
+    - series: dict, with float32 arrays
+      - absolute: (n_bands, n_channels, n_times), the band power.
+      - relative: (n_bands, n_channels, n_times), the band power as a fraction of the power of all bands.
+      - ratios: (n_ratios, n_channels, n_times), the band power ratios.
+    """
+    df = freqs[1] - freqs[0]
+    band_masks = np.array([(freqs >= low) & (freqs < high) for low, high in bands.values()], dtype=Sxx.dtype)
+
+    absolute = np.einsum('bf,cft->bct', band_masks, Sxx) * df
+    total = absolute.sum(axis=0)
+
+    band_index = {band: i for i, band in enumerate(bands)}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        relative = absolute / total
+        ratio_series = np.array([absolute[band_index[numerator]] / absolute[band_index[denominator]]
+                                 for numerator, denominator in ratios.values()]).reshape(len(ratios), *total.shape)
+
+    return {
+        'absolute': absolute.astype(np.float32),
+        'relative': relative.astype(np.float32),
+        'ratios': ratio_series.astype(np.float32)
+    }
+
+
+def save_band_power_series(filename, times, series, channels, bands=BANDS, ratios=BAND_RATIOS):
+    """
+    Save the band power time series (see band_power_series) of a session to one .npz file, with the times and the
+    names of the bands, channels and ratios along the axes.
+    """
+    np.savez_compressed(filename, times=times.astype(np.float32), bands=np.array(list(bands)), channels=np.array(channels),
+                        ratio_names=np.array(list(ratios)), **series)
+
+
+def stft_valid_columns(n_columns, step, nperseg, segments=None):
+    """
+    Returns:
+    - valid: bool ndarray, for every STFT column (starting at multiples of step) whether it lies completely inside
+      one of the segments (see connected_segments), all True without segments.
+    """
+    if segments is None:
+        return np.ones(n_columns, dtype=bool)
+
+    column_starts = np.arange(n_columns) * step
+    valid = np.zeros(n_columns, dtype=bool)
+    for start, stop in segments:
+        valid |= (column_starts >= start) & (column_starts + nperseg <= stop)
+
+    return valid
+
+
+class PsdPyramid:
+    """
+    Welch PSDs of periods of any multiple of a base length, built from one spectrogram (hann, see
+    SpectralCache.psd_pyramid) without transforming the data again.
+
+    Every STFT column is summed into the base block it starts in, columns that reach into the next block are kept
+    apart. The PSD of a period of several blocks is the sum of its blocks, plus the columns between its blocks,
+    divided by the number of columns, which is the Welch PSD of the period.
+
+    Usage:
+        pyramid = spectra.psd_pyramid(channels, base_length=10)
+        starts, lengths, psd, counts = pyramid.periods(300 * 256)
+    """
+
+    def __init__(self, freqs, Sxx, n_samples, base_samples, nperseg, step, segments=None):
+        if base_samples % step or nperseg > base_samples:
+            raise ValueError("The base length has to be a multiple of nperseg - noverlap and at least nperseg.")
+
+        self.freqs = freqs
+        self.n_samples = n_samples
+        self.base_samples = base_samples
+        self.n_blocks = -(-n_samples // base_samples)
+
+        n_channels, n_freqs, n_columns = Sxx.shape
+        column_starts = np.arange(n_columns) * step
+        block = column_starts // base_samples
+        crossing = column_starts + nperseg > (block + 1) * base_samples
+        valid = stft_valid_columns(n_columns, step, nperseg, segments)
+
+        columns = Sxx.transpose(2, 0, 1)  # (columns, channels, freqs)
+        self.inner_sum = np.zeros((self.n_blocks, n_channels, n_freqs))
+        self.crossing_sum = np.zeros((self.n_blocks, n_channels, n_freqs))
+        np.add.at(self.inner_sum, block[valid & ~crossing], columns[valid & ~crossing])
+        np.add.at(self.crossing_sum, block[valid & crossing], columns[valid & crossing])
+        self.inner_count = np.bincount(block[valid & ~crossing], minlength=self.n_blocks)
+        self.crossing_count = np.bincount(block[valid & crossing], minlength=self.n_blocks)
+
+    def periods(self, period_samples):
+        """
+        Parameters:
+        - period_samples: int, the period length in samples, a multiple of the base length.
+
+        Returns:
+        - starts: ndarray, the first sample of every period.
+        - lengths: ndarray, the length of every period in samples, the last period is shorter if the data does not
+          fill it.
+        - psd: ndarray of shape (n_periods, n_channels, n_freqs), NaN for periods without a Welch segment.
+        - counts: ndarray, the number of Welch segments of every period.
+        """
+        if period_samples % self.base_samples:
+            raise ValueError("The period length has to be a multiple of the base length.")
+
+        blocks_per_period = period_samples // self.base_samples
+        n_periods = -(-self.n_blocks // blocks_per_period)
+        padding = n_periods * blocks_per_period - self.n_blocks
+
+        def grouped(values):
+            padded = np.concatenate([values, np.zeros((padding,) + values.shape[1:], dtype=values.dtype)])
+            return padded.reshape((n_periods, blocks_per_period) + values.shape[1:])
+
+        # the columns reaching out of the last block of a period belong to the next period
+        inner_sum, crossing_sum = grouped(self.inner_sum), grouped(self.crossing_sum)
+        inner_count, crossing_count = grouped(self.inner_count), grouped(self.crossing_count)
+        psd_sum = inner_sum.sum(axis=1) + crossing_sum[:, :-1].sum(axis=1)
+        counts = inner_count.sum(axis=1) + crossing_count[:, :-1].sum(axis=1)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            psd = psd_sum / counts[:, np.newaxis, np.newaxis]
+
+        starts = np.arange(n_periods) * period_samples
+        lengths = np.minimum(period_samples, self.n_samples - starts)
+
+        return starts, lengths, psd, counts
+
+
+def band_power_periods(pyramid, periode_length=600, channels=EEG_COLUMNS, sample_rate=256, bands=BANDS):
+    """
+    Absolute band power of consecutive periods from a PsdPyramid.
+
+    Parameters:
+    - pyramid: PsdPyramid, of the channels.
+    - periode_length: int, the length of a period in seconds.
+    - channels: list of str, the channels of the pyramid.
+
+    Returns:
+    - results: list of dict, with periode_start, periode_length and band_power (band name -> {channel: power},
+      None for periods without a Welch segment).
+    """
+    starts, lengths, psd, counts = pyramid.periods(periode_length * sample_rate)
+
+    results = []
+    for start, length, period_psd, count in zip(starts, lengths, psd, counts):
+        band_power = None
+        if count > 0:
+            band_power = band_power_from_psd(pyramid.freqs, {channel: period_psd[i] for i, channel in enumerate(channels)}, bands)
+
+        results.append({
+            'periode_start': int(start // sample_rate),
+            'periode_length': int(length / sample_rate),
+            'band_power': band_power
+        })
+
+    return results
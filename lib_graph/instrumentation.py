@@ -0,0 +1,207 @@
+import json
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+
+TIMINGS_FILE = 'timings.json'
+
+
+def _max_rss_mb():
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on linux
+    return max_rss / 2**20 if sys.platform == 'darwin' else max_rss / 2**10
+
+
+def _rss_mb():
+    # the current RSS, only available on linux
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 2**20
+    except (OSError, AttributeError, IndexError, ValueError):
+        return None
+
+
+def input_sizes(inputs):
+    """
+    Parameters:
+    - inputs: dict, name -> value.
+
+    Returns:
+    - sizes: dict, name -> size in bytes of the arrays and DataFrames in inputs, other values are left out.
+    """
+    sizes = {}
+    for name, value in inputs.items():
+        if isinstance(value, np.ndarray):
+            sizes[name] = int(value.nbytes)
+        elif isinstance(value, (pd.DataFrame, pd.Series)):
+            # without deep, so object columns are not walked
+            sizes[name] = int(np.sum(value.memory_usage(index=True)))
+    return sizes
+
+
+class Timings:
+    """
+    Wall time, CPU time, memory and input sizes of the stages of one session (see Pipeline.run), saved as
+    timings.json next to statistics.json. When a pipeline runs without a Timings object the stages are called
+    directly, so disabled instrumentation costs nothing.
+
+    Memory is the change of the current RSS during a stage (on linux) and the increase of the peak RSS of the
+    process. The peak RSS is the highest RSS the process ever had, so in a reused pool worker it only grows in the
+    stages that need more memory than any earlier session, and is ~0 for the others. With trace_memory also the peak
+    and the change of the memory allocated by python and numpy (tracemalloc, which slows down the allocations, the
+    tracing ends with save or close). The peaks of stages that run at the same time (stage_workers > 1) include
+    each other.
+
+    Usage:
+        timings = Timings()
+        with timings.measure('load_recording'):
+            eeg_data = recording.read_eeg()
+        timings.save(f'{cache_dir}/timings.json')
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.records = []
+        self._lock = threading.Lock()
+        self._frames = threading.local()
+        # only the tracing this object started is stopped again, not the one of an enclosing tool
+        self._started_tracing = trace_memory and not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+
+    @contextmanager
+    def measure(self, name, inputs=None):
+        """
+        Record the block as one entry of the timings.
+
+        Parameters:
+        - name: str, the name of the stage.
+        - inputs: dict, name -> value of the inputs of the stage, see input_sizes.
+        """
+        record = {'stage': name, 'input_bytes': input_sizes(inputs or {})}
+        frames = self._frames.__dict__.setdefault('stack', [])
+        if self.trace_memory:
+            # the peak of an enclosing block is kept in its frame, reset_peak below would lose it
+            current, peak = tracemalloc.get_traced_memory()
+            if frames:
+                frames[-1]['peak'] = max(frames[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+        frame = {'peak': 0, 'memory': current if self.trace_memory else 0}
+        frames.append(frame)
+
+        rss = _rss_mb()
+        max_rss = _max_rss_mb()
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield record
+        finally:
+            record['wall_s'] = time.perf_counter() - wall
+            record['cpu_s'] = time.thread_time() - cpu
+            if rss is not None:
+                record['rss_mb'] = _rss_mb()
+                record['rss_increase_mb'] = record['rss_mb'] - rss
+            if max_rss is not None:
+                record['max_rss_mb'] = _max_rss_mb()
+                record['max_rss_increase_mb'] = record['max_rss_mb'] - max_rss
+
+            frames.pop()
+            if self.trace_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                peak = max(frame['peak'], peak)
+                if frames:
+                    frames[-1]['peak'] = max(frames[-1]['peak'], peak)
+                record['memory_peak_mb'] = (peak - frame['memory']) / 2**20
+                record['memory_delta_mb'] = (current - frame['memory']) / 2**20
+
+            with self._lock:
+                self.records.append(record)
+
+    def close(self):
+        """
+        Stop the memory tracing, if this object started it, so later sessions in the same process run at full speed.
+        """
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def save(self, filename):
+        """
+        Write the records to filename as json, in the order the stages finished, and stop the memory tracing (see
+        close).
+        """
+        self.close()
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump({'trace_memory': self.trace_memory, 'stages': self.records}, f, indent=4)
+            f.write('\n')
+
+
+def summarize_timings(filenames):
+    """
+    Aggregate the timings.json of several sessions per stage.
+
+    Parameters:
+    - filenames: list of str, timings.json files, missing files are left out.
+
+    Returns:
+    - summary: dict, stage -> count, wall_s_total, wall_s_mean, wall_s_max, cpu_s_total, rss_increase_mb_max,
+      max_rss_increase_mb_max (and memory_peak_mb_max of traced sessions), sorted by wall_s_total, the slowest first.
+    """
+    stages = {}
+    for filename in filenames:
+        try:
+            with open(filename, 'r', encoding='utf-8') as f:
+                records = json.load(f)['stages']
+        except (OSError, ValueError, KeyError):
+            continue
+        for record in records:
+            stages.setdefault(record['stage'], []).append(record)
+
+    summary = {}
+    for stage, records in stages.items():
+        wall = [record['wall_s'] for record in records]
+        summary[stage] = {
+            'count': len(records),
+            'wall_s_total': sum(wall),
+            'wall_s_mean': sum(wall) / len(wall),
+            'wall_s_max': max(wall),
+            'cpu_s_total': sum(record['cpu_s'] for record in records),
+            'rss_increase_mb_max': max((record.get('rss_increase_mb', 0) for record in records), default=0),
+            'max_rss_increase_mb_max': max((record.get('max_rss_increase_mb', 0) for record in records), default=0),
+        }
+        memory_peaks = [record['memory_peak_mb'] for record in records if 'memory_peak_mb' in record]
+        if memory_peaks:
+            summary[stage]['memory_peak_mb_max'] = max(memory_peaks)
+
+    return dict(sorted(summary.items(), key=lambda item: item[1]['wall_s_total'], reverse=True))
+
+
+def write_run_timings(session_dirs, filename, top=10):
+    """
+    Write the run level report of the timings.json in session_dirs to filename and print the slowest stages.
+
+    Returns:
+    - summary: dict, see summarize_timings.
+    """
+    summary = summarize_timings([f'{session_dir}/{TIMINGS_FILE}' for session_dir in session_dirs])
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump({'sessions': len(session_dirs), 'stages': summary}, f, indent=4)
+        f.write('\n')
+
+    for stage, stats in list(summary.items())[:top]:
+        print(f"{stage:<55} {stats['wall_s_total']:8.2f}s total {stats['wall_s_mean']:7.2f}s mean  {stats['count']} runs")
+
+    return summary
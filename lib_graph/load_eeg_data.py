@@ -1,12 +1,8 @@
-import io
-import math
-import re
-import zipfile
+from lib_graph.load_recording import EEG_COLUMNS, MuseRecording
+from lib_graph.sample_cache import SampleCache
 
-import pandas as pd
 
-
-def load_data(filename, keep_channels=['tp9', 'af7', 'af8', 'tp10'], sample_rate=256, load_from=0, load_until=None, max_duration=None, col_separator=','):
+def load_data(filename, keep_channels=EEG_COLUMNS, sample_rate=256, load_from=0, load_until=None, max_duration=None, col_separator=',', cache_dir=None, compact=False):
     """
     Load EEG data from a CSV file, which might be inside a zip archive. Assumes column order if no header is present.
 
@@ -17,65 +13,32 @@ def load_data(filename, keep_channels=['tp9', 'af7', 'af8', 'tp10'], sample_rate
     - load_from: float, start loading data from this time in seconds (default 0).
     - load_until: float, stop loading data at this time in seconds (default None, load until end).
     - max_duration: float, maximum duration to load in seconds (overrides load_until if set).
+    - cache_dir: str, directory of the decoded sample cache, see SampleCache (default None, no cache).
+    - compact: bool, only parse the keep_channels and return them as float32 EegSamples (default False).
 
     Returns:
     - eeg_data: DataFrame, contains the time series data for the specified channels within the time range.
+      With compact=True an EegSamples with one (n_samples, n_channels) float32 array, the time is derived from
+      start_sample / sample_rate.
     """
-    # Define default column names if no header is provided
-    default_columns = ['tp9', 'af7', 'af8', 'tp10']
-
-
-    # Function to check if a line contains letters
-    def contains_letters(line):
-        return bool(re.search('[a-zA-Z]', line))
-
-    # Determine if the file is a zip or a csv
-    if filename.endswith('.zip'):
-        with zipfile.ZipFile(filename, 'r') as zip_ref:
-            csv_file_name = [name for name in zip_ref.namelist() if name.endswith('_eeg.csv')][0]
-            with zip_ref.open(csv_file_name) as csv_file:
-                # Check if the CSV has a header
-                first_line = csv_file.readline().decode('utf-8').strip()
-                csv_file.seek(0)  # Reset file pointer to the start
-                has_header = contains_letters(first_line)
-
-                if has_header:
-                    eeg_df = pd.read_csv(io.TextIOWrapper(csv_file), sep=col_separator)
-                else:
-                    eeg_df = pd.read_csv(io.TextIOWrapper(csv_file), sep=col_separator, header=None, names=default_columns)
-    else:
-        # Check if the CSV file has a header
-        with open(filename, 'r') as f:
-            first_line = f.readline().strip()
-        has_header = contains_letters(first_line)
-
-        if has_header:
-            eeg_df = pd.read_csv(filename, sep=col_separator)
-        else:
-            eeg_df = pd.read_csv(filename, sep=col_separator, header=None, names=default_columns)
-
-    # Calculate sample indices based on time parameters
-    start_sample = math.floor(load_from * sample_rate)
-    if max_duration is not None:
-        end_sample = start_sample + math.floor(max_duration * sample_rate)
-    elif load_until is not None:
-        end_sample = math.floor(load_until * sample_rate)
-    else:
-        end_sample = None
+    cache = SampleCache(cache_dir) if cache_dir is not None else None
+    with MuseRecording(filename, col_separator=col_separator, cache=cache) as recording:
+        return recording.read_eeg(keep_channels, sample_rate, load_from, load_until, max_duration, compact)
 
-    # Slice the dataframe based on calculated samples
-    eeg_df = eeg_df.iloc[start_sample:end_sample]
-
-    # Add sample number and convert to time in seconds
-    eeg_df['sample_number'] = range(start_sample, start_sample + len(eeg_df))
-    eeg_df['time_seconds'] = eeg_df['sample_number'] / sample_rate
-
-    # Ensure keep_channels are valid
-    valid_channels = [channel for channel in keep_channels if channel in eeg_df.columns]
-    if not valid_channels:
-        raise ValueError("None of the keep_channels are recognized or present in the data.")
+def iter_data_blocks(filename, block_size, overlap=0, keep_channels=EEG_COLUMNS, sample_rate=256, load_from=0, load_until=None, max_duration=None, col_separator=',', cache_dir=None):
+    """
+    Stream EEG data in fixed-size blocks straight from the CSV (or the zip member), for recordings that are too long
+    to be loaded at once. Only the part of the file that has been consumed is decompressed and parsed.
 
-    # Select only the channels we want to keep
-    eeg_data = eeg_df[valid_channels + ['time_seconds']].copy()
+    Parameters:
+    - filename: str, path to the CSV or ZIP file containing the CSV.
+    - block_size: int, number of samples per block.
+    - overlap: int, number of samples shared by consecutive blocks (default 0).
+    - keep_channels, sample_rate, load_from, load_until, max_duration, col_separator, cache_dir: see load_data().
 
-    return eeg_data
\ No newline at end of file
+    Yields:
+    - eeg_block: DataFrame, the channels and time_seconds of one block (the last block may be shorter).
+    """
+    cache = SampleCache(cache_dir) if cache_dir is not None else None
+    with MuseRecording(filename, col_separator=col_separator, cache=cache) as recording:
+        yield from recording.iter_eeg_blocks(block_size, overlap, keep_channels, sample_rate, load_from, load_until, max_duration)
@@ -0,0 +1,418 @@
+import io
+import math
+import re
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from lib_graph.sample_cache import SampleCache, recording_fingerprint
+
+
+# Define default column names if no header is provided
+EEG_COLUMNS = ['tp9', 'af7', 'af8', 'tp10']
+SIGNAL_QUALITY_COLUMNS = ['signal_is_good', 'signal_quality_tp9', 'signal_quality_af7', 'signal_quality_af8', 'signal_quality_tp10']
+
+
+def contains_letters(line):
+    # a header line contains the column names, the data lines only numbers
+    return bool(re.search('[a-zA-Z]', line))
+
+
+def sample_range(sample_rate, load_from=0, load_until=None, max_duration=None):
+    """
+    Convert a time window in seconds into sample indices.
+
+    Parameters:
+    - sample_rate: int, the sampling rate of the data in Hz.
+    - load_from: float, start of the window in seconds.
+    - load_until: float, end of the window in seconds (None for the end of the recording).
+    - max_duration: float, maximum duration of the window in seconds (overrides load_until if set).
+
+    Returns:
+    - start_sample, end_sample: int, int or None
+    """
+    start_sample = math.floor(load_from * sample_rate)
+    if max_duration is not None:
+        end_sample = start_sample + math.floor(max_duration * sample_rate)
+    elif load_until is not None:
+        end_sample = math.floor(load_until * sample_rate)
+    else:
+        end_sample = None
+
+    return start_sample, end_sample
+
+
+class EegSamples:
+    """
+    Compact EEG data: one contiguous float32 array of shape (n_samples, n_channels). The time of a sample is derived
+    from start_sample and sample_rate instead of being stored next to it.
+    """
+
+    def __init__(self, data, channels, start_sample=0, sample_rate=256):
+        self.data = data
+        self.channels = channels
+        self.start_sample = start_sample
+        self.sample_rate = sample_rate
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, channel):
+        # a view on the column of the channel
+        return self.data[:, self.channels.index(channel)]
+
+    @property
+    def time_seconds(self):
+        return (self.start_sample + np.arange(len(self.data))) / self.sample_rate
+
+    def to_dataframe(self):
+        """
+        Returns:
+        - eeg_data: DataFrame, in the same layout as returned by load_data() (channels and time_seconds).
+        """
+        eeg_data = pd.DataFrame(self.data, columns=self.channels, index=range(self.start_sample, self.start_sample + len(self.data)))
+        eeg_data['time_seconds'] = self.time_seconds
+        return eeg_data
+
+
+class MuseRecording:
+    """
+    A recording of the muse-eeg-osc-recorder. The zip archive is opened once and both the _eeg.csv and the
+    _signal_quality.csv member are read from the same handle. A plain csv file is read as either of them.
+
+    Usage:
+        with MuseRecording('out_eeg/session.zip') as recording:
+            eeg_data, signal_quality_data = recording.read(load_from=300, load_until=1600)
+
+    With a SampleCache the decoded samples of a zip are stored on the first read and every later read only slices
+    the memory-mapped cache file.
+    """
+
+    def __init__(self, filename, col_separator=',', cache=None):
+        self.filename = filename
+        self.col_separator = col_separator
+        self.cache = cache
+        self.zip_ref = None
+        self._fingerprint = None
+        self.eeg_member = None
+        self.signal_quality_member = None
+
+        if filename.endswith('.zip'):
+            self.zip_ref = zipfile.ZipFile(filename, 'r')
+            for name in self.zip_ref.namelist():
+                if name.endswith('_eeg.csv') and self.eeg_member is None:
+                    self.eeg_member = name
+                elif name.endswith('_signal_quality.csv') and self.signal_quality_member is None:
+                    self.signal_quality_member = name
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self.zip_ref is not None:
+            self.zip_ref.close()
+            self.zip_ref = None
+
+    def fingerprint(self):
+        if self._fingerprint is None:
+            self._fingerprint = recording_fingerprint(self.filename, self.zip_ref)
+        return self._fingerprint
+
+    def _read_window(self, stream, member, default_columns, start_sample, end_sample, cached_columns=None, usecols=None, dtype=None, empty_dtype=np.float64):
+        # csv files are not cached, their content hash would need a full read anyway
+        if self.cache is None or self.zip_ref is None:
+            return self._read_csv(member, default_columns, start_sample, end_sample, usecols, dtype, empty_dtype)
+
+        samples, columns = self.cache.load(self.fingerprint(), stream)
+        if samples is None:
+            # decode the complete member once, all later reads only slice the cache file
+            df = self._read_csv(member, default_columns)
+            columns = [column for column in df.columns if cached_columns is None or column in cached_columns]
+            self.cache.store(self.fingerprint(), stream, df[columns].to_numpy(), columns)
+
+            df = df[self._select_columns(columns, usecols)].iloc[start_sample:end_sample]
+            df.index = range(start_sample, start_sample + len(df))
+            return df if dtype is None else df.astype(dtype)
+
+        selected = self._select_columns(columns, usecols)
+        window = np.asarray(samples[start_sample:end_sample, [columns.index(column) for column in selected]], dtype=dtype)
+        return pd.DataFrame(window, columns=selected, index=range(start_sample, start_sample + len(window)))
+
+    @staticmethod
+    def _select_columns(columns, usecols):
+        if usecols is None:
+            return list(columns)
+
+        selected = [column for column in usecols if column in columns]
+        if not selected:
+            raise ValueError("None of the keep_channels are recognized or present in the data.")
+        return selected
+
+    def _read_csv(self, member, default_columns, start_sample=0, end_sample=None, usecols=None, dtype=None, empty_dtype=np.float64):
+        # Only the rows of [start_sample, end_sample) are parsed: the rows before are skipped by the tokenizer
+        # and the reader stops after end_sample, so the rest of the member is never decompressed.
+        # An empty window (past the end, or end_sample before start_sample) gets the columns as dtype, or as
+        # empty_dtype, like the slice of the complete csv, pandas would make them object columns.
+        nrows = None if end_sample is None else max(end_sample - start_sample, 0)
+
+        if self.zip_ref is None:
+            # Check if the CSV file has a header
+            with open(self.filename, 'r') as f:
+                first_line = f.readline().strip()
+            df = self._parse_csv(self.filename, first_line, default_columns, start_sample, nrows, usecols, dtype)
+        else:
+            if member is None:
+                raise FileNotFoundError(f"No matching csv file found in {self.filename}.")
+
+            with self.zip_ref.open(member) as csv_file:
+                # Check if the CSV has a header
+                first_line = csv_file.readline().decode('utf-8').strip()
+                csv_file.seek(0)  # Reset file pointer to the start
+                df = self._parse_csv(io.TextIOWrapper(csv_file), first_line, default_columns, start_sample, nrows, usecols, dtype)
+
+        if df.empty:
+            df = df.astype(dtype or empty_dtype)
+
+        # keep the row labels of the full recording
+        df.index = range(start_sample, start_sample + len(df))
+
+        return df
+
+    def _parse_csv(self, source, first_line, default_columns, start_sample, nrows, usecols=None, dtype=None, chunksize=None):
+        if contains_letters(first_line):
+            # parse the header on its own, so an integer skiprows can jump over the header and the skipped rows
+            names = list(pd.read_csv(io.StringIO(first_line), sep=self.col_separator, nrows=0).columns)
+            skiprows = start_sample + 1
+        else:
+            names = default_columns
+            skiprows = start_sample
+
+        if usecols is None:
+            return pd.read_csv(source, sep=self.col_separator, header=None, names=names, skiprows=skiprows, nrows=nrows, dtype=dtype, chunksize=chunksize)
+
+        # only the selected columns are converted, in the order they were requested
+        selected = self._select_columns(names, usecols)
+        df = pd.read_csv(source, sep=self.col_separator, header=None, names=names, usecols=selected, skiprows=skiprows, nrows=nrows, dtype=dtype, chunksize=chunksize)
+        if chunksize is not None:
+            return (chunk[selected] for chunk in df)
+        return df[selected]
+
+    def _iter_window(self, stream, member, default_columns, start_sample, end_sample, chunk_size, usecols=None, dtype=None):
+        # Yields the rows of [start_sample, end_sample) in chunks of chunk_size rows, read from the sample cache if
+        # the recording is already cached, otherwise straight from the (zip) csv.
+        samples = None
+        if self.cache is not None and self.zip_ref is not None:
+            samples, columns = self.cache.load(self.fingerprint(), stream)
+
+        if samples is not None and (usecols is None or all(column in columns for column in usecols)):
+            selected = self._select_columns(columns, usecols)
+            indices = [columns.index(column) for column in selected]
+            end_sample = len(samples) if end_sample is None else min(end_sample, len(samples))
+            for chunk_start in range(start_sample, end_sample, chunk_size):
+                chunk_end = min(chunk_start + chunk_size, end_sample)
+                yield pd.DataFrame(np.asarray(samples[chunk_start:chunk_end, indices], dtype=dtype), columns=selected, index=range(chunk_start, chunk_end))
+            return
+
+        nrows = None if end_sample is None else max(end_sample - start_sample, 0)
+        if nrows == 0:
+            return
+
+        if self.zip_ref is None:
+            with open(self.filename, 'r') as f:
+                first_line = f.readline().strip()
+            chunks = self._parse_csv(self.filename, first_line, default_columns, start_sample, nrows, usecols, dtype, chunksize=chunk_size)
+            yield from self._label_chunks(chunks, start_sample)
+        else:
+            if member is None:
+                raise FileNotFoundError(f"No matching csv file found in {self.filename}.")
+
+            # the member stays open while the caller consumes the chunks, only the consumed part is decompressed
+            with self.zip_ref.open(member) as csv_file:
+                first_line = csv_file.readline().decode('utf-8').strip()
+                csv_file.seek(0)  # Reset file pointer to the start
+                chunks = self._parse_csv(io.TextIOWrapper(csv_file), first_line, default_columns, start_sample, nrows, usecols, dtype, chunksize=chunk_size)
+                yield from self._label_chunks(chunks, start_sample)
+
+    @staticmethod
+    def _label_chunks(chunks, start_sample):
+        # keep the row labels of the full recording
+        for chunk in chunks:
+            chunk.index = range(start_sample, start_sample + len(chunk))
+            start_sample += len(chunk)
+            yield chunk
+
+    @staticmethod
+    def _iter_blocks(chunks, block_size, overlap):
+        # regroup the chunks into blocks of block_size rows, each block starts block_size - overlap rows after
+        # the previous one. The last block is shorter if the data does not fill it.
+        if block_size <= 0 or not 0 <= overlap < block_size:
+            raise ValueError("block_size must be positive and overlap in [0, block_size).")
+
+        buffer = None
+        yielded = False
+        for chunk in chunks:
+            buffer = chunk if buffer is None else pd.concat([buffer, chunk])
+            while len(buffer) >= block_size:
+                yield buffer.iloc[:block_size].copy()
+                yielded = True
+                buffer = buffer.iloc[block_size - overlap:]
+
+        # the remaining rows, unless they are only the overlap of the last block
+        if buffer is not None and len(buffer) > (overlap if yielded else 0):
+            yield buffer.copy()
+
+    def iter_eeg_blocks(self, block_size, overlap=0, keep_channels=EEG_COLUMNS, sample_rate=256, load_from=0, load_until=None, max_duration=None):
+        """
+        Read the EEG data block by block, without loading the whole recording.
+
+        Parameters:
+        - block_size: int, number of samples per block.
+        - overlap: int, number of samples shared by consecutive blocks (default 0).
+        - keep_channels, sample_rate, load_from, load_until, max_duration: see read_eeg().
+
+        Yields:
+        - eeg_block: DataFrame, the specified channels and time_seconds of block_size samples (the last block may
+          be shorter), in the same layout as read_eeg().
+        """
+        start_sample, end_sample = sample_range(sample_rate, load_from, load_until, max_duration)
+        chunks = self._iter_window('eeg', self.eeg_member, EEG_COLUMNS, start_sample, end_sample, block_size - overlap, usecols=keep_channels)
+
+        for eeg_block in self._iter_blocks(chunks, block_size, overlap):
+            eeg_block['time_seconds'] = eeg_block.index.to_numpy() / sample_rate
+            yield eeg_block
+
+    def iter_signal_quality_blocks(self, block_size, overlap=0, sample_rate=256, load_from=0, load_until=None, max_duration=None):
+        """
+        Read the signal quality data block by block, without loading the whole recording.
+
+        Parameters:
+        - block_size: int, number of samples per block.
+        - overlap: int, number of samples shared by consecutive blocks (default 0).
+        - sample_rate, load_from, load_until, max_duration: see read_signal_quality().
+
+        Yields:
+        - signal_quality_block: DataFrame, in the same layout as read_signal_quality().
+        """
+        start_sample, end_sample = sample_range(sample_rate, load_from, load_until, max_duration)
+        chunks = self._iter_window('signal_quality', self.signal_quality_member, SIGNAL_QUALITY_COLUMNS, start_sample, end_sample, block_size - overlap)
+
+        for signal_quality_block in self._iter_blocks(chunks, block_size, overlap):
+            signal_quality_block['sample_number'] = signal_quality_block.index.to_numpy()
+            signal_quality_block['time_seconds'] = signal_quality_block['sample_number'] / sample_rate
+            yield signal_quality_block
+
+    def read_eeg(self, keep_channels=EEG_COLUMNS, sample_rate=256, load_from=0, load_until=None, max_duration=None, compact=False):
+        """
+        Read the EEG data of the recording. Assumes column order if no header is present.
+
+        Parameters:
+        - keep_channels: list of str, names of the channels to keep (must match predefined names if no header).
+        - sample_rate: int, the sampling rate of the EEG data in Hz.
+        - load_from: float, start loading data from this time in seconds (default 0).
+        - load_until: float, stop loading data at this time in seconds (default None, load until end).
+        - max_duration: float, maximum duration to load in seconds (overrides load_until if set).
+        - compact: bool, return an EegSamples (float32, only the keep_channels) instead of a DataFrame.
+
+        Returns:
+        - eeg_data: DataFrame, contains the time series data for the specified channels within the time range.
+        """
+        if compact:
+            return self.read_eeg_samples(keep_channels, sample_rate, load_from, load_until, max_duration)
+
+        # Only parse the rows within the time range
+        start_sample, end_sample = sample_range(sample_rate, load_from, load_until, max_duration)
+        if all(channel in EEG_COLUMNS for channel in keep_channels):
+            eeg_df = self._read_window('eeg', self.eeg_member, EEG_COLUMNS, start_sample, end_sample, cached_columns=EEG_COLUMNS)
+        else:
+            eeg_df = self._read_csv(self.eeg_member, EEG_COLUMNS, start_sample, end_sample)
+
+        # Add sample number and convert to time in seconds
+        eeg_df['sample_number'] = range(start_sample, start_sample + len(eeg_df))
+        eeg_df['time_seconds'] = eeg_df['sample_number'] / sample_rate
+
+        # Ensure keep_channels are valid
+        valid_channels = [channel for channel in keep_channels if channel in eeg_df.columns]
+        if not valid_channels:
+            raise ValueError("None of the keep_channels are recognized or present in the data.")
+
+        # Select only the channels we want to keep
+        return eeg_df[valid_channels + ['time_seconds']].copy()
+
+    def read_eeg_samples(self, keep_channels=EEG_COLUMNS, sample_rate=256, load_from=0, load_until=None, max_duration=None):
+        """
+        Read the EEG data of the recording in compact form: only the keep_channels are parsed, directly as float32.
+        Parameters are the same as for read_eeg().
+
+        Returns:
+        - eeg_samples: EegSamples, the samples as one contiguous (n_samples, n_channels) float32 array.
+        """
+        start_sample, end_sample = sample_range(sample_rate, load_from, load_until, max_duration)
+        if all(channel in EEG_COLUMNS for channel in keep_channels):
+            eeg_df = self._read_window('eeg', self.eeg_member, EEG_COLUMNS, start_sample, end_sample, cached_columns=EEG_COLUMNS, usecols=keep_channels, dtype=np.float32)
+        else:
+            eeg_df = self._read_csv(self.eeg_member, EEG_COLUMNS, start_sample, end_sample, usecols=keep_channels, dtype=np.float32)
+
+        data = np.ascontiguousarray(eeg_df.to_numpy(dtype=np.float32))
+        return EegSamples(data, list(eeg_df.columns), start_sample=start_sample, sample_rate=sample_rate)
+
+    def read_signal_quality(self, sample_rate=256, load_from=0, load_until=None, max_duration=None):
+        """
+        Read the signal quality data of the recording.
+
+        Parameters:
+        - sample_rate: int, the sampling rate of the data in Hz.
+        - load_from: float, start loading data from this time in seconds (default 0).
+        - load_until: float, stop loading data at this time in seconds (default None, load until end).
+        - max_duration: float, maximum duration to load in seconds (overrides load_until if set).
+
+        Returns:
+        - signal_quality_data: DataFrame, contains the signal quality data within the time range.
+        """
+        # Only parse the rows within the time range
+        start_sample, end_sample = sample_range(sample_rate, load_from, load_until, max_duration)
+        signal_quality_df = self._read_window('signal_quality', self.signal_quality_member, SIGNAL_QUALITY_COLUMNS, start_sample, end_sample, empty_dtype=np.int64)
+
+        # Add sample number and convert to time in seconds
+        signal_quality_df['sample_number'] = range(start_sample, start_sample + len(signal_quality_df))
+        signal_quality_df['time_seconds'] = signal_quality_df['sample_number'] / sample_rate
+
+        return signal_quality_df
+
+    def read(self, keep_channels=EEG_COLUMNS, sample_rate=256, load_from=0, load_until=None, max_duration=None):
+        """
+        Read the EEG and the signal quality data of the recording for the same time range.
+
+        Returns:
+        - eeg_data: DataFrame, see read_eeg().
+        - signal_quality_data: DataFrame, see read_signal_quality().
+        """
+        eeg_data = self.read_eeg(keep_channels, sample_rate, load_from, load_until, max_duration)
+        signal_quality_data = self.read_signal_quality(sample_rate, load_from, load_until, max_duration)
+
+        return eeg_data, signal_quality_data
+
+
+def load_recording(filename, keep_channels=EEG_COLUMNS, sample_rate=256, load_from=0, load_until=None, max_duration=None, col_separator=',', cache_dir=None):
+    """
+    Load the EEG and the signal quality data of a recording while opening the zip archive only once.
+
+    Parameters:
+    - filename: str, path to the ZIP file (or a single CSV file).
+    - keep_channels: list of str, names of the EEG channels to keep.
+    - sample_rate: int, the sampling rate of the data in Hz.
+    - load_from: float, start loading data from this time in seconds (default 0).
+    - load_until: float, stop loading data at this time in seconds (default None, load until end).
+    - max_duration: float, maximum duration to load in seconds (overrides load_until if set).
+    - cache_dir: str, directory of the decoded sample cache (default None, no cache).
+
+    Returns:
+    - eeg_data: DataFrame, the EEG channels and time_seconds.
+    - signal_quality_data: DataFrame, the signal quality columns, sample_number and time_seconds.
+    """
+    cache = SampleCache(cache_dir) if cache_dir is not None else None
+    with MuseRecording(filename, col_separator=col_separator, cache=cache) as recording:
+        return recording.read(keep_channels, sample_rate, load_from, load_until, max_duration)
@@ -1,12 +1,8 @@
-import io
-import math
-import re
-import zipfile
+from lib_graph.load_recording import MuseRecording
+from lib_graph.sample_cache import SampleCache
 
-import pandas as pd
 
-
-def load_signal_quality(filename, sample_rate=256, load_from=0, load_until=None, max_duration=None, col_separator=','):
+def load_signal_quality(filename, sample_rate=256, load_from=0, load_until=None, max_duration=None, col_separator=',', cache_dir=None):
     """
     Load signal quality data from a CSV file, which might be inside a zip archive.
 
@@ -16,56 +12,28 @@ def load_signal_quality(filename, sample_rate=256, load_from=0, load_until=None,
     - load_from: float, start loading data from this time in seconds (default 0).
     - load_until: float, stop loading data at this time in seconds (default None, load until end).
     - max_duration: float, maximum duration to load in seconds (overrides load_until if set).
+    - cache_dir: str, directory of the decoded sample cache, see SampleCache (default None, no cache).
 
     Returns:
     - signal_quality_data: DataFrame, contains the signal quality data within the time range.
     """
-    # Define default column names for signal quality data
-    default_columns = ['signal_is_good', 'signal_quality_tp9', 'signal_quality_af7', 'signal_quality_af8', 'signal_quality_tp10']
-
-    # Function to check if a line contains letters
-    def contains_letters(line):
-        return bool(re.search('[a-zA-Z]', line))
-
-    # Determine if the file is a zip or a csv
-    if filename.endswith('.zip'):
-        with zipfile.ZipFile(filename, 'r') as zip_ref:
-            csv_file_name = [name for name in zip_ref.namelist() if name.endswith('_signal_quality.csv')][0]
-            with zip_ref.open(csv_file_name) as csv_file:
-                # Check if the CSV has a header
-                first_line = csv_file.readline().decode('utf-8').strip()
-                csv_file.seek(0)  # Reset file pointer to the start
-                has_header = contains_letters(first_line)
-
-                if has_header:
-                    signal_quality_df = pd.read_csv(io.TextIOWrapper(csv_file), sep=col_separator)
-                else:
-                    signal_quality_df = pd.read_csv(io.TextIOWrapper(csv_file), sep=col_separator, header=None, names=default_columns)
-    else:
-        # Check if the CSV file has a header
-        with open(filename, 'r') as f:
-            first_line = f.readline().strip()
-        has_header = contains_letters(first_line)
-
-        if has_header:
-            signal_quality_df = pd.read_csv(filename, sep=col_separator)
-        else:
-            signal_quality_df = pd.read_csv(filename, sep=col_separator, header=None, names=default_columns)
+    cache = SampleCache(cache_dir) if cache_dir is not None else None
+    with MuseRecording(filename, col_separator=col_separator, cache=cache) as recording:
+        return recording.read_signal_quality(sample_rate, load_from, load_until, max_duration)
 
-    # Calculate sample indices based on time parameters
-    start_sample = math.floor(load_from * sample_rate)
-    if max_duration is not None:
-        end_sample = start_sample + math.floor(max_duration * sample_rate)
-    elif load_until is not None:
-        end_sample = math.floor(load_until * sample_rate)
-    else:
-        end_sample = None
-
-    # Slice the dataframe based on calculated samples
-    signal_quality_df = signal_quality_df.iloc[start_sample:end_sample]
+def iter_signal_quality_blocks(filename, block_size, overlap=0, sample_rate=256, load_from=0, load_until=None, max_duration=None, col_separator=',', cache_dir=None):
+    """
+    Stream signal quality data in fixed-size blocks straight from the CSV (or the zip member).
 
-    # Add sample number and convert to time in seconds
-    signal_quality_df['sample_number'] = range(start_sample, start_sample + len(signal_quality_df))
-    signal_quality_df['time_seconds'] = signal_quality_df['sample_number'] / sample_rate
+    Parameters:
+    - filename: str, path to the CSV or ZIP file containing the CSV.
+    - block_size: int, number of samples per block.
+    - overlap: int, number of samples shared by consecutive blocks (default 0).
+    - sample_rate, load_from, load_until, max_duration, col_separator, cache_dir: see load_signal_quality().
 
-    return signal_quality_df
+    Yields:
+    - signal_quality_block: DataFrame, the signal quality data of one block (the last block may be shorter).
+    """
+    cache = SampleCache(cache_dir) if cache_dir is not None else None
+    with MuseRecording(filename, col_separator=col_separator, cache=cache) as recording:
+        yield from recording.iter_signal_quality_blocks(block_size, overlap, sample_rate, load_from, load_until, max_duration)
@@ -0,0 +1,180 @@
+import threading
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+
+
+class Stage:
+    """
+    One node of a Pipeline.
+
+    Parameters:
+    - name: str, unique name of the stage.
+    - function: callable, called with the values of inputs as positional arguments. Returns the value of output, or
+      a tuple with one value per output.
+    - inputs: list of str, names of values produced by other stages or given to Pipeline.run.
+    - outputs: str or tuple of str, the names of the values the stage produces (default name).
+    - exclusive: bool, the stage never runs at the same time as another exclusive stage (e.g. pyplot, which is not
+      thread safe).
+    - lookup: callable, called with the values of lookup_inputs before the other inputs are computed. Returns the
+      result of the stage if it is already known (e.g. a cached artifact), or None if the stage has to run.
+    - lookup_inputs: list of str, a subset of inputs that is cheap to compute (e.g. the key of the artifact).
+    """
+
+    def __init__(self, name, function, inputs=(), outputs=None, exclusive=False, lookup=None, lookup_inputs=()):
+        self.name = name
+        self.function = function
+        self.inputs = list(inputs)
+        self.single_output = outputs is None or isinstance(outputs, str)
+        self.outputs = (outputs or name,) if self.single_output else tuple(outputs)
+        self.exclusive = exclusive
+        self.lookup = lookup
+        self.lookup_inputs = list(lookup_inputs)
+
+    def __repr__(self):
+        return f'Stage({self.name!r}, inputs={self.inputs}, outputs={self.outputs})'
+
+
+class Pipeline:
+    """
+    A DAG of named stages with declared inputs and outputs. run() computes the requested values, only the stages
+    they depend on run, each of them once. A value is released as soon as no remaining stage reads it, and
+    independent stages can run in a thread pool. Stages with a lookup are looked up first, the stages that are found
+    do not run, and neither do the stages only they depend on.
+
+    Usage:
+        pipeline = Pipeline()
+        pipeline.add('load', load_recording, outputs=('eeg_data', 'signal_quality_data'))
+        pipeline.add('average', add_average, ['eeg_data'], outputs='eeg_data_average')
+        values = pipeline.run(['eeg_data_average'])
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._producers = {}
+
+    def add(self, name, function, inputs=(), outputs=None, exclusive=False, lookup=None, lookup_inputs=()):
+        """
+        Add a stage, see Stage for the parameters.
+
+        Returns:
+        - stage: Stage, the added stage.
+        """
+        stage = Stage(name, function, inputs, outputs, exclusive, lookup, lookup_inputs)
+        if name in self.stages:
+            raise ValueError(f'duplicate stage {name!r}')
+        for output in stage.outputs:
+            if output in self._producers:
+                raise ValueError(f'{output!r} is produced by {self._producers[output].name!r} and {name!r}')
+
+        self.stages[name] = stage
+        for output in stage.outputs:
+            self._producers[output] = stage
+        return stage
+
+    def required_stages(self, targets, available=()):
+        """
+        Returns:
+        - stages: list of Stage, the stages needed for targets, without the ones whose outputs are available, in the
+          order they were added.
+        """
+        required = set()
+        missing = list(targets)
+        while missing:
+            name = missing.pop()
+            if name in available:
+                continue
+            if name not in self._producers:
+                raise ValueError(f'no stage produces {name!r}')
+            stage = self._producers[name]
+            if stage.name not in required:
+                required.add(stage.name)
+                missing.extend(stage.inputs)
+
+        return [stage for stage in self.stages.values() if stage.name in required]
+
+    def run(self, targets, values=None, workers=1, timings=None):
+        """
+        Compute targets.
+
+        Parameters:
+        - targets: list of str, the names of the requested values.
+        - values: dict, values that are already known (e.g. from an earlier run), their stages do not run. The dict is
+          used in place, values that are no longer needed are removed from it, so they can be freed.
+        - workers: int, the number of threads for independent stages, 1 runs the stages one after the other.
+        - timings: Timings, records every stage (see instrumentation), None calls the stages directly.
+
+        Returns:
+        - values: dict, name -> value of targets.
+        """
+        values = {} if values is None else values
+        keep = set(targets)
+
+        lookups = [stage for stage in self.required_stages(targets, values) if stage.lookup is not None]
+        if lookups:
+            # the inputs of the lookups first, the values the other stages read are kept for the second pass
+            read = {name for stage in self.required_stages(targets, values) for name in stage.inputs}
+            self._execute(list(dict.fromkeys(name for stage in lookups for name in stage.lookup_inputs)), values, workers, timings, keep | read)
+            for stage in lookups:
+                result = stage.lookup(*[values[name] for name in stage.lookup_inputs])
+                if result is not None:
+                    values.update(zip(stage.outputs, (result,) if stage.single_output else result))
+
+            # release the values that only the stages that were found would have read
+            read = {name for stage in self.required_stages(targets, values) for name in stage.inputs}
+            for name in [name for name in values if name not in keep | read]:
+                del values[name]
+
+        self._execute(targets, values, workers, timings, keep)
+        return {name: values[name] for name in targets}
+
+    def _execute(self, targets, values, workers, timings, keep):
+        # runs the stages of targets, without their lookups, the values in keep are not released
+        pending = self.required_stages(targets, values)
+        # how many of the pending stages read a value, it is released when none is left
+        readers = Counter(name for stage in pending for name in stage.inputs)
+        exclusive_lock = threading.Lock()
+
+        def call(stage, arguments):
+            # measured inside the lock, so the time waiting for another exclusive stage is not counted
+            with exclusive_lock if stage.exclusive else nullcontext():
+                if timings is None:
+                    return stage.function(*arguments)
+                with timings.measure(stage.name, dict(zip(stage.inputs, arguments))):
+                    return stage.function(*arguments)
+
+        def finish(stage, result):
+            results = (result,) if stage.single_output else result
+            for name, value in zip(stage.outputs, results):
+                if readers[name] or name in keep:
+                    values[name] = value
+            for name in stage.inputs:
+                readers[name] -= 1
+                if readers[name] == 0 and name not in keep:
+                    values.pop(name, None)
+
+        def next_ready():
+            ready = [stage for stage in pending if all(name in values for name in stage.inputs)]
+            for stage in ready:
+                pending.remove(stage)
+            return ready
+
+        if workers <= 1:
+            while pending:
+                ready = next_ready()
+                if not ready:
+                    raise ValueError(f'the stages {[stage.name for stage in pending]} depend on each other')
+                for stage in ready:
+                    finish(stage, call(stage, [values[name] for name in stage.inputs]))
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                running = {}
+                while pending or running:
+                    for stage in next_ready():
+                        running[executor.submit(call, stage, [values[name] for name in stage.inputs])] = stage
+                    if not running:
+                        raise ValueError(f'the stages {[stage.name for stage in pending]} depend on each other')
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        finish(running.pop(future), future.result())
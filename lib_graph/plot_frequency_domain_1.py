@@ -5,20 +5,22 @@
 import numpy as np
 from matplotlib import pyplot as plt
 
+from lib_graph.spectral_cache import SpectralCache
+
 # Define the sampling rate and the EEG data
   # Hz
 
 
-def plot_frequency_domain_1(eeg_data, location='.cache/',  sampling_rate = 256):
+def plot_frequency_domain_1(eeg_data, location='.cache/',  sampling_rate = 256, spectra=None):
 
     file = 'plot_frequency_domain_1.png'
 
-    eeg_signal = eeg_data['electrodes_average'].values
-
-    # Perform FFT
-    n = len(eeg_signal)
-    frequencies = np.fft.rfftfreq(n, d=1/sampling_rate)
-    fft_values = np.abs(np.fft.rfft(eeg_signal))**2  # Power spectrum
+    # Perform FFT (shared through the spectral cache of the session), over the whole data including the gaps
+    # between connected segments
+    if spectra is None:
+        spectra = SpectralCache(eeg_data, sampling_rate)
+    frequencies, fft_values = spectra.spectrum('electrodes_average', 'fft')
+    fft_values = fft_values**2  # Power spectrum
 
     # Define frequency bands
     bands = {
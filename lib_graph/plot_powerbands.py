@@ -4,21 +4,23 @@ from scipy.signal import welch
 
 from scipy.signal import spectrogram
 
-from lib_graph.func_filters import bandpass_filter_filtfilt
+from lib_graph.derived_signals import DerivedSignals
 
 
-def plot_powerbands_1(eeg_data, location='.cache/', sampling_rate = 256):
+def plot_powerbands_1(eeg_data, location='.cache/', sampling_rate = 256, segments=None, derived=None):
 
     file = 'plot_powerbands_1.png'
 
-    eeg_signal = eeg_data['electrodes_average'].values
+    # the filtered signals are shared through the derived signals of the session
+    if derived is None:
+        derived = DerivedSignals(eeg_data, sampling_rate, segments)
 
     # Define the frequency range for the Alpha band (8-13 Hz)
     alpha_low = 8
     alpha_high = 13
 
-    # Apply a bandpass filter to isolate the Alpha band
-    alpha_signal = bandpass_filter_filtfilt(eeg_signal, alpha_low, alpha_high, sampling_rate)
+    # Apply a bandpass filter to isolate the Alpha band (per connected segment, NaN in the gaps)
+    alpha_signal = derived.band_signal('electrodes_average', (alpha_low, alpha_high))
 
     # Plot the Alpha band signal in the time domain
     plt.figure(figsize=(14, 6))
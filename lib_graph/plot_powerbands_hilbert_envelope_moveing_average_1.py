@@ -1,42 +1,38 @@
-import numpy as np
 from matplotlib import pyplot as plt
 from scipy.signal import welch
 
 from scipy.signal import spectrogram
-from scipy.signal import hilbert
 
-from lib_graph.func_filters import bandpass_filter_filtfilt
+from lib_graph.derived_signals import DerivedSignals
+from lib_graph.func_eeg_data import map_segments
+from lib_graph.func_smoothing import moving_average_seconds
 
 
-
-# Define a function for moving average
-def moving_average(data, window_size):
-    return np.convolve(data, np.ones(window_size) / window_size, mode='same')
-
-
-def plot_powerbands_hilbert_envelope_moveing_average_1(eeg_data, location='.cache/', sampling_rate = 256, only_hilbert=True):
+def plot_powerbands_hilbert_envelope_moveing_average_1(eeg_data, location='.cache/', sampling_rate = 256, only_hilbert=True, segments=None, derived=None):
 
     file = 'plot_powerbands_hilbert_envelope_moveing_average_1.png'
 
-    eeg_signal = eeg_data['electrodes_average'].values
+    # the filtered signals are shared through the derived signals of the session
+    if derived is None:
+        derived = DerivedSignals(eeg_data, sampling_rate, segments)
 
     # Define the frequency range for the Alpha band (8-13 Hz)
     alpha_low = 8
     alpha_high = 13
 
-    # Apply a bandpass filter to isolate the Alpha band
-    alpha_signal = bandpass_filter_filtfilt(eeg_signal, alpha_low, alpha_high, sampling_rate)
+    # Apply a bandpass filter to isolate the Alpha band (per connected segment, NaN in the gaps)
+    alpha_signal = derived.band_signal('electrodes_average', (alpha_low, alpha_high))
 
 
     # Calculate the analytical signal using the Hilbert transform
-    analytic_signal = hilbert(alpha_signal)
-    envelope = np.abs(analytic_signal)
+    envelope = derived.envelope('electrodes_average', (alpha_low, alpha_high))
 
 
 
-    # Apply moving average to the envelope to smooth it
-    window_size = 1000  # Adjust this value for more or less smoothing
-    smoothed_envelope = moving_average(envelope, window_size)
+    # Apply moving average to the envelope to smooth it (running sum, so a larger window costs nothing more)
+    window_seconds = 1000 / 256  # Adjust this value for more or less smoothing, the 1000 samples of 256 Hz, also at a lower sampling_rate
+    # the mean at the edges of a segment is over the samples inside the segment, zero padding would pull it down
+    smoothed_envelope = map_segments(envelope, derived.segments, lambda part: moving_average_seconds(part, window_seconds, sample_rate=sampling_rate, edge='shrink'))
 
     # Plot the Alpha band signal with the smoothed envelope
     plt.figure(figsize=(14, 6))
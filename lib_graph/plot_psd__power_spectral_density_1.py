@@ -1,14 +1,16 @@
 from matplotlib import pyplot as plt
-from scipy.signal import welch
 
+from lib_graph.spectral_cache import SpectralCache
 
-def plot_psd__power_spectral_density_1(eeg_data, location='.cache/', sampling_rate = 256):
 
-    file = 'plot_psd__power_spectral_density_1.png'
+def plot_psd__power_spectral_density_1(eeg_data, location='.cache/', sampling_rate = 256, segments=None, spectra=None, nperseg=1024):
 
-    eeg_signal = eeg_data['electrodes_average'].values
+    file = 'plot_psd__power_spectral_density_1.png'
 
-    frequencies, psd = welch(eeg_signal, fs=sampling_rate, nperseg=1024)
+    # with segments no welch segment spans the gaps between the connected segments
+    if spectra is None:
+        spectra = SpectralCache(eeg_data, sampling_rate, segments)
+    frequencies, psd = spectra.spectrum('electrodes_average', 'welch', nperseg=nperseg)
 
     # Plot the Power Spectral Density (PSD)
     plt.figure(figsize=(14, 6))
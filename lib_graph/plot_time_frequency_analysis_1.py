@@ -2,20 +2,25 @@ import numpy as np
 from matplotlib import pyplot as plt
 from scipy.signal import welch
 
-from scipy.signal import spectrogram
+from lib_graph.spectral_cache import SpectralCache
 
-def plot_time_frequency_analysis_1(eeg_data, location='.cache/', sampling_rate = 256):
 
-    file = 'plot_time_frequency_analysis_1.png'
+def plot_time_frequency_analysis_1(eeg_data, location='.cache/', sampling_rate = 256, spectra=None, channels=None):
 
-    eeg_signal = eeg_data['electrodes_average'].values
+    file = 'plot_time_frequency_analysis_1.png'
 
-    # Calculate the spectrogram
-    frequencies, times, Sxx = spectrogram(eeg_signal, fs=sampling_rate, nperseg=512, noverlap=256, nfft=1024)
+    # Calculate the spectrogram, batched with the other channels of the session (see band_power_series)
+    if spectra is None:
+        spectra = SpectralCache(eeg_data, sampling_rate)
+    if channels is None:
+        channels = ['electrodes_average']
+    # the columns across the gaps between the connected segments are NaN and left blank
+    frequencies, times, Sxx = spectra.spectrogram(channels, nperseg=512, noverlap=256, nfft=1024, mask_gaps=True)
+    Sxx = Sxx[channels.index('electrodes_average')]
 
     # Plot the spectrogram
     plt.figure(figsize=(14, 6))
-    plt.pcolormesh(times, frequencies, 10 * np.log10(Sxx), shading='gouraud')
+    plt.pcolormesh(times, frequencies, np.ma.masked_invalid(10 * np.log10(Sxx)), shading='gouraud')
     plt.title('Spectrogram of EEG Signal - TP9')
     plt.ylabel('Frequency (Hz)')
     plt.xlabel('Time (s)')
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+# Maximum size of all cached recordings together, the least recently used are removed first
+CACHE_SIZE_LIMIT = 4 * 1024 ** 3  # bytes
+
+
+def recording_fingerprint(filename, zip_ref):
+    """
+    Fingerprint of a recording zip, used as the cache key.
+
+    The content hash is built from the name, size and CRC32 of every member as stored in the zip central
+    directory, so the compressed data does not have to be read to detect a changed recording.
+
+    Parameters:
+    - filename: str, path to the ZIP file.
+    - zip_ref: ZipFile, the opened archive.
+
+    Returns:
+    - fingerprint: str, hex digest.
+    """
+    stat = os.stat(filename)
+    content = hashlib.sha1()
+    for info in zip_ref.infolist():
+        content.update(f'{info.filename}:{info.file_size}:{info.CRC};'.encode('utf-8'))
+
+    key = f'{os.path.abspath(filename)}|{stat.st_size}|{stat.st_mtime_ns}|{content.hexdigest()}'
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+class SampleCache:
+    """
+    Cache of decoded recordings. Every stream (eeg, signal_quality) of a recording is stored as a .npy file of shape
+    (n_samples, n_columns) next to a small .json with the column names, and is memory-mapped when it is read again.
+    The file modification time is used as the last access time for the LRU eviction.
+    """
+
+    def __init__(self, cache_dir='cache/_samples', size_limit=CACHE_SIZE_LIMIT):
+        self.cache_dir = cache_dir
+        self.size_limit = size_limit
+
+    def _paths(self, fingerprint, stream):
+        base = f'{self.cache_dir}/{fingerprint}_{stream}'
+        return f'{base}.npy', f'{base}.json'
+
+    def load(self, fingerprint, stream):
+        """
+        Memory-map a cached stream.
+
+        Returns:
+        - samples: read-only np.memmap of shape (n_samples, n_columns), or None if the stream is not cached.
+        - columns: list of str, the column names (None if not cached).
+        """
+        npy_file, json_file = self._paths(fingerprint, stream)
+        try:
+            with open(json_file, 'r', encoding='utf-8') as f:
+                columns = json.load(f)['columns']
+            samples = np.load(npy_file, mmap_mode='r')
+        except (OSError, ValueError, KeyError):
+            return None, None
+
+        # mark as recently used
+        os.utime(npy_file)
+
+        return samples, columns
+
+    def store(self, fingerprint, stream, samples, columns):
+        """
+        Write a decoded stream to the cache and evict the least recently used entries if the cache is too big.
+
+        Parameters:
+        - fingerprint: str, see recording_fingerprint().
+        - stream: str, 'eeg' or 'signal_quality'.
+        - samples: ndarray of shape (n_samples, n_columns).
+        - columns: list of str, the column names.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        npy_file, json_file = self._paths(fingerprint, stream)
+
+        # write to a temporary file first, so a crash never leaves a truncated entry behind
+        with open(f'{npy_file}.tmp', 'wb') as f:
+            np.save(f, np.ascontiguousarray(samples))
+        with open(json_file, 'w', encoding='utf-8') as f:
+            json.dump({'columns': list(columns)}, f)
+        os.replace(f'{npy_file}.tmp', npy_file)
+
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache is smaller than size_limit.
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.npy'):
+                try:
+                    stat = os.stat(f'{self.cache_dir}/{name}')
+                except FileNotFoundError:
+                    # evicted by another process in the meantime
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total_size <= self.size_limit:
+                break
+            base = os.path.splitext(name)[0]
+            for file in (f'{base}.npy', f'{base}.json'):
+                try:
+                    os.remove(f'{self.cache_dir}/{file}')
+                except OSError:
+                    pass
+            total_size -= size
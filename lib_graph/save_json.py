@@ -1,5 +1,19 @@
 import json
 
+import numpy as np
+import pandas as pd
+
+
+def json_default(value):
+    # numpy values and the DataFrame tables of the statistics, json.dump calls this for every unknown type
+    if isinstance(value, pd.DataFrame):
+        return value.to_dict(orient='index')
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
 
 def save_dict_to_json_pretty(dict_to_save, filename, location='cache'):
     """
@@ -12,7 +26,7 @@ def save_dict_to_json_pretty(dict_to_save, filename, location='cache'):
         with open(f'{location}/{filename}', 'w', encoding='utf-8') as file:
             # Using indent for pretty print, sort_keys to sort the keys,
             # and ensure_ascii=False to allow non-ASCII characters
-            json.dump(dict_to_save, file, indent=4, sort_keys=True, ensure_ascii=False)
+            json.dump(dict_to_save, file, indent=4, sort_keys=True, ensure_ascii=False, default=json_default)
             # Add newline at the end of the file for better readability in some editors
             file.write('\n')
     except IOError as e:
@@ -0,0 +1,155 @@
+import numpy as np
+from scipy import signal
+
+from lib_graph.func_spectral import PsdPyramid, amplitude_spectrum, fft_resolution, stft_valid_columns, welch_segments
+
+
+class SpectralCache:
+    """
+    The spectra of one session. The plots and statistics request their spectra from here instead of computing them
+    on their own, so every distinct transform is computed once per session and shared.
+
+    Spectra are keyed by (channel, method, nperseg, window, noverlap):
+    - 'fft': amplitude spectrum |rfft| of the (windowed) channel.
+    - 'welch': Welch PSD of the channel.
+
+    With segments (see connected_segments) the gaps between the segments are handled per kind of spectrum:
+    - 'welch': no Welch segment spans a gap.
+    - segment_spectra(): the amplitude spectrum of every segment on its own, used by the peak alpha statistics
+      instead of 'fft'.
+    - 'fft': transforms the whole channel across the gaps, only for the overview of plot_frequency_domain_1.
+    - spectrogram(): with mask_gaps the columns across a gap are NaN, the pyramid and the trajectory skip them
+      on their own.
+
+    spectrogram() computes one batched STFT of several channels, e.g. for the band power time series
+    (see band_power_series).
+
+    With fast_length the FFTs are zero padded to a fast length (see fft_length), fft_resolution() reports the
+    resulting bin spacing.
+
+    Usage:
+        spectra = SpectralCache(eeg_data, sample_rate=256, segments=segments)
+        freqs, psd = spectra.spectrum('tp9', 'welch', nperseg=1024)
+    """
+
+    def __init__(self, eeg_data, sample_rate=256, segments=None, fast_length=False):
+        self.eeg_data = eeg_data
+        self.sample_rate = sample_rate
+        self.segments = segments
+        self.fast_length = fast_length
+        self._spectra = {}
+
+    def spectrum(self, channel, method='fft', nperseg=None, window=None, noverlap=None):
+        """
+        Parameters:
+        - channel: str, a column of the EEG data (e.g. 'tp9' or 'electrodes_average').
+        - method: str, 'fft' or 'welch'.
+        - nperseg: int, length of a Welch segment (welch only, default 256).
+        - window: str, window applied before the FFT (fft, default None: no window) or the Welch window
+          (welch, default 'hann').
+        - noverlap: int, overlap of the Welch segments (welch only, default nperseg // 2).
+
+        Returns:
+        - freqs: ndarray, the frequencies.
+        - values: ndarray, the amplitude spectrum (fft) or the PSD (welch).
+        """
+        if method == 'welch':
+            nperseg = 256 if nperseg is None else nperseg
+            window = 'hann' if window is None else window
+            noverlap = nperseg // 2 if noverlap is None else noverlap
+        elif method != 'fft':
+            raise ValueError("Invalid method. Use 'fft' or 'welch'.")
+
+        key = (channel, method, nperseg, window, noverlap)
+        if key not in self._spectra:
+            channel_data = self.eeg_data[channel].values
+            if method == 'fft':
+                self._spectra[key] = self._amplitude_spectrum(channel_data, window)
+            elif self.segments is None:
+                self._spectra[key] = signal.welch(channel_data, self.sample_rate, window=window, nperseg=nperseg, noverlap=noverlap)
+            else:
+                self._spectra[key] = welch_segments(channel_data, self.segments, self.sample_rate, nperseg=nperseg, noverlap=noverlap, window=window)
+
+        return self._spectra[key]
+
+    def segment_spectra(self, channel, window=None):
+        """
+        The amplitude spectrum of every segment on its own (see SpectralCache.segments).
+
+        Returns:
+        - spectra: list of (freqs, amplitudes, n_samples), one per segment.
+        """
+        key = (channel, 'segment_fft', None, window, None)
+        if key not in self._spectra:
+            channel_data = self.eeg_data[channel].values
+            self._spectra[key] = [self._amplitude_spectrum(channel_data[start:stop], window) + (stop - start,)
+                                  for start, stop in self.segments]
+
+        return self._spectra[key]
+
+    def spectrogram(self, channels, nperseg=512, noverlap=256, nfft=1024, window=('tukey', 0.25), mask_gaps=False):
+        """
+        The spectrogram of several channels from one batched STFT over the whole data.
+
+        Parameters:
+        - channels: list of str, columns of the EEG data.
+        - nperseg: int, length of an STFT segment in samples.
+        - noverlap: int, overlap of the STFT segments.
+        - nfft: int, FFT length of a segment (zero padded).
+        - window: str or tuple, the window of the STFT segments (default of scipy.signal.spectrogram).
+        - mask_gaps: bool, with segments the columns that do not lie completely inside one segment are NaN (see
+          stft_valid_columns). Without, they are transformed across the gaps, e.g. for the pyramid and the
+          trajectory that skip these columns on their own.
+
+        Returns:
+        - freqs: ndarray, the frequencies.
+        - times: ndarray, the segment centers in seconds.
+        - Sxx: ndarray of shape (n_channels, n_freqs, n_times), the power spectral density.
+        """
+        key = (tuple(channels), 'spectrogram', nperseg, (nfft, window), noverlap)
+        if key not in self._spectra:
+            channels_first = self.eeg_data[channels].to_numpy().T
+            self._spectra[key] = signal.spectrogram(channels_first, fs=self.sample_rate, window=window, nperseg=nperseg,
+                                                    noverlap=noverlap, nfft=nfft, axis=-1)
+        if not mask_gaps or self.segments is None:
+            return self._spectra[key]
+
+        masked_key = key + ('masked',)
+        if masked_key not in self._spectra:
+            freqs, times, Sxx = self._spectra[key]
+            valid = stft_valid_columns(Sxx.shape[-1], nperseg - noverlap, nperseg, self.segments)
+            self._spectra[masked_key] = freqs, times, np.where(valid, Sxx, np.nan)
+
+        return self._spectra[masked_key]
+
+    def psd_pyramid(self, channels, base_length=10, nperseg=1024, noverlap=None):
+        """
+        The PsdPyramid of several channels, for the Welch PSDs of periods of any multiple of base_length seconds.
+        It is built from the hann spectrogram (see spectrogram) that calculate_peak_alpha_trajectory uses as well.
+
+        Parameters:
+        - channels: list of str, columns of the EEG data.
+        - base_length: int, the base block length in seconds.
+        - nperseg: int, length of a Welch segment in samples.
+        - noverlap: int, overlap of the Welch segments (default nperseg // 2).
+        """
+        noverlap = nperseg // 2 if noverlap is None else noverlap
+        key = (tuple(channels), 'pyramid', nperseg, base_length, noverlap)
+        if key not in self._spectra:
+            freqs, _, Sxx = self.spectrogram(channels, nperseg=nperseg, noverlap=noverlap, nfft=nperseg, window='hann')
+            self._spectra[key] = PsdPyramid(freqs, Sxx, len(self.eeg_data), base_length * self.sample_rate, nperseg,
+                                            nperseg - noverlap, self.segments)
+
+        return self._spectra[key]
+
+    def fft_resolution(self):
+        """
+        Returns:
+        - resolution: list of dict, the resolution (see fft_resolution) of the FFT of the whole data, or of every
+          segment with segments.
+        """
+        lengths = [len(self.eeg_data)] if self.segments is None else [stop - start for start, stop in self.segments]
+        return [fft_resolution(n_samples, self.sample_rate, self.fast_length) for n_samples in lengths]
+
+    def _amplitude_spectrum(self, channel_data, window):
+        return amplitude_spectrum(channel_data, self.sample_rate, window, self.fast_length)
@@ -0,0 +1,47 @@
+import io
+import os
+import sys
+import zipfile
+
+import matplotlib
+import numpy as np
+import pytest
+
+# the plots are written to files only
+matplotlib.use('Agg')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def make_recording():
+    """
+    Write a recording zip like the ones of the muse-eeg-osc-recorder: 10 Hz alpha with noise on all electrodes,
+    the electrodes are not connected during the first 20s and the last 5s.
+
+    Returns:
+    - make: callable(path, seconds, sample_rate=256), writes the zip and returns path.
+    """
+    def make(path, seconds, sample_rate=256):
+        rng = np.random.default_rng(0)
+        n = seconds * sample_rate
+        t = np.arange(n) / sample_rate
+        eeg = 800 + 20 * np.sin(2 * np.pi * 10 * t)[:, None] + rng.normal(0, 10, (n, 4))
+        signal_quality = np.ones((n, 5), dtype=int)
+        signal_quality[:20 * sample_rate, 1:] = 4
+        signal_quality[-5 * sample_rate:, 1:] = 4
+
+        eeg_csv = io.StringIO('tp9,af7,af8,tp10\n')
+        eeg_csv.seek(0, io.SEEK_END)
+        np.savetxt(eeg_csv, eeg, fmt='%.3f', delimiter=',')
+        signal_quality_csv = io.StringIO('signal_is_good,signal_quality_tp9,signal_quality_af7,signal_quality_af8,signal_quality_tp10\n')
+        signal_quality_csv.seek(0, io.SEEK_END)
+        np.savetxt(signal_quality_csv, signal_quality, fmt='%d', delimiter=',')
+
+        name = os.path.splitext(os.path.basename(path))[0]
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+            zip_ref.writestr(f'{name}_eeg.csv', eeg_csv.getvalue())
+            zip_ref.writestr(f'{name}_signal_quality.csv', signal_quality_csv.getvalue())
+        return path
+
+    return make
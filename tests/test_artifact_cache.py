@@ -0,0 +1,44 @@
+import os
+
+from lib_graph.artifact_cache import ArtifactCache, _package_modules, artifact_key, code_version
+from lib_graph.calculate_peak_alpha import calculate_peak_alpha_welch
+from lib_graph.func_spectral import band_power_series
+from lib_graph.plot_frequency_domain_1 import plot_frequency_domain_1
+
+
+def helper():
+    return 1
+
+
+def test_artifact_key_changes_with_upstream_code_and_settings():
+    key = artifact_key('session', plot_frequency_domain_1, {'sampling_rate': 256})
+
+    assert key == artifact_key('session', plot_frequency_domain_1, {'sampling_rate': 256})
+    assert key != artifact_key('other session', plot_frequency_domain_1, {'sampling_rate': 256})
+    assert key != artifact_key('session', band_power_series, {'sampling_rate': 256})
+    assert key != artifact_key('session', plot_frequency_domain_1, {'sampling_rate': 128})
+
+
+def test_code_version_covers_the_imported_modules():
+    # BANDS and the spectra of calculate_peak_alpha come from func_spectral
+    assert 'lib_graph.func_spectral' in _package_modules('lib_graph.calculate_peak_alpha')
+    assert code_version(calculate_peak_alpha_welch) != code_version(helper)
+    assert code_version(helper, calculate_peak_alpha_welch) == code_version(calculate_peak_alpha_welch, helper)
+
+
+def test_link_and_lookup_only_find_stored_artifacts(tmp_path):
+    artifacts = ArtifactCache(str(tmp_path / 'artifacts'))
+
+    assert not artifacts.link('a' * 40, str(tmp_path / 'plot.png'))
+    assert artifacts.lookup('b' * 40) is None
+
+    def build():
+        with open(tmp_path / 'plot.png', 'w') as f:
+            f.write('png')
+    assert artifacts.file('a' * 40, str(tmp_path / 'plot.png'), build)
+    assert artifacts.value('b' * 40, lambda: {'peak': 10.0}) == {'peak': 10.0}
+
+    os.remove(tmp_path / 'plot.png')
+    assert artifacts.link('a' * 40, str(tmp_path / 'plot.png'))
+    assert (tmp_path / 'plot.png').read_text() == 'png'
+    assert artifacts.lookup('b' * 40) == {'peak': 10.0}
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from lib_graph.calculate_peak_alpha import aggregate_peak_alpha_trajectory, calculate_peak_alpha_trajectory, \
+    calculate_periods_peak_alpha_welch
+
+
+def eeg(seconds, sample_rate=256):
+    # alpha peaks that differ between the channels, with noise
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    data = {channel: 20 * np.sin(2 * np.pi * frequency * t) + rng.normal(0, 5, len(t))
+            for channel, frequency in zip(['tp9', 'af7', 'af8', 'tp10'], [9.5, 10, 10.5, 11])}
+    return pd.DataFrame(dict(data, time_seconds=t))
+
+
+@pytest.mark.parametrize('seconds', [600, 650, 700.5])
+def test_aggregated_periods_match_the_periodic_results(seconds):
+    eeg_data = eeg(seconds)
+
+    periodic = calculate_periods_peak_alpha_welch(eeg_data, periode_length=300, nperseg=1024)
+    trajectory = calculate_peak_alpha_trajectory(eeg_data, window_length=60, hop=10, nperseg=1024)
+    aggregated = aggregate_peak_alpha_trajectory(trajectory, periode_length=300)
+
+    assert [(period['periode_start'], period['periode_length']) for period in aggregated] == \
+           [(period['periode_start'], period['periode_length']) for period in periodic]
+    for expected, period in zip(periodic, aggregated):
+        for channel, peak in period['peak_aplhas'].items():
+            assert peak == pytest.approx(expected['peak_aplhas'][channel], abs=0.25)
+
+
+def test_short_last_period_without_window_center_has_no_peaks():
+    eeg_data = eeg(610)
+
+    trajectory = calculate_peak_alpha_trajectory(eeg_data, window_length=60, hop=10, nperseg=1024)
+    aggregated = aggregate_peak_alpha_trajectory(trajectory, periode_length=300)
+
+    assert [period['periode_length'] for period in aggregated] == [300, 300, 10]
+    assert aggregated[-1]['mean_peak_alpha'] is None
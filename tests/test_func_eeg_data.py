@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from lib_graph.func_eeg_data import remove_non_connected_electrode_parts
+
+
+def baseline_remove_non_connected_electrode_parts(eeg_data, signal_quality_data, ignored_electrodes=None, truncate_only_beginning_and_end=True):
+    # the implementation with merge_asof that remove_non_connected_electrode_parts replaces, as the reference
+    if ignored_electrodes is None:
+        ignored_electrodes = []
+
+    merged_data = pd.merge_asof(eeg_data.sort_values('time_seconds'), signal_quality_data.sort_values('time_seconds'),
+                                on='time_seconds', direction='nearest')
+
+    electrodes = [electrode for electrode in ['tp9', 'af7', 'af8', 'tp10'] if electrode not in ignored_electrodes]
+    non_connected = merged_data[[f'signal_quality_{electrode}' for electrode in electrodes]].gt(1).any(axis=1)
+
+    if truncate_only_beginning_and_end:
+        first_good_index = non_connected.idxmin()
+        last_good_index = non_connected[::-1].idxmin() + 1
+        eeg_data_filtered = merged_data.iloc[first_good_index:last_good_index].copy()
+    else:
+        eeg_data_filtered = merged_data[~non_connected].copy()
+
+    signal_quality_columns = [col for col in merged_data.columns if 'signal_quality' in col]
+    signal_quality_data_filtered = eeg_data_filtered[signal_quality_columns + ['time_seconds']].copy()
+    eeg_data_filtered.drop(columns=signal_quality_columns, inplace=True)
+
+    return eeg_data_filtered, signal_quality_data_filtered
+
+
+def recording(n, start=300 * 256, signal_quality_start=None, bad=(), signal_quality_gap=None, seed=0):
+    # eeg and signal quality data like the loaders return them, bad: (from, to, electrode column) rows not connected
+    rng = np.random.default_rng(seed)
+    samples = np.arange(start, start + n)
+    eeg_data = pd.DataFrame(rng.normal(size=(n, 4)), columns=['tp9', 'af7', 'af8', 'tp10'], index=samples)
+    eeg_data['time_seconds'] = samples / 256
+
+    signal_quality_start = start if signal_quality_start is None else signal_quality_start
+    samples = np.arange(signal_quality_start, signal_quality_start + n)
+    signal_quality_data = pd.DataFrame(np.ones((n, 5), dtype=np.int64), index=samples,
+                                       columns=['signal_is_good', 'signal_quality_tp9', 'signal_quality_af7', 'signal_quality_af8', 'signal_quality_tp10'])
+    for first, last, column in bad:
+        signal_quality_data.iloc[first:last, column] = 4
+    signal_quality_data['sample_number'] = samples
+    signal_quality_data['time_seconds'] = samples / 256
+    if signal_quality_gap is not None:
+        signal_quality_data = signal_quality_data.drop(signal_quality_data.index[signal_quality_gap[0]:signal_quality_gap[1]])
+
+    return eeg_data, signal_quality_data
+
+
+CASES = {
+    'connected': recording(5000),
+    'edges': recording(5000, bad=[(0, 300, 1), (4800, 5000, 2)]),
+    'middle': recording(5000, bad=[(0, 100, 1), (2000, 2500, 3), (4900, 5000, 4)]),
+    'ignored electrode': recording(5000, bad=[(0, 800, 1), (1000, 1200, 2)]),
+    'shifted signal quality': recording(5000, signal_quality_start=299 * 256, bad=[(0, 600, 1), (3000, 3100, 2)]),
+    'gap in the signal quality': recording(5000, bad=[(0, 200, 3)], signal_quality_gap=(1000, 1300)),
+    # the signal quality of the report ends before the EEG data starts, all samples match its last row
+    'signal quality before the eeg': recording(5000, signal_quality_start=65 * 256, bad=[(4990, 5000, 1)]),
+}
+
+
+@pytest.mark.parametrize('truncate_only_beginning_and_end', [True, False])
+@pytest.mark.parametrize('case', CASES)
+def test_same_frames_as_the_merge_asof_baseline(case, truncate_only_beginning_and_end):
+    eeg_data, signal_quality_data = CASES[case]
+    ignored_electrodes = ['tp9'] if case == 'ignored electrode' else None
+
+    expected = baseline_remove_non_connected_electrode_parts(eeg_data.copy(), signal_quality_data.copy(), ignored_electrodes, truncate_only_beginning_and_end)
+    result = remove_non_connected_electrode_parts(eeg_data.copy(), signal_quality_data.copy(), ignored_electrodes, truncate_only_beginning_and_end)
+
+    pd.testing.assert_frame_equal(result[0], expected[0])
+    pd.testing.assert_frame_equal(result[1], expected[1])
+
+
+def test_keeps_the_data_if_no_sample_is_connected():
+    eeg_data, signal_quality_data = recording(1000, bad=[(0, 1000, 2)])
+
+    eeg_data_filtered, signal_quality_data_filtered = remove_non_connected_electrode_parts(eeg_data, signal_quality_data)
+
+    assert len(eeg_data_filtered) == len(signal_quality_data_filtered) == 1000
+    np.testing.assert_array_equal(eeg_data_filtered['tp9'].to_numpy(), eeg_data['tp9'].to_numpy())
+
+
+def test_accepts_the_sampling_frequencies_positionally():
+    eeg_data, signal_quality_data = CASES['edges']
+
+    expected = remove_non_connected_electrode_parts(eeg_data, signal_quality_data, None, True)
+    result = remove_non_connected_electrode_parts(eeg_data, signal_quality_data, None, True, 256, 256)
+    keywords = remove_non_connected_electrode_parts(eeg_data, signal_quality_data, sample_frequency_data=256, sample_frequency_signal_quality=256)
+
+    pd.testing.assert_frame_equal(result[0], expected[0])
+    pd.testing.assert_frame_equal(keywords[1], expected[1])
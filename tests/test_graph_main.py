@@ -0,0 +1,120 @@
+import json
+import os
+
+import pytest
+
+import graph_main
+from lib_graph.load_recording import MuseRecording
+
+
+FILE = 'session.zip'
+SETTINGS = {'load_from': 0, 'load_until': 400, 'periode_lengths': (60,)}
+
+
+@pytest.fixture(scope='module')
+def session(tmp_path_factory):
+    # one report that every test builds on, the artifacts of the tests do not overwrite each other
+    base = tmp_path_factory.mktemp('session')
+    os.makedirs(base / 'out_eeg')
+    return base
+
+
+@pytest.fixture
+def report(session, make_recording, monkeypatch):
+    if not os.path.exists(session / 'out_eeg' / FILE):
+        make_recording(str(session / 'out_eeg' / FILE), 420)
+    # the report of the unchanged code, only built the first time
+    build(session)
+
+    eeg_reads = []
+    read_eeg = MuseRecording.read_eeg
+    def counted_read_eeg(self, *args, **kwargs):
+        eeg_reads.append(self.filename)
+        return read_eeg(self, *args, **kwargs)
+    monkeypatch.setattr(MuseRecording, 'read_eeg', counted_read_eeg)
+
+    return session, eeg_reads
+
+
+def build(base):
+    statistics = graph_main.generate_img_report_for(FILE, str(base / 'cache'), str(base / 'out_eeg'), **SETTINGS)
+    assert statistics
+    return statistics
+
+
+def report_files(base):
+    # report file -> inode, a linked artifact keeps the inode of the cached file, a built one gets a new one
+    report_dir = base / 'cache' / 'session'
+    return {name: os.stat(report_dir / name).st_ino for name in os.listdir(report_dir) if name != 'statistics.json'}
+
+
+def rebuilt(before, after):
+    assert before.keys() == after.keys()
+    return sorted(name for name in before if before[name] != after[name])
+
+
+def test_unchanged_report_links_every_artifact_without_loading_the_eeg(report):
+    base, eeg_reads = report
+    with open(base / 'cache' / 'session' / 'statistics.json') as f:
+        statistics = json.load(f)
+    before = report_files(base)
+
+    build(base)
+
+    assert rebuilt(before, report_files(base)) == []
+    assert eeg_reads == []
+    with open(base / 'cache' / 'session' / 'statistics.json') as f:
+        assert json.load(f) == statistics
+
+
+def test_changed_plot_only_rebuilds_that_plot(report, monkeypatch):
+    base, eeg_reads = report
+    plot = graph_main.plot_frequency_domain_1
+    def plot_frequency_domain_1(*args, **kwargs):
+        # a new version of the plot
+        return plot(*args, **kwargs)
+    monkeypatch.setattr(graph_main, 'plot_frequency_domain_1', plot_frequency_domain_1)
+    before = report_files(base)
+
+    build(base)
+
+    assert rebuilt(before, report_files(base)) == ['plot_frequency_domain_1.png']
+    assert len(eeg_reads) == 1
+
+
+def test_changed_moving_average_plot_rebuilds_the_icon(report, monkeypatch):
+    base, _ = report
+    plot = graph_main.plot_powerbands_hilbert_envelope_moveing_average_1
+    def plot_powerbands_hilbert_envelope_moveing_average_1(*args, **kwargs):
+        # a new version of the plot
+        return plot(*args, **kwargs)
+    monkeypatch.setattr(graph_main, 'plot_powerbands_hilbert_envelope_moveing_average_1', plot_powerbands_hilbert_envelope_moveing_average_1)
+    before = report_files(base)
+
+    build(base)
+
+    assert rebuilt(before, report_files(base)) == ['icon.png', 'plot_powerbands_hilbert_envelope_moveing_average_1.png']
+
+
+def test_changed_session_code_rebuilds_every_artifact(report, monkeypatch):
+    base, _ = report
+    def prepare():
+        # a new version of the data preparation
+        pass
+    monkeypatch.setattr(graph_main, 'SESSION_CODE', graph_main.SESSION_CODE + (prepare,))
+    before = report_files(base)
+
+    build(base)
+
+    assert rebuilt(before, report_files(base)) == sorted(before)
+
+
+def test_manifest_changes_with_the_report_code(monkeypatch):
+    settings = dict(SETTINGS, fast_fft=False, analysis_rate=None)
+    parameters = graph_main.manifest_parameters(settings)
+    def plot_frequency_domain_1(*args, **kwargs):
+        # a new version of the plot
+        pass
+    monkeypatch.setattr(graph_main, 'REPORT_CODE', graph_main.REPORT_CODE + (plot_frequency_domain_1,))
+
+    assert graph_main.manifest_parameters(settings) != parameters
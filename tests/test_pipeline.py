@@ -0,0 +1,26 @@
+from lib_graph.pipeline import Pipeline
+
+
+def test_lookup_skips_the_stage_and_its_inputs():
+    calls = []
+    cache = {'cached': 'from cache'}
+
+    def stage(name, result):
+        def function(*_):
+            calls.append(name)
+            return result
+        return function
+
+    pipeline = Pipeline()
+    pipeline.add('load', stage('load', 'data'), outputs='data')
+    pipeline.add('cached_key', stage('cached_key', 'cached'))
+    pipeline.add('cached', stage('cached', 'built'), ['cached_key', 'data'], lookup=cache.get, lookup_inputs=['cached_key'])
+    pipeline.add('missing_key', stage('missing_key', 'missing'))
+    pipeline.add('missing', stage('missing', 'built'), ['missing_key', 'data'], lookup=cache.get, lookup_inputs=['missing_key'])
+
+    assert pipeline.run(['cached']) == {'cached': 'from cache'}
+    assert calls == ['cached_key']
+
+    calls.clear()
+    assert pipeline.run(['cached', 'missing']) == {'cached': 'from cache', 'missing': 'built'}
+    assert sorted(calls) == ['cached_key', 'load', 'missing', 'missing_key']